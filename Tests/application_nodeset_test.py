@@ -24,10 +24,15 @@ import logging
 import sys
 from typing import Dict, Tuple, List
 import queue
+import time
+import threading
+from concurrent import futures
 
 from pyzwaver import zmessage
 from pyzwaver.command_translator import CommandTranslator
-from pyzwaver.node import Nodeset, Node
+from pyzwaver.node import Nodeset, Node, InterviewScheduler
+from pyzwaver import node as znode
+from pyzwaver import command
 from pyzwaver import zwave as z
 
 
@@ -44,6 +49,637 @@ class FakeDriver(object):
         print(m)
 
 
+def TestEndpoints():
+    fake_driver = FakeDriver()
+    translator = CommandTranslator(fake_driver)
+    nodeset = Nodeset(translator, 1)
+    node = nodeset.GetNode(3)
+    node.put(0, z.Version_CommandClassReport, {"class": z.MultiChannel, "version": 3})
+    for e in [1, 2, 3, 9]:
+        node.put(0, z.MultiChannel_CapabilityReport,
+                 {"endpoint": e, "generic": 0x10, "specific": 1,
+                  "classes": [z.SwitchBinary, z.Mark, z.Basic]})
+    assert sorted(node.endpoints) == [1, 2, 3, 9]
+    assert node.EndpointValues(2).HasCommandClass(z.SwitchBinary)
+    assert not node.EndpointValues(2).HasCommandClass(z.Basic)
+
+    # inbound report from endpoint 2
+    data = [z.MultiChannel, z.MultiChannel_ChannelEncap[1], 2, 0, z.SwitchBinary, 3, 0xff]
+    translator.put(1, zmessage.MakeRawMessage(z.API_APPLICATION_COMMAND_HANDLER,
+                                              [0, 3, len(data)] + data))
+    assert node.EndpointValues(2).Get(z.SwitchBinary_Report) == {"level": 0xff}
+    assert node.values.Get(z.SwitchBinary_Report) is None
+
+    # queries are sent to each endpoint
+    fake_driver.history = []
+    node.BatchCommandSubmitEndpoints([1, 2, 3, 9], [(z.SwitchBinary_Get, {}), (z.Basic_Get, {})],
+                                     zmessage.NodePriorityLo(3), 0)
+    dsts = [m.payload[9] for m in fake_driver.history]
+    assert dsts == [1, 2, 3, 9], dsts
+
+    # for Sets endpoints 1-3 share one bit addressed frame, endpoint 9 needs its own
+    fake_driver.history = []
+    node.BatchCommandSubmitEndpoints([1, 2, 3, 9], [(z.SwitchBinary_Set, {"level": 0})],
+                                     zmessage.NodePriorityLo(3), 0)
+    dsts = [m.payload[9] for m in fake_driver.history]
+    assert dsts == [0x87, 9], dsts
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def TestInterviewScheduler():
+    fake_driver = FakeDriver()
+    translator = CommandTranslator(fake_driver)
+    clock = FakeClock()
+    scheduler = InterviewScheduler(max_active=2, timeout=10, max_backoff=25, clock=clock)
+    nodeset = Nodeset(translator, 1, scheduler)
+    for n, flags in [(2, set()), (3, {"listening"}), (4, {"listening"})]:
+        node = nodeset.GetNode(n)
+        node.put(0, command.CUSTOM_COMMAND_PROTOCOL_INFO,
+                 {"protocol_version": 4, "flags": flags, "device_type": (4, 0x10, 1)})
+        node.put(0, z.Version_CommandClassReport, {"class": z.ManufacturerSpecific, "version": 1})
+
+    def Started():
+        nodes = []
+        for m in fake_driver.history:
+            if m.node not in nodes:
+                nodes.append(m.node)
+        fake_driver.history = []
+        return nodes
+
+    # battery node 2 has to wait for the listening ones
+    Started()
+    for n in [4, 2, 3]:
+        nodeset.GetNode(n).MaybeChangeState(znode.NODE_STATE_DISCOVERED)
+    assert Started() == [4, 3]
+    nodeset.put(4, 1, z.ManufacturerSpecific_Report, {"manufacturer": 1, "type": 2, "product": 3})
+    assert nodeset.GetNode(4).IsInterviewed()
+    assert Started() == []
+
+    # node 3 gets stuck and is retried after a backoff, node 2 takes its slot
+    clock.now += 11
+    scheduler.Tick()
+    assert Started() == [2]
+    progress = scheduler.Progress()
+    assert progress[3][:2] == (znode.INTERVIEW_BACKOFF, 1)
+    assert progress[4] == (znode.INTERVIEW_DONE, 0, 100.0)
+    assert progress[2][0] == znode.INTERVIEW_ACTIVE
+    clock.now += 20
+    scheduler.Tick()
+    assert Started() == [3]
+    # second failure: backoff is capped at 25 secs
+    clock.now += 11
+    scheduler.Tick()
+    assert Started() == []
+    assert scheduler.Progress()[3][:2] == (znode.INTERVIEW_BACKOFF, 2)
+    clock.now += 10
+    scheduler.Tick()
+    assert Started() == [2]
+    clock.now += 15
+    scheduler.Tick()
+    assert Started() == [3]
+    assert scheduler.durations == {4: 0}
+    print(scheduler)
+
+
+def TestVersionProbes():
+    fake_driver = FakeDriver()
+    translator = CommandTranslator(fake_driver)
+    nodeset = Nodeset(translator, 1)
+
+    def Probed():
+        out = []
+        for m in fake_driver.history:
+            if m.payload[3] != z.API_ZW_SEND_DATA:
+                continue
+            data = list(m.payload[6:6 + m.payload[5]])
+            if (data[0], data[1]) == z.Version_CommandClassGet:
+                out.append(data[2])
+        fake_driver.history = []
+        return out
+
+    node = nodeset.GetNode(2)
+    node.InitializeUnversioned([z.SwitchBinary, z.Version, z.Hail, z.ManufacturerSpecific],
+                               [z.Basic, z.SceneActivation], [z.SwitchBinary], [])
+    node.RefreshStaticValues()
+    # control only classes and single version classes are not probed
+    assert Probed() == [z.SwitchBinary, z.Version, z.ManufacturerSpecific]
+    assert node.values.CommandVersion(z.Hail) == 1
+    assert node.values.CommandVersion(z.SceneActivation) == -1
+
+    # known versions are not probed again unless forced
+    node.put(0, z.Version_CommandClassReport, {"class": z.SwitchBinary, "version": 2})
+    assert node.PlanVersionProbes() == [z.Version, z.ManufacturerSpecific]
+    node.RefreshAllCommandVersions()
+    assert Probed() == [z.SwitchBinary, z.Version, z.ManufacturerSpecific]
+
+    # without the Version class everything is version 1
+    node = nodeset.GetNode(3)
+    node.InitializeUnversioned([z.SwitchBinary, z.Basic], [], [], [])
+    assert node.PlanVersionProbes() == []
+    assert node.values.CommandVersion(z.SwitchBinary) == 1
+
+
+def SentCommands(fake_driver):
+    out = []
+    for m in fake_driver.history:
+        if m.payload[3] == z.API_ZW_SEND_DATA:
+            out.append(command.ParseCommand(list(m.payload[6:6 + m.payload[5]])))
+    fake_driver.history = []
+    return out
+
+
+def TestParameterDiscovery():
+    fake_driver = FakeDriver()
+    translator = CommandTranslator(fake_driver)
+    nodeset = Nodeset(translator, 1)
+    product = {"manufacturer": 1, "type": 2, "product": 3}
+
+    # version 3: the node enumerates its parameters
+    node = nodeset.GetNode(2)
+    node.put(0, z.Version_CommandClassReport, {"class": z.Configuration, "version": 3})
+    node.put(0, z.ManufacturerSpecific_Report, product)
+    node.state = znode.NODE_STATE_INTERVIEWED
+    fake_driver.history = []
+    node.RefreshAllParameters()
+    assert SentCommands(fake_driver) == [{"parameter": 0}]
+    no_props = {"size": 0, "format": 0, "flags": 0, "min": 0, "max": 0, "default": 0}
+    props = {"size": 1, "format": 0, "flags": 0, "min": 0, "max": 99, "default": 5}
+    node.put(0, z.Configuration_PropertiesReport, {"parameter": 0, "properties": no_props, "next": 3})
+    assert SentCommands(fake_driver) == [{"parameter": 3}]
+    node.put(0, z.Configuration_PropertiesReport, {"parameter": 3, "properties": props, "next": 10})
+    assert len(fake_driver.history) == 2
+    fake_driver.history = []
+    node.put(0, z.Configuration_PropertiesReport, {"parameter": 10, "properties": props, "next": 0})
+    assert len(fake_driver.history) == 1
+    fake_driver.history = []
+    for p in [3, 10]:
+        node.put(0, z.Configuration_Report, {"parameter": p, "value": {"size": 1, "value": 5}})
+    assert nodeset.catalog.Get((1, 2, 3)) == [3, 10]
+
+    # version 1: same product uses the learned parameters, others get a full scan
+    for n, prod, expected in [(3, product, [3, 10]),
+                              (4, dict(product, product=4), list(range(1, 256)))]:
+        node = nodeset.GetNode(n)
+        node.put(0, z.Version_CommandClassReport, {"class": z.Configuration, "version": 1})
+        node.put(0, z.ManufacturerSpecific_Report, prod)
+        node.state = znode.NODE_STATE_INTERVIEWED
+        fake_driver.history = []
+        node.RefreshAllParameters()
+        assert [c["parameter"] for c in SentCommands(fake_driver)] == expected
+
+    # the full scan of node 4 is learned once it went quiet
+    for p in [7, 9]:
+        node.put(0, z.Configuration_Report, {"parameter": p, "value": {"size": 1, "value": 5}})
+    assert nodeset.catalog.Get((1, 2, 4)) is None
+    nodeset.CheckDeadlines(time.time() + 61)
+    assert nodeset.catalog.Get((1, 2, 4)) == [7, 9]
+
+    # reports outside of a scan are ignored
+    node = nodeset.GetNode(2)
+    node.put(0, z.Configuration_Report, {"parameter": 20, "value": {"size": 1, "value": 5}})
+    assert nodeset.catalog.Get((1, 2, 3)) == [3, 10]
+    fake_driver.history = []
+    node.put(0, z.Configuration_PropertiesReport, {"parameter": 10, "properties": props, "next": 11})
+    assert fake_driver.history == []
+
+    # an enumeration which does not ascend is abandoned
+    for bad_next in [5, 3]:
+        node.RefreshAllParameters()
+        node.put(0, z.Configuration_PropertiesReport, {"parameter": 0, "properties": no_props, "next": 3})
+        node.put(0, z.Configuration_PropertiesReport, {"parameter": 3, "properties": props, "next": 5})
+        fake_driver.history = []
+        node.put(0, z.Configuration_PropertiesReport, {"parameter": 5, "properties": props, "next": bad_next})
+        assert [c["parameter"] for c in SentCommands(fake_driver)] == [5]
+        assert node._parameter_scan is None
+    assert nodeset.catalog.Get((1, 2, 3)) == [3, 10]
+
+
+class ChangeListener(object):
+
+    def __init__(self):
+        self.changes = []
+
+    def put_change(self, change):
+        self.changes.append(change)
+
+
+def TestValueChanges():
+    translator = CommandTranslator(FakeDriver())
+    nodeset = Nodeset(translator, 1)
+    listener = ChangeListener()
+    nodeset.AddChangeListener(listener)
+    node = nodeset.GetNode(2)
+
+    def Meter(ts, value):
+        data = [z.Meter, 2, 0x21, 0x74, 0, 0, 0, value]
+        translator.put(ts, zmessage.MakeRawMessage(z.API_APPLICATION_COMMAND_HANDLER,
+                                                   [0, 2, len(data)] + data))
+
+    Meter(1, 10)
+    Meter(2, 10)
+    Meter(3, 11)
+    changes = [c for c in listener.changes if c.key == z.Meter_Report]
+    assert len(changes) == 2
+    assert changes[0].old is None and changes[0].subkey == (1, 2)
+    assert changes[1].old["value"]["_value"] == 0.01
+    assert changes[1].new["value"]["_value"] == 0.011
+    assert changes[1].version == node.values.Version(z.Meter_Report)
+    # identical readings only refresh the timestamp
+    assert node.values.GetMap(z.Meter_Report)[(1, 2)][0] == 3
+
+    version = node.values.version
+    assert not node.values.Set(4, z.Basic_Report, None)
+    assert node.values.Set(4, z.Basic_Report, {"level": 1})
+    assert not node.values.Set(5, z.Basic_Report, {"level": 1})
+    assert node.values.version == version + 1
+    assert node.values.Version(z.Basic_Report) == node.values.version
+    assert node.values.Version(z.Battery_Report) == 0
+
+    node.EndpointValues(3).Set(6, z.Basic_Report, {"level": 2})
+    assert (listener.changes[-1].n, listener.changes[-1].endpoint) == (2, 3)
+
+
+def TestSnapshots():
+    values = znode.NodeValues()
+    values.Set(0, z.Basic_Report, {"level": 1})
+    values.SetMapEntry(0, z.Version_CommandClassReport, z.Basic, {"class": z.Basic, "version": 1})
+    snap = values.Snapshot()
+    assert values.Snapshot() is snap
+    assert snap.Snapshot() is snap
+
+    # identical values do not invalidate the snapshot
+    values.Set(1, z.Basic_Report, {"level": 1})
+    assert values.Snapshot() is snap
+    values.Set(2, z.Basic_Report, {"level": 2})
+    values.SetMapEntry(2, z.Version_CommandClassReport, z.Basic, {"class": z.Basic, "version": 2})
+    values.SetMapEntry(2, z.Version_CommandClassReport, z.Meter, {"class": z.Meter, "version": 3})
+    # the old snapshot is unaffected
+    assert snap.Get(z.Basic_Report) == {"level": 1}
+    assert snap.CommandVersion(z.Basic) == 1
+    assert not snap.HasCommandClass(z.Meter)
+    snap2 = values.Snapshot()
+    assert snap2 is not snap and snap2.version == values.version
+    assert snap2.Get(z.Basic_Report) == {"level": 2}
+    assert snap2.CommandVersion(z.Meter) == 3
+    try:
+        snap2.Set(3, z.Basic_Report, {"level": 3})
+        assert False, "snapshots must be read only"
+    except TypeError:
+        pass
+
+    # readers iterating snapshots never see a dict changing under them
+    done = []
+
+    def Writer():
+        for i in range(20000):
+            values.SetMapEntry(i, z.Meter_Report, i % 50, {"level": i})
+        done.append(True)
+
+    writer = threading.Thread(target=Writer)
+    writer.start()
+    while not done:
+        snap = values.Snapshot()
+        for _ in snap.GetMap(z.Meter_Report).items():
+            pass
+    writer.join()
+    assert len(values.Snapshot().GetMap(z.Meter_Report)) == 50
+
+
+def TestMultiCmdBundling():
+    fake_driver = FakeDriver()
+    nodeset = Nodeset(CommandTranslator(fake_driver), 1)
+    # only controlling MultiCmd: every Get is sent on its own
+    node = nodeset.GetNode(2)
+    node.InitializeUnversioned([z.Basic, z.SwitchBinary], [z.MultiCmd], [], [])
+    node.RefreshDynamicValues()
+    assert [tuple(c[:2]) for c in SentRaw(fake_driver)] == [z.Basic_Get, z.SwitchBinary_Get]
+
+    node = nodeset.GetNode(3)
+    node.InitializeUnversioned([z.Basic, z.SwitchBinary, z.MultiCmd], [], [], [])
+    node.RefreshDynamicValues()
+    sent = SentRaw(fake_driver)
+    assert len(sent) == 1 and tuple(sent[0][:2]) == z.MultiCmd_Encap, sent
+
+
+def TestIndexes():
+    translator = CommandTranslator(FakeDriver())
+    nodeset = Nodeset(translator, 1)
+    for n, flags, device_type, classes in [
+            (2, {"listening"}, (4, 0x10, 1), [z.SwitchBinary, z.Basic]),
+            (3, {"listening"}, (4, 0x11, 1), [z.SwitchMultilevel, z.Basic]),
+            (4, set(), (4, 0x20, 1), [z.SensorBinary, z.Battery])]:
+        node = nodeset.GetNode(n)
+        node.put(0, command.CUSTOM_COMMAND_PROTOCOL_INFO,
+                 {"protocol_version": 4, "flags": flags, "device_type": device_type})
+        node.InitializeUnversioned(classes, [], [], [])
+
+    assert nodeset.NodesWithClass(z.Basic) == {2, 3}
+    assert nodeset.NodesWithClass(z.Meter) == set()
+    assert nodeset.NodesWithDeviceType(0x10) == {2}
+    assert nodeset.NodesWithDeviceType(0x11, 1) == {3}
+    assert nodeset.ListeningNodes() == {2, 3}
+    assert nodeset.SleepingNodes() == {4}
+    assert nodeset.NodesInState(znode.NODE_STATE_NONE) == {2, 3, 4}
+
+    nodeset.GetNode(3).state = znode.NODE_STATE_INTERVIEWED
+    # switches that are not interviewed yet
+    switches = nodeset.NodesWithClass(z.SwitchBinary) | nodeset.NodesWithClass(z.SwitchMultilevel)
+    assert switches - nodeset.NodesInState(znode.NODE_STATE_INTERVIEWED) == {2}
+
+    # a version of 0 means not supported
+    nodeset.GetNode(2).put(0, z.Version_CommandClassReport, {"class": z.Basic, "version": 0})
+    assert nodeset.NodesWithClass(z.Basic) == {3}
+
+    # resetting a node drops its classes, dropping it removes it completely
+    nodeset.GetNode(3).state = znode.NODE_STATE_NONE
+    assert nodeset.NodesWithClass(z.SwitchMultilevel) == set()
+    assert nodeset.NodesInState(znode.NODE_STATE_INTERVIEWED) == set()
+    nodeset.DropNode(4)
+    assert nodeset.SleepingNodes() == set()
+    assert nodeset.NodesInState(znode.NODE_STATE_NONE) == {2, 3}
+
+
+def TestDynamicPoller():
+    driver = FakeDriver()
+    translator = CommandTranslator(driver)
+    nodeset = Nodeset(translator, 1)
+    clock = FakeClock()
+    for n, flags in [(2, {"listening"}), (4, set())]:
+        node = nodeset.GetNode(n)
+        node.put(0, command.CUSTOM_COMMAND_PROTOCOL_INFO,
+                 {"protocol_version": 4, "flags": flags, "device_type": (4, 0x10, 1)})
+        node.InitializeUnversioned([z.SwitchBinary, z.SensorMultilevel], [], [], [])
+        node.state = znode.NODE_STATE_INTERVIEWED
+    switch = nodeset.GetNode(2)
+    switch.put(clock.now, z.SwitchBinary_Report, {"level": 0})
+
+    ttls = {z.SwitchBinary_Report: 100.0, z.SensorMultilevel_Report: 50.0}
+    poller = znode.DynamicPoller(nodeset, ttls, frames_per_minute=1, jitter=0.0, clock=clock)
+
+    def Polled(at):
+        clock.now = at
+        driver.history = []
+        poller.Tick()
+        return [(m.node, tuple(m.payload[6:8])) for m in driver.history
+                if m.payload[3] == z.API_ZW_SEND_DATA]
+
+    assert Polled(1000) == []
+    # the sensor value has never been seen, the sleeping node 4 is never polled
+    assert Polled(1060) == [(2, z.SensorMultilevel_Get)]
+    # an unsolicited report keeps the switch fresh
+    switch.put(1090, z.SwitchBinary_Report, {"level": 0xff})
+    assert Polled(1101) == []
+    assert poller.skipped_fresh == 1
+    # both are stale now but the budget only allows one frame per minute
+    assert Polled(1200) == [(2, z.SensorMultilevel_Get)]
+    assert poller.deferred == 1
+    assert Polled(1230) == []
+    assert Polled(1260) == [(2, z.SwitchBinary_Get)]
+    assert poller.frames == 3
+    print(poller)
+
+    # a multisensor needs three Gets which exceeds the budget of two per minute
+    nodeset = Nodeset(CommandTranslator(driver), 1)
+    sensor = nodeset.GetNode(5)
+    sensor.put(0, command.CUSTOM_COMMAND_PROTOCOL_INFO,
+               {"protocol_version": 4, "flags": {"listening"}, "device_type": (4, 0x21, 1)})
+    sensor.InitializeUnversioned([z.SensorMultilevel], [], [], [])
+    sensor.values.Set(0, z.SensorMultilevel_SupportedReport, {"bits": {"size": 1, "value": 0b101}})
+    sensor.state = znode.NODE_STATE_INTERVIEWED
+    poller = znode.DynamicPoller(nodeset, {z.SensorMultilevel_Report: 50.0},
+                                 frames_per_minute=2, jitter=0.0, clock=clock)
+    assert Polled(2000) == []
+    # the group overdraws the full bucket instead of being blocked forever
+    assert Polled(2060) == [(5, z.SensorMultilevel_Get)] * 3
+    # the debt delays the next round
+    assert Polled(2111) == []
+    assert Polled(2150) == [(5, z.SensorMultilevel_Get)] * 3
+
+
+def SentRaw(fake_driver):
+    out = [list(m.payload[6:6 + m.payload[5]]) for m in fake_driver.history
+           if m.payload[3] == z.API_ZW_SEND_DATA]
+    fake_driver.history = []
+    return out
+
+
+def TestDeadlines():
+    fake_driver = FakeDriver()
+    translator = CommandTranslator(fake_driver)
+    nodeset = Nodeset(translator, 1)
+    assert nodeset.GetNode(1).deadline is None
+    node = nodeset.GetNode(5)
+    assert node.deadline is not None
+    node.InitializeUnversioned([z.SwitchBinary, z.Version, z.ManufacturerSpecific, z.Meter],
+                               [], [], [])
+    node.MaybeChangeState(znode.NODE_STATE_DISCOVERED)
+    assert len(SentRaw(fake_driver)) == 9
+    start = node.deadline
+    assert start is not None
+
+    # nothing happens before the deadline
+    nodeset.CheckDeadlines(start - 1)
+    assert SentRaw(fake_driver) == []
+
+    # most answers arrive but the device specific info, two versions and the
+    # product info get lost
+    node.put(0, z.Meter_SupportedReport, {"type": 1, "scale": 0})
+    node.put(0, z.Version_Report, {"library": 3, "protocol": 4, "firmware": 5,
+                                   "hardware": 1, "firmware_version": [1, 0]})
+    node.put(0, z.Version_CommandClassReport, {"class": z.SwitchBinary, "version": 1})
+    node.put(0, z.Version_CommandClassReport, {"class": z.Version, "version": 2})
+    nodeset.CheckDeadlines(start + 1)
+    resent = SentRaw(fake_driver)
+    assert [tuple(c[:2]) for c in resent] == [z.ManufacturerSpecific_DeviceSpecificGet] * 2 + [
+        z.Version_CommandClassGet] * 2 + [z.ManufacturerSpecific_Get], resent
+    assert sorted(c[2] for c in resent[2:4]) == [z.Meter, z.ManufacturerSpecific]
+    assert node.deadline_retries == 1
+    # resuming by hand does not reset the retries
+    node.ResumeInterview()
+    SentRaw(fake_driver)
+    assert node.deadline_retries == 1
+
+    # the next retry backs off
+    nodeset.CheckDeadlines(start + 2)
+    assert SentRaw(fake_driver) == []
+    # answers may arrive in any order, the node is interviewed once all are in
+    node.put(0, z.ManufacturerSpecific_Report, {"manufacturer": 1, "type": 2, "product": 3})
+    assert node.state == znode.NODE_STATE_DISCOVERED
+    assert set(node.OutstandingAnswers()) == {
+        (z.ManufacturerSpecific_DeviceSpecificReport, 0),
+        (z.ManufacturerSpecific_DeviceSpecificReport, 1),
+        (z.Version_CommandClassReport, z.Meter),
+        (z.Version_CommandClassReport, z.ManufacturerSpecific)}
+    assert node.InterviewCompletion() == 5 / 9 * 100
+    node.put(0, z.Version_CommandClassReport, {"class": z.Meter, "version": 1})
+    assert node.state == znode.NODE_STATE_DISCOVERED
+    # version 1 of ManufacturerSpecific has no device specific info: nothing left to wait for
+    node.put(0, z.Version_CommandClassReport, {"class": z.ManufacturerSpecific, "version": 1})
+    assert node.state == znode.NODE_STATE_INTERVIEWED
+    assert node.deadline is None
+    assert len(node.AnswerLatencies()) == 7
+
+    # each device specific report only answers the query for its type
+    node = nodeset.GetNode(8)
+    node.InitializeUnversioned([z.Version, z.ManufacturerSpecific], [], [], [])
+    node.MaybeChangeState(znode.NODE_STATE_DISCOVERED)
+    node.put(0, z.Version_Report, {"library": 3, "protocol": 4, "firmware": 5,
+                                   "hardware": 1, "firmware_version": [1, 0]})
+    node.put(0, z.Version_CommandClassReport, {"class": z.Version, "version": 2})
+    node.put(0, z.Version_CommandClassReport, {"class": z.ManufacturerSpecific, "version": 2})
+    node.put(0, z.ManufacturerSpecific_Report, {"manufacturer": 1, "type": 2, "product": 3})
+    node.put(0, z.ManufacturerSpecific_DeviceSpecificReport, {"type": 1, "bytes": [1, 2]})
+    assert set(node.OutstandingAnswers()) == {(z.ManufacturerSpecific_DeviceSpecificReport, 0)}
+    assert node.state == znode.NODE_STATE_DISCOVERED
+    node.put(0, z.ManufacturerSpecific_DeviceSpecificReport, {"type": 0, "bytes": [3, 4]})
+    assert node.state == znode.NODE_STATE_INTERVIEWED
+
+    # control only classes are not expected to answer
+    node = nodeset.GetNode(6)
+    node.InitializeUnversioned([z.Version, z.ManufacturerSpecific],
+                               [z.SwitchMultilevel, z.Meter], [], [])
+    node.MaybeChangeState(znode.NODE_STATE_DISCOVERED)
+    assert set(node.OutstandingAnswers()) == {
+        (z.Version_Report, None),
+        (z.ManufacturerSpecific_DeviceSpecificReport, 0),
+        (z.ManufacturerSpecific_DeviceSpecificReport, 1),
+        (z.Version_CommandClassReport, z.Version),
+        (z.Version_CommandClassReport, z.ManufacturerSpecific),
+        (z.ManufacturerSpecific_Report, None)}
+    node.put(0, z.Version_Report, {"library": 3, "protocol": 4, "firmware": 5,
+                                   "hardware": 1, "firmware_version": [1, 0]})
+    node.put(0, z.Version_CommandClassReport, {"class": z.Version, "version": 2})
+    node.put(0, z.Version_CommandClassReport, {"class": z.ManufacturerSpecific, "version": 1})
+    node.put(0, z.ManufacturerSpecific_Report, {"manufacturer": 1, "type": 2, "product": 3})
+    assert node.state == znode.NODE_STATE_INTERVIEWED
+
+    # version 0 means the class is not supported after all
+    node = nodeset.GetNode(7)
+    node.InitializeUnversioned([z.Version, z.ManufacturerSpecific, z.ColorSwitch], [], [], [])
+    node.MaybeChangeState(znode.NODE_STATE_DISCOVERED)
+    assert (z.ColorSwitch_SupportedReport, None) in node.OutstandingAnswers()
+    node.put(0, z.Version_Report, {"library": 3, "protocol": 4, "firmware": 5,
+                                   "hardware": 1, "firmware_version": [1, 0]})
+    node.put(0, z.Version_CommandClassReport, {"class": z.Version, "version": 2})
+    node.put(0, z.Version_CommandClassReport, {"class": z.ManufacturerSpecific, "version": 1})
+    node.put(0, z.ManufacturerSpecific_Report, {"manufacturer": 1, "type": 2, "product": 3})
+    assert set(node.OutstandingAnswers()) == {
+        (z.ColorSwitch_SupportedReport, None),
+        (z.Version_CommandClassReport, z.ColorSwitch)}
+    node.put(0, z.Version_CommandClassReport, {"class": z.ColorSwitch, "version": 0})
+    assert node.state == znode.NODE_STATE_INTERVIEWED
+
+
+def TestSchedulerOwnsDeadline():
+    fake_driver = FakeDriver()
+    translator = CommandTranslator(fake_driver)
+    clock = FakeClock()
+    scheduler = InterviewScheduler(max_active=1, timeout=60.0, clock=clock)
+    nodeset = Nodeset(translator, 1, scheduler)
+    node = nodeset.GetNode(5)
+    node.InitializeUnversioned([z.SwitchBinary, z.Version, z.ManufacturerSpecific], [], [], [])
+    node.MaybeChangeState(znode.NODE_STATE_DISCOVERED)
+    assert len(SentRaw(fake_driver)) > 0
+    # the interview is retried by the scheduler only
+    assert node.deadline is None
+    nodeset.CheckDeadlines(clock.now + 3600)
+    assert SentRaw(fake_driver) == []
+    clock.now += 61
+    scheduler.Tick()
+    clock.now += 120
+    scheduler.Tick()
+    resent = SentRaw(fake_driver)
+    assert len(resent) == len(node.MissingStaticQueries()) > 0
+    assert node.deadline is None
+    nodeset.CheckDeadlines(clock.now + 3600)
+    assert SentRaw(fake_driver) == []
+    assert node.state == znode.NODE_STATE_DISCOVERED
+
+
+def TestQueries():
+    fake_driver = FakeDriver()
+    nodeset = Nodeset(CommandTranslator(fake_driver), 1)
+    switch = nodeset.GetNode(2)
+    other = nodeset.GetNode(3)
+    level = switch.Query(z.Basic_Get, {})
+    param3 = other.Query(z.Configuration_Get, {"parameter": 3})
+    param5 = other.Query(z.Configuration_Get, {"parameter": 5})
+    lost = other.Query(z.Battery_Get, {}, timeout=0.05)
+    assert len(SentRaw(fake_driver)) == 4
+
+    # answers arrive in any order and only resolve the matching query
+    other.put(0, z.Configuration_Report, {"parameter": 5, "value": {"size": 1, "value": 7}})
+    assert param5.result(0)["value"]["value"] == 7
+    assert not param3.done()
+    switch.put(0, z.Basic_Report, {"level": 0x63})
+    assert level.result(0) == {"level": 0x63}
+    other.put(0, z.Configuration_Report, {"parameter": 3, "value": {"size": 1, "value": 1}})
+    assert param3.result(0)["value"]["value"] == 1
+
+    try:
+        lost.result(2)
+        assert False, "query should have timed out"
+    except futures.TimeoutError:
+        pass
+    assert not other._queries
+
+
+class ReadingListener(object):
+
+    def __init__(self):
+        self.readings = []
+
+    def put(self, n, ts, key, values):
+        self.readings.append((n, ts, values["value"]["_value"]))
+
+
+def _Temperature(v):
+    return {"type": 1, "value": {"unit": 0, "_value": v}}
+
+
+def _Power(v):
+    return {"value": {"type": 1, "unit": 2, "_value": v}}
+
+
+def TestSubscriptions():
+    nodeset = Nodeset(CommandTranslator(FakeDriver()), 1)
+    temperature = ReadingListener()
+    power = ReadingListener()
+    sub = nodeset.Subscribe(12, z.SensorMultilevel_Report, temperature, subkey=(1, 0), deadband=0.5)
+    nodeset.Subscribe(12, z.Meter_Report, power, thresholds=[100.0])
+    node = nodeset.GetNode(12)
+
+    for ts, v in enumerate([20.0, 20.3, 20.6, 20.6, 20.2, 20.0]):
+        node.put(ts, z.SensorMultilevel_Report, _Temperature(v))
+    # other sensor types are not part of the subscription
+    node.put(10, z.SensorMultilevel_Report, {"type": 5, "value": {"unit": 0, "_value": 50.0}})
+    assert temperature.readings == [(12, 0, 20.0), (12, 2, 20.6), (12, 5, 20.0)]
+    assert sub.suppressed == 3
+
+    for ts, v in enumerate([99.0, 101.0, 102.0, 100.0, 98.0]):
+        node.put(ts, z.Meter_Report, _Power(v))
+    # thresholds only: the first reading and the crossings
+    assert [r[2] for r in power.readings] == [99.0, 101.0, 98.0]
+    # the first reading of another scale qualifies on its own
+    node.put(6, z.Meter_Report, {"value": {"type": 1, "unit": 0, "_value": 3.5}})
+    node.put(7, z.Meter_Report, {"value": {"type": 1, "unit": 0, "_value": 3.6}})
+    assert [r[2] for r in power.readings] == [99.0, 101.0, 98.0, 3.5]
+    # the values themselves are always recorded
+    assert node.values.GetMap(z.Meter_Report)[(1, 2)][1]["value"]["_value"] == 98.0
+
+    nodeset.Unsubscribe(sub)
+    node.put(20, z.SensorMultilevel_Report, _Temperature(30.0))
+    assert len(temperature.readings) == 3
+
+
 def main():
     fake_driver = FakeDriver()
     translator = CommandTranslator(fake_driver)
@@ -55,6 +691,20 @@ def main():
     node.put(0, z.Version_CommandClassReport, {"class": z.Basic, "version": 10})
     assert node.values.HasCommandClass(z.Basic)
 
+    TestEndpoints()
+    TestInterviewScheduler()
+    TestVersionProbes()
+    TestParameterDiscovery()
+    TestValueChanges()
+    TestSnapshots()
+    TestMultiCmdBundling()
+    TestIndexes()
+    TestDynamicPoller()
+    TestSubscriptions()
+    TestDeadlines()
+    TestSchedulerOwnsDeadline()
+    TestQueries()
+
     print ("OK")
     return 0
 
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+
+"""
+command_benchmark.py compares the table interpreting parser/assembler
+with the compiled ones, dict results with record results and
+lazy command views.
+It reads the same input format as command_test.py from stdin.
+"""
+
+# python imports
+import logging
+import sys
+import time
+import tracemalloc
+
+# local imports
+
+from pyzwaver import command
+from pyzwaver import zwave as z
+
+TRANSLATE = {
+    "SOF": z.SOF,
+    "REQU": z.REQUEST,
+    "RESP": z.RESPONSE,
+}
+
+ROUNDS = 200
+
+# key -> name of the first field (if any)
+FIRST_FIELD = {(k >> 8, k & 0xff): t[0][2:-1] if t else None for k, t in z.SUBCMD_TO_PARSE_TABLE.items()}
+
+
+def ParseToken(t):
+    if t in TRANSLATE:
+        return TRANSLATE[t]
+    elif ":" in t:
+        return int(t.split(":", 1)[1], 16)
+    else:
+        return int(t, 16)
+
+
+def ReadApplicationData(lines):
+    out = []
+    for line in lines:
+        if line.startswith("#"): continue
+        token = line.split()
+        if len(token) == 0: continue
+        message = [ParseToken(t) for t in token]
+        if message[0] != z.SOF: continue
+        if message[2] != z.REQUEST: continue
+        if message[3] != z.API_APPLICATION_COMMAND_HANDLER: continue
+        size = message[6]
+        out.append(command.MaybePatchCommand(message[7:7 + size]))
+    return out
+
+
+def Measure(name, fun, inputs):
+    start = time.time()
+    for _ in range(ROUNDS):
+        for i in inputs:
+            fun(i)
+    dur = time.time() - start
+    ops = ROUNDS * len(inputs) / dur
+    print("%-20s %10.0f ops/sec" % (name, ops))
+    return ops
+
+
+def MemoryPerResult(fun, inputs):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [fun(i) for i in inputs]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert results
+    return (after - before) // len(inputs)
+
+
+def FirstField(raw):
+    view = command.CommandView(raw)
+    name = FIRST_FIELD[view.key]
+    if name is not None:
+        view.get(name)
+
+
+def _main(argv):
+    logging.basicConfig(level=logging.ERROR)
+    messages = ReadApplicationData(sys.stdin)
+    values = [((m[0], m[1]), command.ParseCommand(m)) for m in messages]
+    for m, (k, v) in zip(messages, values):
+        assert command._ParseCommandGeneric(m) == v
+        assert command._AssembleCommandGeneric(k[0], k[1], v) == command.AssembleCommand(k[0], k[1], v)
+        view = command.CommandView(bytes(m))
+        for name in z.SUBCMD_TO_PARSE_TABLE[k[0] * 256 + k[1]]:
+            name = name[2:-1]
+            if name in v:
+                assert view[name] == v[name], (name, view[name], v[name])
+        assert view.Decode() == v
+
+    print("messages: %d  rounds: %d" % (len(messages), ROUNDS))
+    a = Measure("parse generic", command._ParseCommandGeneric, messages)
+    b = Measure("parse compiled", command.ParseCommand, messages)
+    print("parse speedup: %.2fx" % (b / a))
+    c = Measure("parse records", command.ParseCommandAsRecord, messages)
+    print("records vs compiled: %.2fx" % (c / b))
+    raw = [memoryview(bytes(m)) for m in messages]
+    d = Measure("view key only", lambda x: command.CommandView(x).key, raw)
+    e = Measure("view first field", FirstField, raw)
+    print("view vs compiled: key only %.2fx  first field %.2fx" % (d / b, e / b))
+    print("bytes per message dict: %d  record: %d" % (
+        MemoryPerResult(command.ParseCommand, messages),
+        MemoryPerResult(command.ParseCommandAsRecord, messages)))
+    a = Measure("assemble generic", lambda x: command._AssembleCommandGeneric(x[0][0], x[0][1], x[1]), values)
+    b = Measure("assemble compiled", lambda x: command.AssembleCommand(x[0][0], x[0][1], x[1]), values)
+    print("assemble speedup: %.2fx" % (b / a))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
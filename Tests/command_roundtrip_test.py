@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+
+"""
+command_roundtrip_test.py generates random arguments for every command
+in z.SUBCMD_TO_PARSE_TABLE and checks that ParseCommand(AssembleCommand(...))
+reproduces them. It also reports parse/assemble throughput per format letter.
+
+Usage: command_roundtrip_test.py [seed]
+"""
+
+# python imports
+import collections
+import logging
+import random
+import sys
+import time
+
+# local imports
+from pyzwaver import command
+from pyzwaver import zwave as z
+
+SAMPLES_PER_COMMAND = 20
+ROUNDS = 10
+
+_TEXT = "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_."
+
+
+def _Bytes(rng, n):
+    return [rng.randrange(256) for _ in range(n)]
+
+
+def _SizedInt(rng, size):
+    return {"size": size, "value": rng.randrange(256 ** size)}
+
+
+def _Meter(rng):
+    size = rng.choice((1, 2, 4))
+    out = {
+        "type": rng.randrange(32),
+        "unit": rng.randrange(8),
+        "exp": rng.randrange(8),
+        "rate": rng.randrange(4),
+        "mantissa": _Bytes(rng, size),
+    }
+    # the previous value is only present if the time delta is
+    extra = rng.randrange(3)
+    if extra > 0:
+        out["dt"] = rng.randrange(65536)
+    if extra > 1:
+        out["mantissa2"] = _Bytes(rng, size)
+    return out
+
+
+def _Properties(rng):
+    size = rng.choice((0, 1, 2, 4))
+    out = {"size": size, "format": rng.randrange(8), "flags": rng.randrange(4)}
+    for name in ("min", "max", "default"):
+        out[name] = rng.randrange(256 ** size)
+    return out
+
+
+def _Name(rng):
+    encoding = rng.randrange(3)
+    text = "".join(rng.choice(_TEXT) for _ in range(rng.randrange(12)))
+    return {"encoding": encoding,
+            "text": list(text.encode(command._ENCODING_TO_DECODER[encoding]))}
+
+
+_GENERATORS = {
+    'B': lambda rng: rng.randrange(256),
+    'W': lambda rng: rng.randrange(65536),
+    '3': lambda rng: rng.randrange(1 << 24),
+    'A': lambda rng: bytes(_Bytes(rng, rng.randrange(10))),
+    'C': lambda rng: [rng.randrange(65536)] + _Bytes(rng, 5),
+    'D': lambda rng: _Bytes(rng, rng.randrange(10)),
+    'E': lambda rng: [_Bytes(rng, rng.randrange(2, 8)) for _ in range(rng.randrange(4))],
+    'F': lambda rng: {"encoding": rng.randrange(8), "text": _Bytes(rng, rng.randrange(32))},
+    'G': lambda rng: [(rng.randrange(256), rng.randrange(65536), rng.randrange(65536))
+                      for _ in range(rng.randrange(5))],
+    'K': lambda rng: _Bytes(rng, 16),
+    'L': lambda rng: _Bytes(rng, rng.randrange(10)),
+    'M': _Meter,
+    'N': _Name,
+    'O': lambda rng: _Bytes(rng, 8),
+    'P': _Properties,
+    'R': lambda rng: _SizedInt(rng, rng.randrange(9)),
+    'T': lambda rng: _SizedInt(rng, rng.randrange(9)),
+    'V': lambda rng: _SizedInt(rng, rng.choice((1, 2, 4))),
+    'X': lambda rng: {"exp": rng.randrange(8), "unit": rng.randrange(4),
+                      "mantissa": _Bytes(rng, rng.choice((1, 2, 4)))},
+    'b': lambda rng: rng.randrange(256),
+    't': lambda rng: [rng.randrange(65536) for _ in range(rng.randrange(4))],
+}
+
+
+def GenerateArgs(rng, table):
+    args = {}
+    omit = False
+    for t in table:
+        kind, name = t[0], t[2:-1]
+        if kind in command._OPTIONAL_COMPONENTS:
+            # once an optional component is missing, all later ones are too
+            omit = omit or rng.randrange(3) == 0
+            if omit:
+                continue
+        args[name] = _GENERATORS[kind](rng)
+    return args
+
+
+def StripDerived(v):
+    """Removes the computed components (e.g. "_value") from a parsed value"""
+    if isinstance(v, dict):
+        return {k: StripDerived(x) for k, x in v.items() if not k.startswith("_")}
+    return v
+
+
+def Normalize(v):
+    """Turns records into dicts and tuples into lists"""
+    if isinstance(v, command.Record):
+        v = dict(v)
+    if isinstance(v, dict):
+        return {k: Normalize(x) for k, x in v.items()}
+    if isinstance(v, tuple):
+        return [Normalize(x) for x in v]
+    if isinstance(v, list):
+        return [Normalize(x) for x in v]
+    return v
+
+
+def CheckRoundTrip(key, args):
+    k0, k1 = key >> 8, key & 0xff
+    raw = command.AssembleCommand(k0, k1, args)
+    assert raw == command._AssembleCommandGeneric(k0, k1, args), (key, args)
+    values = command.ParseCommand(raw)
+    assert StripDerived(values) == args, (z.SUBCMD_TO_STRING[key], args, raw, values)
+    assert values == command._ParseCommandGeneric(raw), (key, raw)
+    assert Normalize(command.ParseCommandAsRecord(raw)) == Normalize(values), (key, raw)
+    assert command.AssembleCommand(k0, k1, values) == raw, (key, values)
+    return raw
+
+
+def CheckMalformed(key, args):
+    """Malformed values must be rejected with ValueError by all the parsers"""
+    raw = command.AssembleCommand(key >> 8, key & 0xff, args)
+    for parse in (command.ParseCommand, command._ParseCommandGeneric, command.ParseCommandAsRecord):
+        try:
+            parse(raw)
+        except ValueError:
+            continue
+        assert False, (parse.__name__, key, raw)
+
+
+def Measure(fun, inputs):
+    start = time.time()
+    for _ in range(ROUNDS):
+        for i in inputs:
+            fun(i)
+    dur = time.time() - start
+    return ROUNDS * len(inputs) / dur
+
+
+def main(argv):
+    logging.basicConfig(level=logging.ERROR)
+    seed = int(argv[0]) if argv else 0
+    rng = random.Random(seed)
+    # letter -> [(key, args, raw), ...]
+    by_letter = collections.defaultdict(list)
+    count = 0
+    for key, table in sorted(z.SUBCMD_TO_PARSE_TABLE.items()):
+        letters = set(t[0] for t in table) or {"-"}
+        for _ in range(SAMPLES_PER_COMMAND):
+            args = GenerateArgs(rng, table)
+            raw = CheckRoundTrip(key, args)
+            count += 1
+            for letter in letters:
+                by_letter[letter].append((key, args, raw))
+    missing = set(_GENERATORS) - set(by_letter)
+    assert not missing, missing
+    # zero size mantissa
+    CheckMalformed(z.Meter_Report[0] * 256 + z.Meter_Report[1],
+                   {"value": {"type": 1, "unit": 2, "exp": 0, "rate": 0, "mantissa": []}})
+    print("seed: %d  commands: %d  round trips: %d" % (seed, len(z.SUBCMD_TO_PARSE_TABLE), count))
+    print("%-6s %8s %15s %15s" % ("letter", "samples", "parse ops/sec", "assemble ops/sec"))
+    for letter, samples in sorted(by_letter.items()):
+        raws = [raw for _, _, raw in samples]
+        inputs = [(key >> 8, key & 0xff, args) for key, args, _ in samples]
+        p = Measure(command.ParseCommand, raws)
+        a = Measure(lambda x: command.AssembleCommand(*x), inputs)
+        print("%-6s %8d %15.0f %15.0f" % (letter, len(samples), p, a))
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
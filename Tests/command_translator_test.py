@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+"""
+Tests for the inbound processing done by the CommandTranslator
+"""
+
+# python import
+import logging
+import sys
+import time
+
+from pyzwaver import command
+from pyzwaver import command_translator
+from pyzwaver import zmessage
+from pyzwaver.command_translator import CommandTranslator
+from pyzwaver import zwave as z
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.history = []
+
+    def AddListener(self, l):
+        pass
+
+    def SendMessage(self, m: zmessage.Message):
+        self.history.append(m)
+
+
+class RecordingListener(object):
+
+    def __init__(self):
+        self.events = []
+
+    def put(self, n, ts, key, values):
+        self.events.append((n, ts, key, values))
+
+
+class BatchListener(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def put_batch(self, events):
+        self.batches.append(events)
+
+
+def MakeApplicationCommand(n, data):
+    return zmessage.MakeRawMessage(z.API_APPLICATION_COMMAND_HANDLER, [0, n, len(data)] + data)
+
+
+def TestParseCache():
+    translator = CommandTranslator(FakeDriver(), parse_cache_size=2)
+    listener = RecordingListener()
+    translator.AddListener(listener)
+
+    basic_on = MakeApplicationCommand(2, [z.Basic, 3, 0xff])
+    basic_off = MakeApplicationCommand(2, [z.Basic, 3, 0])
+    meter = MakeApplicationCommand(3, [z.Meter, 2, 0x21, 0x74, 0, 0, 0xa8, 0xa7, 0, 0x53, 0, 2, 0x60, 0x11])
+    for m in [basic_on, basic_on, basic_off, basic_on, meter, meter, basic_off]:
+        translator.put(0, m)
+
+    cache = translator.parse_cache
+    assert cache.hits == 3, cache
+    assert cache.misses == 4, cache
+    assert cache.evictions == 2, cache
+    assert len(cache) == 2
+
+    events = listener.events
+    assert len(events) == 7
+    assert events[0][2] == z.Basic_Report
+    assert events[0][3] == {"level": 0xff}
+    # hits share the same frozen value
+    assert events[0][3] is events[1][3]
+    assert events[4][3]["value"]["_value"] == 43.175
+    assert isinstance(events[4][3]["value"]["mantissa"], tuple)
+    try:
+        events[0][3]["level"] = 0
+        assert False, "cached values must be immutable"
+    except TypeError:
+        pass
+    print(cache)
+
+
+def TestLazyListeners():
+    translator = CommandTranslator(FakeDriver())
+    eager = RecordingListener()
+    lazy = RecordingListener()
+    translator.AddListener(eager)
+    translator.AddListener(lazy, lazy=True)
+
+    sensor = MakeApplicationCommand(5, [z.SensorMultilevel, 5, 1, 0x22, 0, 0xd7])
+    translator.put(0, sensor)
+    n, _, key, view = lazy.events[0]
+    assert n == 5
+    assert key == z.SensorMultilevel_Report
+    assert isinstance(view, command.CommandView)
+    # commands with quirks are always decoded
+    assert view["type"] == 1
+    assert view._values is not None
+    assert view["value"]["_value"] == 21.5
+    assert dict(view) == eager.events[0][3]
+
+    # static fields of commands without quirks do not trigger decoding
+    translator.put(0, MakeApplicationCommand(5, [z.Battery, 3, 0x40]))
+    view = lazy.events[-1][3]
+    assert view["level"] == 0x40
+    assert view._values is None
+    assert dict(view) == eager.events[-1][3]
+
+    # patched commands are decoded the same way
+    version = MakeApplicationCommand(5, [z.Version, 0x14, z.Basic])
+    translator.put(0, version)
+    assert dict(lazy.events[-1][3]) == eager.events[-1][3] == {"class": z.Basic, "version": 1}
+
+    # lazy only: no eager decoding
+    translator = CommandTranslator(FakeDriver())
+    translator.AddListener(lazy, lazy=True)
+    translator._DecodeCommand = None
+    translator.put(0, MakeApplicationCommand(5, [z.Basic, 3, 0x10]))
+    assert lazy.events[-1][3].get("level") == 0x10
+
+
+def _FixInvertedLevel(m):
+    m[2] = 0xff - m[2]
+    return True
+
+
+def TestQuirks():
+    inverted = command.Quirk("inverted level", z.Basic_Report, _FixInvertedLevel, (0x86, None, 0x50))
+    quirks = command.QuirkRegistry(command.QUIRKS.Quirks() + [inverted])
+    assert quirks.product_specific
+    translator = CommandTranslator(FakeDriver(), parse_cache_size=8, quirks=quirks)
+    listener = RecordingListener()
+    translator.AddListener(listener)
+    translator.SetProductInfo(2, (0x86, 3, 0x50))
+    translator.SetProductInfo(3, (0x86, 3, 0x51))
+
+    basic = [z.Basic, 3, 0x10]
+    for n in [2, 3, 4, 2]:
+        translator.put(0, MakeApplicationCommand(n, basic))
+    assert [e[3]["level"] for e in listener.events] == [0xef, 0x10, 0x10, 0xef]
+    # the second message from node 2 was a cache hit
+    assert inverted.fired == 1
+    assert translator.parse_cache.hits == 1
+
+    # generic quirks still apply
+    translator.put(0, MakeApplicationCommand(4, [z.Version, 0x14, z.Basic]))
+    assert listener.events[-1][3] == {"class": z.Basic, "version": 1}
+    print(quirks)
+
+
+def _InvertSwitchLevel(m):
+    m[2] = 0xff - m[2]
+    return True
+
+
+def TestLazyQuirks():
+    inverted = command.Quirk("inverted switch", z.SwitchBinary_Report, _InvertSwitchLevel)
+    quirks = command.QuirkRegistry(command.QUIRKS.Quirks() + [inverted])
+    translator = CommandTranslator(FakeDriver(), quirks=quirks)
+    eager = RecordingListener()
+    lazy = RecordingListener()
+    translator.AddListener(eager)
+    translator.AddListener(lazy, lazy=True)
+    translator.put(0, MakeApplicationCommand(2, [z.SwitchBinary, 3, 0]))
+    # the statically known field must not bypass the quirk
+    assert eager.events[0][3]["level"] == 0xff
+    assert lazy.events[0][3]["level"] == 0xff
+
+
+def TestMultiCmd():
+    driver = FakeDriver()
+    translator = CommandTranslator(driver)
+    listener = RecordingListener()
+    translator.AddListener(listener)
+
+    # inbound: one frame carrying two reports
+    encap = command.AssembleCommand(z.MultiCmd, z.MultiCmd_Encap[1], {"commands": [
+        [z.Basic, 3, 0x20],
+        [z.Battery, 3, 0x55]]})
+    translator.put(0, MakeApplicationCommand(7, encap))
+    assert [(e[0], e[2], e[3]) for e in listener.events] == [
+        (7, z.Basic_Report, {"level": 0x20}),
+        (7, z.Battery_Report, {"level": 0x55})]
+
+    # outbound: 20 Gets of 3 bytes each need two frames
+    commands = [(z.SceneActuatorConf_Get, {"scene": s}) for s in range(20)]
+    translator.SendBundledCommands(7, commands, (0, 0, 7), 0)
+    assert len(driver.history) == 2
+    scenes = []
+    for m in driver.history:
+        payload = m.payload[6:6 + m.payload[5]]
+        assert len(payload) <= command.MAX_COMMAND_PAYLOAD
+        values = command.ParseCommand(list(payload))
+        scenes += [c[2] for c in values["commands"]]
+    assert scenes == list(range(20))
+
+    # a single command is not encapsulated
+    assert command.PackMultiCmd([[z.Basic, 2]]) == [[z.Basic, 2]]
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def TestFailureQuarantine():
+    clock = FakeClock()
+    failures = command_translator.FailureQuarantine(
+        max_samples=2, traceback_interval=10, mute_threshold=3, mute_window=60,
+        mute_duration=100, clock=clock)
+    driver = FakeDriver()
+    translator = CommandTranslator(driver, failures=failures)
+    listener = RecordingListener()
+    translator.AddListener(listener)
+
+    truncated = [z.SensorMultilevel, 5, 1]
+    for _ in range(2):
+        translator.put(0, MakeApplicationCommand(5, truncated))
+    translator.put(0, MakeApplicationCommand(5, [z.Basic, 3, 1]))
+    assert failures.node_failures == {5: 2}
+    assert failures.suppressed_tracebacks == 1
+    assert len(listener.events) == 1
+
+    # third failure mutes the node
+    translator.put(0, MakeApplicationCommand(5, truncated))
+    assert failures.Samples(command_translator.FAILURE_PARSE, z.SensorMultilevel_Report) == {
+        ("parse", z.SensorMultilevel_Report, "ValueError"): [(5, bytes(truncated))] * 2}
+    translator.put(0, MakeApplicationCommand(5, [z.Basic, 3, 2]))
+    translator.put(0, MakeApplicationCommand(6, [z.Basic, 3, 3]))
+    assert [e[0] for e in listener.events] == [5, 6]
+    assert failures.dropped == 1
+    clock.now += 101
+    translator.put(0, MakeApplicationCommand(5, [z.Basic, 3, 4]))
+    assert [e[3]["level"] for e in listener.events] == [1, 3, 4]
+
+    # assemble failures are recorded and nothing is sent
+    translator.SendCommand(7, z.Basic_Set, {}, (0, 0, 7), 0)
+    assert not driver.history
+    assert failures.type_failures[("assemble", z.Basic_Set, "ValueError")] == 1
+    print(failures)
+
+
+def TestFilteredListeners():
+    translator = CommandTranslator(FakeDriver())
+    by_node = RecordingListener()
+    by_class = RecordingListener()
+    by_key = RecordingListener()
+    by_predicate = RecordingListener()
+    translator.AddListener(by_node, nodes=[2])
+    translator.AddListener(by_class, classes={z.Basic})
+    translator.AddListener(by_key, keys={z.Battery_Report}, nodes={2, 3})
+    translator.AddListener(by_predicate, lazy=True, predicate=lambda n, key, v: v.get("level") == 0)
+
+    for n, data in [(2, [z.Basic, 3, 0]),
+                    (3, [z.Basic, 3, 1]),
+                    (3, [z.Battery, 3, 0]),
+                    (4, [z.Battery, 3, 2]),
+                    (5, [z.SwitchBinary, 3, 0])]:
+        translator.put(0, MakeApplicationCommand(n, data))
+
+    def Summary(listener):
+        return [(e[0], e[2]) for e in listener.events]
+
+    assert Summary(by_node) == [(2, z.Basic_Report)]
+    assert Summary(by_class) == [(2, z.Basic_Report), (3, z.Basic_Report)]
+    assert Summary(by_key) == [(3, z.Battery_Report)]
+    assert Summary(by_predicate) == [(2, z.Basic_Report), (3, z.Battery_Report),
+                                     (5, z.SwitchBinary_Report)]
+
+    # commands nobody subscribed to are not even parsed
+    translator = CommandTranslator(FakeDriver())
+    translator.AddListener(by_node, nodes=[2])
+    translator.put(0, MakeApplicationCommand(3, [z.SensorMultilevel, 5, 1]))
+    assert not translator.failures.node_failures
+    translator.put(0, MakeApplicationCommand(2, [z.SensorMultilevel, 5, 1]))
+    assert translator.failures.node_failures == {2: 1}
+
+
+def TestBatchListener():
+    translator = CommandTranslator(FakeDriver())
+    listener = BatchListener()
+    batcher = translator.AddBatchListener(listener, max_events=3, max_delay_ms=20,
+                                          keys={z.Basic_Report})
+    for level in range(5):
+        translator.put(level, MakeApplicationCommand(2, [z.Basic, 3, level]))
+    translator.put(5, MakeApplicationCommand(2, [z.Battery, 3, 50]))
+    # the first batch is full and delivered immediately
+    assert len(listener.batches) == 1
+    assert listener.batches[0] == [(2, ts, z.Basic_Report, {"level": ts}) for ts in range(3)]
+    # the second one is delivered by the background thread
+    deadline = time.time() + 2
+    while len(listener.batches) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [e[3]["level"] for e in listener.batches[1]] == [3, 4]
+
+    translator.put(6, MakeApplicationCommand(2, [z.Basic, 3, 6]))
+    batcher.Close()
+    assert len(listener.batches) == 3
+    assert batcher.batches == 3 and batcher.events == 6
+
+
+def TestDuplicateFilter():
+    clock = FakeClock()
+    duplicates = command_translator.DuplicateFilter(window=0.5, clock=clock)
+    translator = CommandTranslator(FakeDriver(), duplicates=duplicates)
+    listener = RecordingListener()
+    translator.AddListener(listener)
+
+    basic = [z.Basic, 3, 0xff]
+    for n, dt in [(2, 0), (2, 0.1), (3, 0), (2, 0.2), (2, 0.3), (2, 0)]:
+        clock.now += dt
+        translator.put(0, MakeApplicationCommand(n, basic))
+    # a different payload is not a duplicate
+    translator.put(0, MakeApplicationCommand(2, [z.Basic, 3, 0]))
+    assert [e[0] for e in listener.events] == [2, 3, 2, 2]
+    assert duplicates.dropped == 3
+    assert duplicates.node_dropped == {2: 3}
+    assert duplicates.passed == 4
+    print(duplicates)
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    TestParseCache()
+    TestLazyListeners()
+    TestQuirks()
+    TestLazyQuirks()
+    TestMultiCmd()
+    TestFailureQuarantine()
+    TestFilteredListeners()
+    TestBatchListener()
+    TestDuplicateFilter()
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
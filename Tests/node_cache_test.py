@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+"""
+Tests for persisting and restoring node interviews
+"""
+
+# python import
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from pyzwaver import zmessage
+from pyzwaver.command_translator import CommandTranslator
+from pyzwaver.node import Nodeset, NODE_STATE_INTERVIEWED, NODE_STATE_NONE
+from pyzwaver.node_cache import NodeCache
+from pyzwaver import zwave as z
+
+HOME_ID = 0xcafe0001
+PRODUCT = {"manufacturer": 0x86, "type": 3, "product": 0x50}
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.history = []
+
+    def AddListener(self, l):
+        pass
+
+    def SendMessage(self, m: zmessage.Message):
+        self.history.append(m)
+
+
+def MakeInterviewedNodeset():
+    translator = CommandTranslator(FakeDriver())
+    nodeset = Nodeset(translator, 1)
+    node = nodeset.GetNode(5)
+    node.state = NODE_STATE_INTERVIEWED
+    node.InitializeUnversioned([z.SwitchBinary, z.MultiCmd], [z.Basic], [], [])
+    node.put(0, z.ManufacturerSpecific_Report, PRODUCT)
+    node.put(0, z.Version_CommandClassReport, {"class": z.SwitchBinary, "version": 2})
+    node.put(0, z.Version_CommandClassReport, {"class": z.ManufacturerSpecific, "version": 1})
+    node.put(0, z.Version_CommandClassReport, {"class": z.Configuration, "version": 1})
+    # a full scan finds parameters 7 and 9
+    node.RefreshAllParameters()
+    for p in [7, 9]:
+        node.put(0, z.Configuration_Report, {"parameter": p, "value": {"size": 1, "value": 3}})
+    nodeset.CheckDeadlines(time.time() + 61)
+    node.put(0, z.SwitchBinary_Report, {"level": 0xff})
+    node.put(0, z.MultiChannel_CapabilityReport,
+             {"endpoint": 2, "generic": 0x10, "specific": 1, "classes": [z.SwitchBinary]})
+    # not yet interviewed nodes are not persisted
+    nodeset.GetNode(6).put(0, z.Version_CommandClassReport, {"class": z.Basic, "version": 1})
+    return nodeset
+
+
+def Restore(path):
+    driver = FakeDriver()
+    translator = CommandTranslator(driver)
+    nodeset = Nodeset(translator, 1)
+    cache = NodeCache(path, HOME_ID)
+    restored = cache.Restore(nodeset, [5, 6, 7])
+    cache.Close()
+    return driver, translator, nodeset, restored
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "nodes")
+        cache = NodeCache(path, HOME_ID)
+        cache.SaveAll(MakeInterviewedNodeset())
+        cache.Close()
+
+        driver, translator, nodeset, restored = Restore(path)
+        assert restored == [5]
+        node = nodeset.GetNode(5)
+        assert node.state == NODE_STATE_INTERVIEWED
+        assert node.stale
+        assert node.values.ProductInfo() == (0x86, 3, 0x50)
+        assert node.values.CommandVersion(z.SwitchBinary) == 2
+        assert node.values.GetMap(z.Configuration_Report)[7][1]["value"]["value"] == 3
+        assert node.EndpointValues(2).HasCommandClass(z.SwitchBinary)
+        # so is the node info
+        assert node._supported == {z.SwitchBinary, z.MultiCmd}
+        assert node._controls == {z.Basic}
+        # dynamic values are not cached
+        assert node.values.Get(z.SwitchBinary_Report) is None
+        assert translator._products[5] == (0x86, 3, 0x50)
+        # parameters learned for the product
+        assert nodeset.catalog.Get((0x86, 3, 0x50)) == [7, 9]
+
+        # an ad-hoc report does not shrink the scan of an unknown product
+        other = nodeset.GetNode(7)
+        other.put(0, z.Version_CommandClassReport, {"class": z.Configuration, "version": 1})
+        other.put(0, z.ManufacturerSpecific_Report, dict(PRODUCT, product=0x52))
+        other.put(0, z.Configuration_Report, {"parameter": 7, "value": {"size": 1, "value": 3}})
+        assert nodeset.catalog.Get((0x86, 3, 0x52)) is None
+        driver.history = []
+        other.RefreshAllParameters()
+        assert len(driver.history) == 255
+        driver.history = []
+
+        # a matching product confirms the cache
+        node.Revalidate()
+        assert len(driver.history) == 1
+        node.put(1, z.ManufacturerSpecific_Report, PRODUCT)
+        assert not node.stale
+        assert node.state == NODE_STATE_INTERVIEWED
+
+        # a different product discards it
+        driver, translator, nodeset, restored = Restore(path)
+        node = nodeset.GetNode(5)
+        node.put(1, z.ManufacturerSpecific_Report, dict(PRODUCT, product=0x51))
+        assert not node.stale
+        assert node.state == NODE_STATE_NONE
+        assert not node.values.HasValue(z.Configuration_Report)
+        assert not node.endpoints
+        assert not node._supported
+
+        # other networks do not see the entries
+        cache = NodeCache(path, HOME_ID + 1)
+        assert cache.Restore(Nodeset(CommandTranslator(FakeDriver()), 1), [5]) == []
+        cache.Close()
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+"""
+Tests for the sensor/meter reading history
+"""
+
+# python import
+import logging
+import sys
+
+from pyzwaver import zmessage
+from pyzwaver.command_translator import CommandTranslator
+from pyzwaver.node import Nodeset
+from pyzwaver.timeseries import RingBuffer
+from pyzwaver import zwave as z
+
+
+class FakeDriver(object):
+
+    def AddListener(self, l):
+        pass
+
+    def SendMessage(self, m: zmessage.Message):
+        pass
+
+
+def TestRingBuffer():
+    buf = RingBuffer(4)
+    assert len(buf) == 0
+    assert buf.Last() is None
+    assert buf.Stats() is None
+    for ts in range(6):
+        buf.Add(ts, ts * 10.0)
+    # the two oldest samples were overwritten
+    assert len(buf) == 4
+    assert buf.Last() == (5, 50.0)
+    ts, values = buf.Window()
+    assert list(ts) == [2, 3, 4, 5]
+    assert list(values) == [20, 30, 40, 50]
+    ts, values = buf.Window(3, 5)
+    assert list(ts) == [3, 4]
+    assert list(buf.Window(10)[0]) == []
+    assert buf.Stats() == (4, 20, 50, 35)
+    assert buf.Stats(start=4) == (2, 40, 50, 45)
+    assert buf.Downsample(2) == [(2, 2, 20, 30, 25), (4, 2, 40, 50, 45)]
+    assert buf.Downsample(10, end=4) == [(0, 2, 20, 30, 25)]
+
+
+def TestNodeHistory():
+    translator = CommandTranslator(FakeDriver())
+    nodeset = Nodeset(translator, 1, history_capacity=16)
+
+    def Send(ts, data):
+        translator.put(ts, zmessage.MakeRawMessage(z.API_APPLICATION_COMMAND_HANDLER,
+                                                   [0, 5, len(data)] + data))
+
+    for ts, temp in enumerate([215, 217, 220]):
+        # 21.5C ...
+        Send(ts, [z.SensorMultilevel, 5, 1, 0x22, 0, temp])
+    Send(3, [z.Battery, 3, 90])
+    Send(4, [z.Basic, 3, 1])
+    history = nodeset.GetNode(5).history
+    temps = history.Get(z.SensorMultilevel_Report, (1, 0))
+    assert list(temps.Window()[1]) == [21.5, 21.7, 22.0]
+    assert history.Get(z.Battery_Report).Last() == (3, 90)
+    # non numeric readings are not recorded
+    assert sorted(history.Keys()) == [(z.SensorMultilevel_Report, (1, 0)), (z.Battery_Report, None)]
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    TestRingBuffer()
+    TestNodeHistory()
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -349,7 +349,11 @@ CMD_TO_STRING = {}
 SUBCMD_TO_PARSE_TABLE = {}
 
 ALLOWED_PARAMETER_FORMATS = {
-    "3{XXX}",  # 24bit
+    # 24bit
+    "3{min}",
+    "3{max}",
+    "3{default}",
+    "3{step}",
     "A{code}",
     "A{name}",
     "A{commands}",
@@ -382,6 +386,8 @@ ALLOWED_PARAMETER_FORMATS = {
     "B{sec}",
     "B{seq}",
     "B{specific}",
+    "B{src}",
+    "B{dst}",
     "B{state}",
     "B{status}",
     "B{thermo}",
@@ -394,6 +400,7 @@ ALLOWED_PARAMETER_FORMATS = {
     "C{date}",
     "D{code}",
     "D{data}",
+    "E{commands}",
     "G{groups}",
     "F{bytes}",
     "K{key}",
@@ -405,6 +412,7 @@ ALLOWED_PARAMETER_FORMATS = {
     "M{value}",
     "N{name}",
     "O{nonce}",
+    "P{properties}",
     "R{bits}",
     "T{bits}",
     "V{value}",
@@ -415,6 +423,8 @@ ALLOWED_PARAMETER_FORMATS = {
     "W{icon}",
     "W{icon2}",
     "W{id}",
+    "W{next}",
+    "W{parameter}",
     "W{manufacturer}",
     "W{product}",
     "W{protocol}",
@@ -608,7 +618,7 @@ C("MultiChannel", 0x60,
   CapabilityReport=(0x0a, "B{endpoint},B{generic},B{specific},L{classes}"),
   ChannelEndPointFind=(0x0b, ""),
   ChannelEndPointFindReport=(0x0c, ""),
-  ChannelEncap=(0x0d, ""),
+  ChannelEncap=(0x0d, "B{src},B{dst},L{command}"),
   )
 
 C("DoorLock", 0x62,
@@ -632,6 +642,9 @@ C("Configuration", 0x70,
   Set=(0x4, "B{parameter},V{value}"),
   Get=(0x5, "B{parameter}"),
   Report=(0x6, "B{parameter},V{value}"),
+  # v3
+  PropertiesGet=(0x0e, "W{parameter}"),
+  PropertiesReport=(0x0f, "W{parameter},P{properties},W{next}"),
   )
 
 C("Alarm", 0x71,
@@ -702,7 +715,7 @@ C("WakeUp", 0x84,
   Notification=(0x07, ""),
   NoMoreInformation=(0x08, ""),
   IntervalCapabilitiesGet=(0x09, ""),
-  IntervalCapabilitiesReport=(0x0a, "3{XXX},3{XXX},3{XXX},3{XXX}"))
+  IntervalCapabilitiesReport=(0x0a, "3{min},3{max},3{default},3{step}"))
 
 C("Association", 0x85,
   Set=(0x1, "B{group},L{nodes}"),
@@ -784,7 +797,8 @@ C("ScreenMd", 0x92)
 C("ScreenAttributes", 0x93)
 C("Language", 0x89)
 C("MeterPulse", 0x35)
-C("MultiCmd", 0x8f)
+C("MultiCmd", 0x8f,
+  Encap=(0x01, "E{commands}"))
 C("MultiInstanceAssociation", 0x8e)
 C("Proprietary", 0x88)
 C("SwitchToggleMultilevel", 0x29)
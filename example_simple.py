@@ -23,6 +23,7 @@ Progression:
 * start the controller
 * wait for controller initialization
 * wait for each node to be interviewed
+* query the basic level of all nodes concurrently
 * terminate
 """
 
@@ -32,12 +33,15 @@ import logging
 import argparse
 import sys
 import time
+from concurrent import futures
 
 from pyzwaver.controller import Controller
 from pyzwaver.driver import Driver, MakeSerialDevice
 from pyzwaver.command_translator import CommandTranslator
 from pyzwaver import command
-from pyzwaver.node import Nodeset
+from pyzwaver import zwave as z
+from pyzwaver.node import Nodeset, InterviewScheduler, NODE_STATE_INTERVIEWED
+from pyzwaver.node_cache import NodeCache
 
 
 class MyFormatter(logging.Formatter):
@@ -96,6 +100,10 @@ def main():
                         default=30,
                         help='Lower numbers mean more verbosity')
 
+    parser.add_argument('--node_cache', type=str,
+                        default="",
+                        help='Optional file for persisting node interviews across restarts')
+
     args = parser.parse_args()
     # note: this makes sure we have at least one handler
     logging.basicConfig(level=logging.ERROR)
@@ -117,9 +125,18 @@ def main():
     print(controller)
 
     translator = CommandTranslator(driver)
-    nodeset = Nodeset(translator, controller.GetNodeId())
+    # at most two nodes are interviewed at the same time
+    scheduler = InterviewScheduler(max_active=2)
+    nodeset = Nodeset(translator, controller.GetNodeId(), scheduler)
     translator.AddListener(TestListener())
     # n.InitializeExternally(CONTROLLER.props.product, CONTROLLER.props.library_type, True)
+    cache = None
+    if args.node_cache:
+        cache = NodeCache(args.node_cache, controller.props.home_id)
+        restored = cache.Restore(nodeset, controller.nodes)
+        logging.info("restored %d nodes from cache", len(restored))
+        for n in restored:
+            nodeset.GetNode(n).Revalidate()
 
     logging.info("Pinging %d nodes", len(controller.nodes))
     for n in controller.nodes:
@@ -130,18 +147,33 @@ def main():
     not_ready = controller.nodes.copy()
     not_ready.remove(controller.GetNodeId())
     while not_ready:
-        interviewed = set()
-        for n in not_ready:
-            node = nodeset.GetNode(n)
-            if node.IsInterviewed():
-                interviewed.add(node)
+        interviewed = not_ready & nodeset.NodesInState(NODE_STATE_INTERVIEWED)
         time.sleep(2.0)
-        for node in interviewed:
+        scheduler.Tick()
+        nodeset.CheckDeadlines()
+        for n in sorted(interviewed):
+            node = nodeset.GetNode(n)
             Banner("Node %s has been interviewed" % node.n)
             print(node)
+            if cache:
+                cache.Save(node)
             not_ready.remove(node.n)
             if not_ready:
                 print("\nStill waiting for %s" % str(not_ready))
+                print(scheduler)
+
+    Banner("Querying basic levels")
+    queries = {n: nodeset.GetNode(n).Query(z.Basic_Get, {}, timeout=5.0)
+               for n in sorted(nodeset.NodesWithClass(z.Basic))}
+    for n, future in queries.items():
+        try:
+            print("node %d: level %d" % (n, future.result()["level"]))
+        except futures.TimeoutError:
+            print("node %d: no answer" % n)
+
+    if cache:
+        cache.SaveAll(nodeset)
+        cache.Close()
     driver.Terminate()
     return 0
 
@@ -54,8 +54,9 @@ from pyzwaver import zmessage
 from pyzwaver.controller import Controller, EVENT_UPDATE_COMPLETE
 from pyzwaver.driver import Driver, MakeSerialDevice
 from pyzwaver.command import NodeDescription
-from pyzwaver.command_translator import CommandTranslator
-from pyzwaver.node import Node, Nodeset, NODE_STATE_INTERVIEWED, NODE_STATE_DISCOVERED
+from pyzwaver.command_translator import CommandTranslator, DuplicateFilter
+from pyzwaver.node import Node, Nodeset, InterviewScheduler, DynamicPoller, \
+    NODE_STATE_DISCOVERED, NODE_STATE_INTERVIEWED
 from pyzwaver import zwave as z
 
 
@@ -791,6 +792,7 @@ DRIVER: Driver = None
 CONTROLLER: Controller = None
 TRANSLATOR: CommandTranslator = None
 NODESET: Nodeset = None
+POLLER: DynamicPoller = None
 DB: Db = None
 
 # ======================================================================
@@ -824,6 +826,8 @@ class NodeUpdater(object):
 
     def __init__(self):
         self._nodes_to_update = set()
+        # n -> (state, last_contact) when the node was last rendered
+        self._rendered = {}
         self._update_driver = False
         timerThread = threading.Thread(target=self._refresh_thread)
         timerThread.daemon = True
@@ -837,30 +841,41 @@ class NodeUpdater(object):
                 SendToSocket("d:" + RenderDriver(DRIVER))
             if not NODESET:
                 continue
+            # state and contact changes are not value changes
+            for n, node in list(NODESET.nodes.items()):
+                if self._rendered.get(n) != (node.state, node.last_contact):
+                    self._nodes_to_update.add(n)
             for n in self._nodes_to_update:
                 node = NODESET.GetNode(n)
+                self._rendered[n] = (node.state, node.last_contact)
                 SendToSocket("o%d:" % n + json.dumps(RenderNode(node, DB),
                                                      sort_keys=True, indent=4))
             self._update_driver = False
             self._nodes_to_update.clear()
             if count % 20 == 0:
+                discovered = (NODESET.NodesInState(NODE_STATE_DISCOVERED) |
+                              NODESET.NodesInState(NODE_STATE_INTERVIEWED))
                 for n in CONTROLLER.nodes:
-                    node: Node = NODESET.GetNode(n)
-                    if node.state < NODE_STATE_DISCOVERED:
+                    if n not in discovered:
                         TRANSLATOR.Ping(n, 3, False, "refresher")
                         time.sleep(0.5)
-                    elif node.state < NODE_STATE_INTERVIEWED:
-                        logging.warning("[%d] (%s) trigger static", n, node.state)
-                        node.RefreshStaticValues()
+            # restarts stuck interviews
+            NODESET.scheduler.Tick()
+            NODESET.CheckDeadlines()
+            if count % 5 == 0 and POLLER:
+                POLLER.Tick()
             count += 1
             time.sleep(1.0)
 
     def put(self, n, _ts, _key, _values):
         #print ("got event ", n, _key, _values)
         # SendToSocket("E:[%d] %s" % (n, "@NO EVENT@"))
-        self._nodes_to_update.add(n)
         self._update_driver = True
 
+    def put_change(self, change):
+        # only nodes whose values actually changed get re-rendered
+        self._nodes_to_update.add(change.n)
+
 
 def ControllerEventCallback(action, event):
     SendToSocket("S:" + event)
@@ -975,12 +990,13 @@ def DriverBad(driver):
 
 
 def GetControls(node: Node):
-    is_switch = node.values.HasCommandClass(z.SwitchBinary)
+    snapshot = node.values.Snapshot()
+    is_switch = snapshot.HasCommandClass(z.SwitchBinary)
     out = {
         "node_switch_on": is_switch,
         "node_switch_off": is_switch,
-        "node_slide": node.values.HasCommandClass(z.SwitchMultilevel),
-        "node_scene_refresh": node.values.HasCommandClass(z.SceneActuatorConf),
+        "node_slide": snapshot.HasCommandClass(z.SwitchMultilevel),
+        "node_scene_refresh": snapshot.HasCommandClass(z.SceneActuatorConf),
     }
     return out
 
@@ -1004,19 +1020,21 @@ def RenderAssociationGroup(no, group, name, info, lst):
 
 
 def RenderNodeCommandClasses(node: Node):
+    snapshot = node.values.Snapshot()
     out = ["<table>"]
-    for cls, name, version in sorted(node.values.CommandVersions()):
+    for cls, name, version in sorted(snapshot.CommandVersions()):
         out += ["<tr><td>%s [%d]</td><td>%d</td></tr>" % (name, cls, version)]
     out += ["</table>"]
     return out
 
 
 def RenderNodeAssociations(node: Node):
+    snapshot = node.values.Snapshot()
     out = [
         "<p>",
         "<table>",
     ]
-    for no, group, info, lst, name in node.values.Associations():
+    for no, group, info, lst, name in snapshot.Associations():
         if group:
             out.append(RenderAssociationGroup(
                 no, group, info, lst, name))
@@ -1025,7 +1043,8 @@ def RenderNodeAssociations(node: Node):
 
 
 def RenderNodeParameters(node: Node):
-    compact = CompactifyParams(node.values.Configuration())
+    snapshot = node.values.Snapshot()
+    compact = CompactifyParams(snapshot.Configuration())
     out = ["<table>"]
     for a, b, c, d in sorted(compact):
         r = str(a)
@@ -1038,7 +1057,8 @@ def RenderNodeParameters(node: Node):
 
 
 def RenderNodeScenes(node: Node):
-    compact = CompactifyParams(node.values.SceneActuatorConfiguration())
+    snapshot = node.values.Snapshot()
+    compact = CompactifyParams(snapshot.SceneActuatorConfiguration())
     out = ["<table>"]
     for a, b, c, d in sorted(compact):
         r = str(a)
@@ -1051,8 +1071,9 @@ def RenderNodeScenes(node: Node):
 
 
 def RenderMiscValues(node: Node):
+    snapshot = node.values.Snapshot()
     out = ["<table>"]
-    for _, name, values in sorted(node.values.Values()):
+    for _, name, values in sorted(snapshot.Values()):
         if name.endswith("Report"):
             name = name[:-6]
         if name.endswith("_"):
@@ -1069,9 +1090,10 @@ def _ProductLink(_manu_id, prod_type, prod_id):
 
 
 def RenderNodeBrief(node: Node, db, _is_failed):
-    readings = (RenderReadings(node.values.Sensors() +
-                               node.values.Meters() +
-                               node.values.MiscSensors()))
+    snapshot = node.values.Snapshot()
+    readings = (RenderReadings(snapshot.Sensors() +
+                               snapshot.Meters() +
+                               snapshot.MiscSensors()))
     state = node.state[2:]
     # TODO
     #if pnode.failed:
@@ -1080,13 +1102,13 @@ def RenderNodeBrief(node: Node, db, _is_failed):
     if node.last_contact:
         age = "%dm ago" % ((time.time() - node.last_contact) / 60.0)
 
-    device_type = node.values.DeviceType()
+    device_type = snapshot.DeviceType()
     description = NodeDescription(device_type)
 
     out = {
         "name": db.GetNodeName(node.n),
-        "link": _ProductLink(*node.values.ProductInfo()),
-        "switch_level": node.values.GetMultilevelSwitchLevel(),
+        "link": _ProductLink(*snapshot.ProductInfo()),
+        "switch_level": snapshot.GetMultilevelSwitchLevel(),
         "controls": GetControls(node),
         "basics": "<pre>%s</pre>\n" % node.BasicString(),
         "readings": "\n".join(readings),
@@ -1382,7 +1404,7 @@ class MyFormatter(logging.Formatter):
 
 
 def main():
-    global DRIVER, CONTROLLER, TRANSLATOR, NODESET, DB
+    global DRIVER, CONTROLLER, TRANSLATOR, NODESET, POLLER, DB
     # note: this makes sure we have at least one handler
     # logging.basicConfig(level=logging.WARNING)
     # logging.basicConfig(level=logging.ERROR)
@@ -1417,8 +1439,9 @@ def main():
     CONTROLLER.UpdateRoutingInfo()
     DRIVER.WaitUntilAllPreviousMessagesHaveBeenHandled()
     print(CONTROLLER)
-    TRANSLATOR = CommandTranslator(DRIVER)
-    NODESET = Nodeset(TRANSLATOR, CONTROLLER.GetNodeId())
+    TRANSLATOR = CommandTranslator(DRIVER, duplicates=DuplicateFilter())
+    NODESET = Nodeset(TRANSLATOR, CONTROLLER.GetNodeId(), InterviewScheduler())
+    POLLER = DynamicPoller(NODESET)
 
     cp = CONTROLLER.props.product
     NODESET.put(
@@ -1427,7 +1450,9 @@ def main():
         z.ManufacturerSpecific_Report,
         {'manufacturer': cp[0], 'type': cp[1], 'product': cp[2]})
     # The updater will do the initial pings of the nodes
-    TRANSLATOR.AddListener(NodeUpdater())
+    updater = NodeUpdater()
+    TRANSLATOR.AddListener(updater)
+    NODESET.AddChangeListener(updater)
     logging.warning("listening on port %d", OPTIONS.port)
     application.listen(OPTIONS.port)
     tornado.ioloop.IOLoop.instance().start()
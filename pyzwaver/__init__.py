@@ -4,9 +4,11 @@ from . import command_translator
 from . import controller
 from . import driver
 from . import node
+from . import node_cache
+from . import timeseries
 from . import value
 from . import zmessage
 from . import zsecurity
 from . import zwave
 
-__all__ = ['command', 'command_translator', 'controller', 'driver', 'node', 'value', 'zmessage', 'zsecurity', 'zwave']
+__all__ = ['command', 'command_translator', 'controller', 'driver', 'node', 'node_cache', 'timeseries', 'value', 'zmessage', 'zsecurity', 'zwave']
@@ -21,7 +21,13 @@ command.py contain code for parsing and assembling API_APPLICATION_COMMAND_reque
 It also contains some logic pertaining to the node state machine.
 """
 
+import collections
+import collections.abc
+import functools
+import keyword
 import logging
+import struct
+import types
 
 from pyzwaver import zwave as z
 
@@ -58,6 +64,20 @@ def StringifyCommandClass(cls):
     return z.CMD_TO_STRING.get(cls, "UNKNOWN:%d" % cls)
 
 
+_STRING_TO_SUBCMD = {v: k for k, v in z.SUBCMD_TO_STRING.items()}
+
+
+def ReportForGet(key):
+    """Returns the key of the report answering the XXX_Get command key or None"""
+    s = z.SUBCMD_TO_STRING.get(key[0] * 256 + key[1])
+    if s is None or not s.endswith("Get"):
+        return None
+    k = _STRING_TO_SUBCMD.get(s[:-3] + "Report")
+    if k is None:
+        return None
+    return k >> 8, k & 0xff
+
+
 def NodeDescription(basic_generic_specific):
     k = basic_generic_specific[1] * 256 + basic_generic_specific[2]
     v = z.GENERIC_SPECIFIC_DB.get(k)
@@ -68,20 +88,19 @@ def NodeDescription(basic_generic_specific):
 
 # ======================================================================
 def _GetSignedValue(data):
+    if (data[0] & 0x80) == 0:
+        return int.from_bytes(bytes(data), "big")
     value = 0
-    negative = (data[0] & 0x80) != 0
     for d in data:
         value <<= 8
-        if negative:
-            value += ~d
-        else:
-            value += d
+        value += ~d
+
+    value += 1
+    return -value
 
-    if negative:
-        value += 1
-        return -value
-    else:
-        return value
+
+# 10 ** exp for all possible (3 bit) exponents
+_POW10 = [pow(10, exp) for exp in range(8)]
 
 
 # ======================================================================
@@ -91,7 +110,7 @@ def _GetReading(m, index, units_extra):
     units = (c & 0x18) >> 3 | units_extra
     exp = (c & 0xe0) >> 5
     mantissa = m[index + 1: index + 1 + size]
-    value = _GetSignedValue(mantissa) / pow(10, exp)
+    value = _GetSignedValue(mantissa) / _POW10[exp]
     return index + 1 + size, units, mantissa, exp, value
 
 
@@ -99,7 +118,11 @@ def _GetTimeDelta(m, index):
     return index + 2, m[index] * 256 + m[index + 1]
 
 
-def _ParseMeter(m, index):
+def _DecodeMeter(m, index):
+    """Returns index, type, unit, exp, rate, mantissa, value, dt, mantissa2, value2
+
+    Absent trailing components are None.
+    """
     if index + 2 > len(m):
         raise ValueError("cannot parse value")
     c1 = m[index]
@@ -112,28 +135,38 @@ def _ParseMeter(m, index):
     unit = (c2 & 0x18) >> 3 | unit_extra << 2
     exp = (c2 & 0xe0) >> 5
     index += 2
-    out = {
-        "type": kind,
-        "unit": unit,
-        "exp": exp,
-        "rate": rate,
-    }
-    if index + size >= len(m):
+    # the sign of an empty mantissa is undefined
+    if size == 0 or index + size > len(m):
         raise ValueError("cannot parse value")
     mantissa = m[index: index + size]
     index += size
-    value = _GetSignedValue(mantissa) / pow(10, exp)
-    out["mantissa"], out["_value"] = mantissa, value
+    value = _GetSignedValue(mantissa) / _POW10[exp]
+    dt = None
     if index + 2 <= len(m):
         # TODO: provide non-raw version of this
-        index, out["dt"] = _GetTimeDelta(m, index)
-    n = 2
+        index, dt = _GetTimeDelta(m, index)
+    mantissa2, value2 = None, None
     if index + size <= len(m):
-        mantissa = m[index: index + size]
-        value = _GetSignedValue(mantissa) / pow(10, out["exp"])
-        out["mantissa%d" % n], out["_value%d" % n] = mantissa, value
+        mantissa2 = m[index: index + size]
+        value2 = _GetSignedValue(mantissa2) / _POW10[exp]
         index += size
-        n += 1
+    return index, kind, unit, exp, rate, mantissa, value, dt, mantissa2, value2
+
+
+def _ParseMeter(m, index):
+    index, kind, unit, exp, rate, mantissa, value, dt, mantissa2, value2 = _DecodeMeter(m, index)
+    out = {
+        "type": kind,
+        "unit": unit,
+        "exp": exp,
+        "rate": rate,
+        "mantissa": mantissa,
+        "_value": value,
+    }
+    if dt is not None:
+        out["dt"] = dt
+    if mantissa2 is not None:
+        out["mantissa2"], out["_value2"] = mantissa2, value2
     return index, out
 
 
@@ -179,13 +212,15 @@ def _ParseName(m, index):
 
 def _ParseStringWithLength(m, index):
     size = m[index]
-    return 1 + size + index, bytes(m[index + 1: size])
+    if len(m) < index + 1 + size:
+        raise ValueError("malformed string")
+    return 1 + size + index, bytes(m[index + 1: index + 1 + size])
 
 
 def _ParseStringWithLengthAndEncoding(m, index):
     encoding = m[index] >> 5
     size = m[index] & 0x1f
-    return 1 + size, {"encoding": encoding, "text": m[index + 1:index + 1 + size]}
+    return index + 1 + size, {"encoding": encoding, "text": m[index + 1:index + 1 + size]}
 
 
 def _ParseListRest(m, index):
@@ -216,6 +251,35 @@ def _ParseNonce(m, index):
     return index + size, m[index:index + size]
 
 
+def _ParseKey(m, index):
+    size = 16
+    if len(m) < index + size:
+        raise ValueError("malformed key")
+    return index + size, m[index:index + size]
+
+
+def _ParseInt24(m, index):
+    if len(m) < index + 3:
+        raise ValueError("cannot parse 24bit value")
+    return index + 3, m[index] << 16 | m[index + 1] << 8 | m[index + 2]
+
+
+def _ParseCommands(m, index):
+    """Parses a count followed by length prefixed commands"""
+    if len(m) <= index:
+        raise ValueError("malformed command list")
+    count = m[index]
+    index += 1
+    out = []
+    for i in range(count):
+        if len(m) <= index or len(m) < index + 1 + m[index]:
+            raise ValueError("malformed command list")
+        size = m[index]
+        out.append(m[index + 1:index + 1 + size])
+        index += 1 + size
+    return index, out
+
+
 def _ParseDataRest(m, index):
     size = len(m) - index
     return index + size, m[index:index + size]
@@ -264,7 +328,8 @@ def _ParseOptionalTarget(m, index):
     return index, out
 
 
-def _ParseSensor(m, index):
+def _DecodeSensor(m, index):
+    """Returns index, exp, unit, mantissa, value"""
     # we need at least two bytes
     if len(m) < index + 2:
         raise ValueError("malformed sensor string")
@@ -280,9 +345,14 @@ def _ParseSensor(m, index):
         raise ValueError("malformed sensor string precision:%d unit:%d size:%d" %
                          (precision, unit, size))
     mantissa = m[index + 1: index + 1 + size]
-    value = _GetSignedValue(mantissa) / pow(10, precision)
-    return index + 1 + size, {"exp": precision, "unit": unit, "mantissa": mantissa,
-                              "_value": value}
+    value = _GetSignedValue(mantissa) / _POW10[precision]
+    return index + 1 + size, precision, unit, mantissa, value
+
+
+def _ParseSensor(m, index):
+    index, precision, unit, mantissa, value = _DecodeSensor(m, index)
+    return index, {"exp": precision, "unit": unit, "mantissa": mantissa,
+                   "_value": value}
 
 
 def _ParseValue(m, index):
@@ -291,6 +361,23 @@ def _ParseValue(m, index):
     return index + 1 + size, {"size": size, "value": _GetIntBigEndian(m[start:start + size])}
 
 
+def _ParseProperties(m, index):
+    """Parses the format byte and min/max/default of a Configuration_PropertiesReport"""
+    if len(m) <= index:
+        raise ValueError("malformed parameter properties")
+    c = m[index]
+    size = c & 7
+    index += 1
+    if len(m) < index + 3 * size:
+        raise ValueError("malformed parameter properties size: %d" % size)
+    values = []
+    for i in range(3):
+        values.append(_GetIntBigEndian(m[index:index + size]))
+        index += size
+    return index, {"size": size, "format": (c >> 3) & 7, "flags": c >> 6,
+                   "min": values[0], "max": values[1], "default": values[2]}
+
+
 def _ParseDate(m, index):
     if len(m) < index + 7:
         raise ValueError("malformed time data")
@@ -320,6 +407,10 @@ _PARSE_ACTIONS = {
     "D": _ParseDataRest,  # as Uint8List
     "T": _ParseSizedLittleEndianInt,
     "X": _ParseSensor,
+    "K": _ParseKey,
+    "E": _ParseCommands,
+    "P": _ParseProperties,
+    "3": _ParseInt24,
     'b': _ParseOptionalByte,
     't': _ParseOptionalTarget,
 }
@@ -333,8 +424,8 @@ def _GetParameterDescriptors(m):
     return z.SUBCMD_TO_PARSE_TABLE[key]
 
 
-def ParseCommand(m):
-    """ParseCommand decodes an API_APPLICATION_COMMAND request into a map of values"""
+def _ParseCommandGeneric(m):
+    """Table interpreting version of ParseCommand - used as a reference"""
     table = _GetParameterDescriptors(m)
 
     if table is None:
@@ -380,126 +471,985 @@ def _MakeDate(date):
 def _MakeSensor(args):
     m = args["mantissa"]
     c = args["exp"] << 5 | args["unit"] << 3 | len(m)
-    return [c] + m
+    return [c] + list(m)
 
 
 def _MakeMeter(args):
-    c1 = (args["unit"] & 4) << 7 | args["rate"] << 5 | (args["type"] & 0x1f)
+    c1 = (args["unit"] & 4) << 5 | args["rate"] << 5 | (args["type"] & 0x1f)
     c2 = args["exp"] << 5 | (args["unit"] & 3) << 3 | len(args["mantissa"])
     delta = []
     if "dt" in args:
         dt = args["dt"]
         delta = [dt >> 8, dt & 0xff]
-    return [c1, c2] + args["mantissa"] + delta + args.get("mantissa2", [])
+    return [c1, c2] + list(args["mantissa"]) + delta + list(args.get("mantissa2", []))
 
 
-# raw_cmd: [class, subcommand, arg1, arg2, ....]
-def AssembleCommand(cmd0, cmd1, args):
+# all assemblers append the encoding of v to data
+
+def _AssembleByte(data, v):
+    data.append(v)
+
+
+def _AssembleWord(data, v):
+    data.append((v >> 8) & 0xff)
+    data.append(v & 0xff)
+
+
+def _AssembleName(data, v):
+    data.append(v["encoding"])
+    data += v["text"]
+
+
+def _AssembleStringWithLength(data, v):
+    data.append(len(v))
+    data += v
+
+
+def _AssembleGroups(data, v):
+    data.append(len(v))
+    for num, profile, event in v:
+        data += (num, 0, profile >> 8, profile & 0xff, 0, event >> 8, event & 0xff)
+
+
+def _AssembleCommands(data, v):
+    data.append(len(v))
+    for c in v:
+        data.append(len(c))
+        data += c
+
+
+def _AssembleInt24(data, v):
+    data += (v >> 16 & 0xff, v >> 8 & 0xff, v & 0xff)
+
+
+def _AssembleKey(data, v):
+    if len(v) != 16:
+        raise ValueError("bad key parameter of length %d" % len(v))
+    data += v
+
+
+def _AssembleList(data, v):
+    data += v
+
+
+def _AssembleDate(data, v):
+    data += _MakeDate(v)
+
+
+def _AssembleNonce(data, v):
+    if len(v) != 8:
+        raise ValueError("bad nonce parameter of length %d" % len(v))
+    data += v
+
+
+def _AssembleValue(data, v):
+    size = v["size"]
+    value = v["value"]
+    data.append(size)
+    for i in reversed(range(size)):
+        data.append((value >> 8 * i) & 0xff)
+
+
+def _AssembleProperties(data, v):
+    size = v["size"]
+    data.append(v["flags"] << 6 | v["format"] << 3 | size)
+    for x in (v["min"], v["max"], v["default"]):
+        for i in reversed(range(size)):
+            data.append((x >> 8 * i) & 0xff)
+
+
+def _AssembleSensor(data, v):
+    data += _MakeSensor(v)
+
+
+def _AssembleMeter(data, v):
+    data += _MakeMeter(v)
+
+
+def _AssembleStringWithLengthAndEncoding(data, v):
+    m = v["text"]
+    c = (v["encoding"] << 5) | len(m)
+    data.append(c)
+    data += m
+
+
+def _AssembleRestLittleEndianInt(data, v):
+    value = v["value"]
+    for i in range(v["size"]):
+        data.append(value & 0xff)
+        value >>= 8
+
+
+def _AssembleSizedLittleEndianInt(data, v):
+    data.append(v["size"])
+    _AssembleRestLittleEndianInt(data, v)
+
+
+def _AssembleOptionalByte(data, v):
+    if v is not None:
+        data.append(v)
+
+
+def _AssembleOptionalTarget(data, v):
+    if v is not None:
+        data.append(len(v))
+        for w in v:
+            data.append((w >> 8) & 255)
+            data.append(w & 255)
+
+
+_ASSEMBLE_ACTIONS = {
+    'B': _AssembleByte,
+    'W': _AssembleWord,
+    'N': _AssembleName,
+    'K': _AssembleKey,
+    'D': _AssembleList,
+    'L': _AssembleList,
+    'C': _AssembleDate,
+    'O': _AssembleNonce,
+    'V': _AssembleValue,
+    'X': _AssembleSensor,
+    'M': _AssembleMeter,
+    'F': _AssembleStringWithLengthAndEncoding,
+    'R': _AssembleRestLittleEndianInt,
+    'T': _AssembleSizedLittleEndianInt,
+    'A': _AssembleStringWithLength,
+    'G': _AssembleGroups,
+    '3': _AssembleInt24,
+    'E': _AssembleCommands,
+    'P': _AssembleProperties,
+    'b': _AssembleOptionalByte,
+    't': _AssembleOptionalTarget,
+}
+
+
+def _AssembleCommandGeneric(cmd0, cmd1, args):
+    """Table interpreting version of AssembleCommand - used as a reference"""
     table = z.SUBCMD_TO_PARSE_TABLE[cmd0 * 256 + cmd1]
     assert table is not None
     data = [
         cmd0,
         cmd1
     ]
-    # logging.debug("${raw_cmd[0]} ${raw_cmd[1]}: table length:
-    # ${table.length}")
     for t in table:
         kind = t[0]
         name = t[2:-1]
         v = args.get(name)
         if v is None and kind not in _OPTIONAL_COMPONENTS:
             raise ValueError("missing args for [%s]" % name)
+        action = _ASSEMBLE_ACTIONS.get(kind)
+        if action is None:
+            raise ValueError("unknown parameter  type: %s" % kind)
+        action(data, v)
+    return data
+
+
+# ======================================================================
+# Records
+#
+# ParseCommandAsRecord() returns instances of small classes with __slots__
+# instead of dicts: one class per command plus a few classes for nested
+# values. Lists become tuples.
+# Records support the read only part of the dict API, so code like
+# values["level"], values.get("level") or "level" in values keeps working.
+# Optional fields which are not present in a message are not set.
+# ======================================================================
+
+class Record(collections.abc.Mapping):
+    __slots__ = ()
+    _FIELDS = frozenset()
+    # used for pickling
+    _KIND = None
+
+    def __getitem__(self, name):
+        if name not in self._FIELDS:
+            raise KeyError(name)
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __iter__(self):
+        for name in self.__slots__:
+            if hasattr(self, name):
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join("%s=%r" % kv for kv in self.items()))
+
+    def __reduce__(self):
+        return _UnpickleRecord, (self._KIND, tuple(self.items()))
+
+
+class SensorReading(Record):
+    __slots__ = ("exp", "unit", "mantissa", "_value")
+    _FIELDS = frozenset(__slots__)
+    _KIND = "SensorReading"
+
+    def __init__(self, exp, unit, mantissa, value):
+        self.exp = exp
+        self.unit = unit
+        self.mantissa = mantissa
+        self._value = value
+
+
+class MeterReading(Record):
+    __slots__ = ("type", "unit", "exp", "rate", "mantissa", "_value", "dt", "mantissa2", "_value2")
+    _FIELDS = frozenset(__slots__)
+    _KIND = "MeterReading"
+
+    def __init__(self, kind, unit, exp, rate, mantissa, value, dt, mantissa2, value2):
+        self.type = kind
+        self.unit = unit
+        self.exp = exp
+        self.rate = rate
+        self.mantissa = mantissa
+        self._value = value
+        if dt is not None:
+            self.dt = dt
+        if mantissa2 is not None:
+            self.mantissa2 = mantissa2
+            self._value2 = value2
+
+
+class SizedValue(Record):
+    __slots__ = ("size", "value")
+    _FIELDS = frozenset(__slots__)
+    _KIND = "SizedValue"
+
+    def __init__(self, size, value):
+        self.size = size
+        self.value = value
+
+
+class EncodedText(Record):
+    __slots__ = ("encoding", "text", "_decoded")
+    _FIELDS = frozenset(__slots__)
+    _KIND = "EncodedText"
+
+    def __init__(self, encoding, text, decoded=None):
+        self.encoding = encoding
+        self.text = text
+        if decoded is not None:
+            self._decoded = decoded
+
+
+class ParameterProperties(Record):
+    __slots__ = ("size", "format", "flags", "min", "max", "default")
+    _FIELDS = frozenset(__slots__)
+    _KIND = "ParameterProperties"
+
+    def __init__(self, size, format, flags, min, max, default):
+        self.size = size
+        self.format = format
+        self.flags = flags
+        self.min = min
+        self.max = max
+        self.default = default
+
+
+_NESTED_RECORDS = {
+    "SensorReading": SensorReading,
+    "MeterReading": MeterReading,
+    "SizedValue": SizedValue,
+    "EncodedText": EncodedText,
+    "ParameterProperties": ParameterProperties,
+}
+
+
+def _ParseSensorRecord(m, index):
+    index, precision, unit, mantissa, value = _DecodeSensor(m, index)
+    return index, SensorReading(precision, unit, tuple(mantissa), value)
+
+
+def _ParseMeterRecord(m, index):
+    index, kind, unit, exp, rate, mantissa, value, dt, mantissa2, value2 = _DecodeMeter(m, index)
+    if mantissa2 is not None:
+        mantissa2 = tuple(mantissa2)
+    return index, MeterReading(kind, unit, exp, rate, tuple(mantissa), value, dt, mantissa2, value2)
+
+
+def _SizedValueRecord(parser):
+    def parse(m, index):
+        index, v = parser(m, index)
+        return index, SizedValue(v["size"], v["value"])
+
+    return parse
+
+
+def _EncodedTextRecord(parser):
+    def parse(m, index):
+        index, v = parser(m, index)
+        return index, EncodedText(v["encoding"], tuple(v["text"]), v.get("_decoded"))
+
+    return parse
+
+
+def _TupleRecord(parser):
+    def parse(m, index):
+        index, v = parser(m, index)
+        if v is not None:
+            v = tuple(v)
+        return index, v
+
+    return parse
+
+
+def _ParsePropertiesRecord(m, index):
+    index, v = _ParseProperties(m, index)
+    return index, ParameterProperties(**v)
+
+
+def _ParseCommandsRecord(m, index):
+    index, v = _ParseCommands(m, index)
+    return index, tuple(tuple(c) for c in v)
+
+
+_RECORD_PARSE_ACTIONS = dict(_PARSE_ACTIONS)
+_RECORD_PARSE_ACTIONS.update({
+    'C': _TupleRecord(_ParseDate),
+    'D': _TupleRecord(_ParseDataRest),
+    'E': _ParseCommandsRecord,
+    'F': _EncodedTextRecord(_ParseStringWithLengthAndEncoding),
+    'G': _TupleRecord(_ParseGroups),
+    'K': _TupleRecord(_ParseKey),
+    'L': _TupleRecord(_ParseListRest),
+    'M': _ParseMeterRecord,
+    'N': _EncodedTextRecord(_ParseName),
+    'O': _TupleRecord(_ParseNonce),
+    'P': _ParsePropertiesRecord,
+    'R': _SizedValueRecord(_ParseRestLittleEndianInt),
+    'T': _SizedValueRecord(_ParseSizedLittleEndianInt),
+    'V': _SizedValueRecord(_ParseValue),
+    'X': _ParseSensorRecord,
+    't': _TupleRecord(_ParseOptionalTarget),
+})
+
+_RECORD_CLASSES = {}
+
+
+def _MakeRecordClass(key):
+    table = z.SUBCMD_TO_PARSE_TABLE[key]
+    # dict.fromkeys removes duplicates while preserving the order
+    names = list(dict.fromkeys(t[2:-1] for t in table))
+    name = z.SUBCMD_TO_STRING.get(key, "Command_%04x" % key)
+    cls = type(name, (Record,), {
+        "__slots__": tuple(names),
+        "_FIELDS": frozenset(names),
+        "_KIND": key,
+        "__module__": __name__,
+    })
+    # field names like "class" cannot be assigned with the usual syntax
+    # so those are initialized via their slot descriptors
+    ns = {}
+    params = []
+    lines = []
+    for i, t in enumerate(table):
+        param = "p%d" % i
+        params.append(param)
+        name = t[2:-1]
+        if keyword.iskeyword(name):
+            setter = "_set%d" % i
+            ns[setter] = cls.__dict__[name].__set__
+            assign = "%s(self, %s)" % (setter, param)
+        else:
+            assign = "self.%s = %s" % (name, param)
+        if t[0] in _OPTIONAL_COMPONENTS:
+            lines.append("    if %s is not None:" % param)
+            lines.append("        " + assign)
+        else:
+            lines.append("    " + assign)
+    src = "def __init__(%s):\n%s\n" % (", ".join(["self"] + params),
+                                        "\n".join(lines or ["    pass"]))
+    exec(src, ns)
+    cls.__init__ = ns["__init__"]
+    return cls
+
+
+def _RecordClass(key):
+    cls = _RECORD_CLASSES.get(key)
+    if cls is None:
+        cls = _MakeRecordClass(key)
+        _RECORD_CLASSES[key] = cls
+    return cls
+
+
+def _UnpickleRecord(kind, items):
+    if isinstance(kind, str):
+        cls = _NESTED_RECORDS[kind]
+    else:
+        cls = _RecordClass(kind)
+    r = cls.__new__(cls)
+    for name, v in items:
+        setattr(r, name, v)
+    return r
+
+
+# ======================================================================
+# Compiled parsers and assemblers
+#
+# Interpreting the descriptor strings of z.SUBCMD_TO_PARSE_TABLE for every
+# message is wasteful. Instead each table entry is translated (once, on first
+# use) into python source for a specialised parse and assemble function.
+# Runs of fixed width fields are handled inline: runs of bytes by plain
+# indexing, runs containing words by a single precompiled struct.Struct.
+# ======================================================================
+
+_FIXED_WIDTH = {'B': ('B', 1), 'W': ('H', 2)}
+
+_CODEGEN_GLOBALS = {}
+for _k, _f in _PARSE_ACTIONS.items():
+    _CODEGEN_GLOBALS["_P_" + _k] = _f
+for _k, _f in _RECORD_PARSE_ACTIONS.items():
+    _CODEGEN_GLOBALS["_Q_" + _k] = _f
+for _k, _f in _ASSEMBLE_ACTIONS.items():
+    _CODEGEN_GLOBALS["_A_" + _k] = _f
+
+
+def _SplitIntoRuns(table):
+    """Groups the table into runs of fixed width fields and single variable fields"""
+    runs = []
+    for t in table:
+        kind, name = t[0], t[2:-1]
+        if kind in _FIXED_WIDTH and runs and runs[-1][0]:
+            runs[-1][1].append((kind, name))
+        else:
+            runs.append((kind in _FIXED_WIDTH, [(kind, name)]))
+    return runs
+
+
+def _FixedRunStruct(fields):
+    return struct.Struct(">" + "".join(_FIXED_WIDTH[k][0] for k, _ in fields))
+
+
+def _FunctionName(prefix, key):
+    s = z.SUBCMD_TO_STRING.get(key, "%04x" % key)
+    return "%s_%s" % (prefix, s)
+
+
+def _GenerateParser(key, table, ns, records=False):
+    fun = _FunctionName("_ParseRecord" if records else "_Parse", key)
+    lines = ["def %s(m):" % fun]
+    emit = lines.append
+    if any(t[0] == 'W' for t in table):
+        emit("    b = bytes(m)")
+    # offset of the next field if statically known otherwise None
+    offset = 2
+    # local variable holding the value of each field
+    values = []
+    for no, (fixed, fields) in enumerate(_SplitIntoRuns(table)):
+        pos = "index" if offset is None else "%d" % offset
+        if fixed:
+            width = sum(_FIXED_WIDTH[k][1] for k, _ in fields)
+            if offset is None:
+                emit("    if len(m) < index + %d:" % width)
+            else:
+                emit("    if len(m) < %d:" % (offset + width))
+            emit("        raise ValueError(\"cannot parse %s\")" %
+                 ",".join(n for _, n in fields))
+            first = len(values)
+            values += ["f%d" % i for i in range(first, first + len(fields))]
+            if any(k == 'W' for k, _ in fields):
+                st = "_S%d" % no
+                ns[st] = _FixedRunStruct(fields)
+                emit("    %s, = %s.unpack_from(b, %s)" % (", ".join(values[first:]), st, pos))
+            else:
+                for i, v in enumerate(values[first:]):
+                    if offset is None:
+                        emit("    %s = m[index + %d]" % (v, i))
+                    else:
+                        emit("    %s = m[%d]" % (v, offset + i))
+            if offset is None:
+                emit("    index += %d" % width)
+            else:
+                offset += width
+        else:
+            kind = fields[0][0]
+            if kind not in _PARSE_ACTIONS:
+                emit("    raise ValueError(\"unknown parameter type: %s\")" % kind)
+                return fun, lines
+            v = "f%d" % len(values)
+            values.append(v)
+            emit("    index, %s = _%s_%s(m, %s)" % (v, "Q" if records else "P", kind, pos))
+            offset = None
+    if records:
+        ns["_R"] = _RecordClass(key)
+        emit("    return _R(%s)" % ", ".join(values))
+        return fun, lines
+    items = ["%r: %s" % (t[2:-1], v) for t, v in zip(table, values)
+             if t[0] not in _OPTIONAL_COMPONENTS]
+    emit("    out = {%s}" % ", ".join(items))
+    for t, v in zip(table, values):
+        if t[0] in _OPTIONAL_COMPONENTS:
+            emit("    if %s is not None:" % v)
+            emit("        out[%r] = %s" % (t[2:-1], v))
+    emit("    return out")
+    return fun, lines
+
+
+def _GenerateAssembler(key, table, ns):
+    fun = _FunctionName("_Assemble", key)
+    lines = ["def %s(args):" % fun]
+    emit = lines.append
+    emit("    data = [%d, %d]" % (key >> 8, key & 0xff))
+    for no, (fixed, fields) in enumerate(_SplitIntoRuns(table)):
+        values = []
+        for i, (kind, name) in enumerate(fields):
+            v = "v%d_%d" % (no, i)
+            values.append(v)
+            emit("    %s = args.get(%r)" % (v, name))
+            if kind not in _OPTIONAL_COMPONENTS:
+                emit("    if %s is None:" % v)
+                emit("        raise ValueError(\"missing args for [%s]\")" % name)
+        if fixed:
+            if any(k == 'W' for k, _ in fields):
+                st = "_S%d" % no
+                ns[st] = _FixedRunStruct(fields)
+                emit("    data += %s.pack(%s)" % (st, ", ".join(values)))
+            elif len(values) == 1:
+                emit("    data.append(%s)" % values[0])
+            else:
+                emit("    data += (%s)" % ", ".join(values))
+        else:
+            kind = fields[0][0]
+            if kind not in _ASSEMBLE_ACTIONS:
+                emit("    raise ValueError(\"unknown parameter  type: %s\")" % kind)
+                return fun, lines
+            emit("    _A_%s(data, %s)" % (kind, values[0]))
+    emit("    return data")
+    return fun, lines
+
+
+def _Compile(generator, key):
+    table = z.SUBCMD_TO_PARSE_TABLE[key]
+    ns = dict(_CODEGEN_GLOBALS)
+    fun, lines = generator(key, table, ns)
+    exec("\n".join(lines) + "\n", ns)
+    return ns[fun]
+
+
+class _CompiledFunctions(dict):
+    """Maps command keys (cmd0 * 256 + cmd1) to compiled functions
+
+    Functions are compiled on first use. Unknown keys raise a KeyError.
+    """
+
+    def __init__(self, generator):
+        super().__init__()
+        self._generator = generator
+
+    def __missing__(self, key):
+        f = _Compile(self._generator, key)
+        self[key] = f
+        return f
+
+
+_PARSERS = _CompiledFunctions(_GenerateParser)
+_RECORD_PARSERS = _CompiledFunctions(functools.partial(_GenerateParser, records=True))
+_ASSEMBLERS = _CompiledFunctions(_GenerateAssembler)
+
+
+def ParseCommand(m):
+    """ParseCommand decodes an API_APPLICATION_COMMAND request into a map of values"""
+    if len(m) < 2:
+        logging.error("malformed command %s", m)
+        raise ValueError("unknown command")
+    return _PARSERS[m[0] * 256 + m[1]](m)
+
+
+def ParseCommandAsRecord(m):
+    """Like ParseCommand but returns a Record instead of a dict
+
+    Records use considerably less memory than dicts which matters for
+    values which are cached for a long time.
+    """
+    if len(m) < 2:
+        logging.error("malformed command %s", m)
+        raise ValueError("unknown command")
+    return _RECORD_PARSERS[m[0] * 256 + m[1]](m)
+
+
+# raw_cmd: [class, subcommand, arg1, arg2, ....]
+def AssembleCommand(cmd0, cmd1, args):
+    return _ASSEMBLERS[cmd0 * 256 + cmd1](args)
+
+
+# ======================================================================
+# Lazy command views
+#
+# A CommandView wraps a memoryview of the raw command and only decodes
+# what is being looked at. Fields at a statically known offset (the
+# leading run of bytes and words) are read straight from the buffer.
+# Everything else triggers a single full decode which is memoized.
+# ======================================================================
+
+class _ViewLayouts(dict):
+    """Maps command keys (tuples) to {name: (offset, kind)} for all fields
+    at a statically known offset
+
+    Unknown keys raise a KeyError.
+    """
+
+    def __missing__(self, key):
+        layout = {}
+        runs = _SplitIntoRuns(z.SUBCMD_TO_PARSE_TABLE[key[0] * 256 + key[1]])
+        if runs and runs[0][0]:
+            offset = 2
+            for kind, name in runs[0][1]:
+                layout[name] = (offset, kind)
+                offset += _FIXED_WIDTH[kind][1]
+        self[key] = layout
+        return layout
+
+
+_VIEW_LAYOUTS = _ViewLayouts()
+
+
+def _DecodePatched(m):
+    return ParseCommand(MaybePatchCommand(list(m)))
+
+
+class CommandView(collections.abc.Mapping):
+    """Read only, lazily decoded view of a raw command
+
+    raw is a bytes like object, typically a memoryview slice of the
+    received frame. It is not copied, so the underlying buffer must not
+    change while the view is alive.
+    Decoding problems only surface when the affected field is accessed.
+
+    If static is False fields are never read straight from the buffer.
+    This is required if decode patches the command (see QuirkRegistry).
+    By default it is False for commands with quirks in the global registry.
+    """
+    __slots__ = ("raw", "key", "_layout", "_decode", "_values")
+
+    def __init__(self, raw, decode=_DecodePatched, static=None):
+        try:
+            key = (raw[0], raw[1])
+        except IndexError:
+            logging.error("malformed command %s", bytes(raw))
+            raise ValueError("unknown command")
+        self.raw = raw
+        self.key = key
+        # raises a KeyError for unknown commands just like ParseCommand
+        layout = _VIEW_LAYOUTS[key]
+        if static is None:
+            static = not QUIRKS.HasQuirks(key)
+        self._layout = layout if static else {}
+        self._decode = decode
+        self._values = None
+
+    def Decode(self):
+        """Returns the fully decoded values (memoized)"""
+        if self._values is None:
+            self._values = self._decode(self.raw)
+        return self._values
+
+    def _GetStatic(self, name):
+        """Returns the field if it can be read directly from the buffer otherwise None"""
+        field = self._layout.get(name)
+        if field is None:
+            return None
+        offset, kind = field
+        raw = self.raw
         if kind == 'B':
-            data.append(v)
-        elif kind == 'W':
-            data.append((v >> 8) & 0xff)
-            data.append(v & 0xff)
-        elif kind == 'N':
-            data.append(1)
-            # for c in v:
-            # out.append(ord(c))
-        elif kind == 'K':
-            if len(v) != 16:
-                raise ValueError("bad key parameter of length %d" % len(v))
-            data += v
-        elif kind == 'D':
-            data += v
-        elif kind == 'L':
-            data += v
-        elif kind == 'C':
-            data += _MakeDate(v)
-        elif kind == 'O':
-            if len(v) != 8:
-                raise ValueError("bad nonce parameter of length %d" % len(v))
-            data += v
-        elif kind == 'V':
-            size = v["size"]
-            value = v["value"]
-            data += [size]
-            for i in reversed(range(size)):
-                data += [(value >> 8 * i) & 0xff]
-        elif kind == 'X':
-            data += _MakeSensor(v)
-        elif kind == 'M':
-            data += _MakeMeter(v)
-        elif kind == 'F':
-            m = v["text"]
-            c = (v["encoding"] << 5) | len(m)
-            data += [c] + v["text"]
-        elif kind == 'R':
-            value = v["value"]
-            for i in range(v["size"]):
-                data += [value & 0xff]
-                value >>= 8
-        elif kind == 'b':
+            if offset < len(raw):
+                return raw[offset]
+        elif offset + 1 < len(raw):
+            return raw[offset] << 8 | raw[offset + 1]
+        return None
+
+    def __getitem__(self, name):
+        if self._values is None:
+            v = self._GetStatic(name)
             if v is not None:
-                data.append(v)
-        elif kind == 't':
+                return v
+            self._values = self._decode(self.raw)
+        return self._values[name]
+
+    def get(self, name, default=None):
+        if self._values is None:
+            v = self._GetStatic(name)
             if v is not None:
-                data.append(len(v))
-                for w in v:
-                    data.append((w >> 8) & 255)
-                    data.append(w & 255)
-        else:
-            raise ValueError("unknown parameter  type: %s" % kind)
+                return v
+            self._values = self._decode(self.raw)
+        return self._values.get(name, default)
+
+    def __contains__(self, name):
+        if self._values is None and self._GetStatic(name) is not None:
+            return True
+        return name in self.Decode()
+
+    def __iter__(self):
+        return iter(self.Decode())
+
+    def __len__(self):
+        return len(self.Decode())
+
+    def __repr__(self):
+        return "CommandView(%s, %s)" % (StringifyCommand(self.key), Hexify(self.raw[2:]))
+
+
+# ======================================================================
+# Parse cache
+# ======================================================================
+
+def FreezeValue(v):
+    """Returns an immutable version of a parsed value
+
+    dicts become read only mappings and lists become tuples.
+    Records are left alone as they only offer a read only interface.
+    """
+    if isinstance(v, dict):
+        return types.MappingProxyType({k: FreezeValue(x) for k, x in v.items()})
+    if isinstance(v, list):
+        return tuple(FreezeValue(x) for x in v)
+    return v
+
+
+class ParseCache:
+    """Bounded LRU cache for decoded commands keyed by the raw command bytes
+
+    Many devices keep sending byte identical reports so most lookups are hits.
+    decode(raw) must return (key, values) and must only depend on raw.
+    raw is usually the command bytes but can be any hashable which
+    determines the decoding, e.g. (product, bytes) if quirks are involved.
+    The cached values are frozen (see FreezeValue()) as they are shared
+    between all recipients.
+    """
+
+    def __init__(self, decode, max_size=256):
+        assert max_size > 0
+        self._decode = decode
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def Get(self, raw):
+        entries = self._entries
+        e = entries.get(raw)
+        if e is not None:
+            self.hits += 1
+            entries.move_to_end(raw)
+            return e
+        self.misses += 1
+        key, values = self._decode(raw)
+        e = key, FreezeValue(values)
+        entries[raw] = e
+        if len(entries) > self._max_size:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return e
+
+    def Clear(self):
+        self._entries.clear()
+
+    def HitRate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "size: %d/%d  hits: %d  misses: %d  evictions: %d  hit-rate: %.1f%%" % (
+            len(self._entries), self._max_size, self.hits, self.misses, self.evictions,
+            100.0 * self.HitRate())
 
-    return data
 
+# ======================================================================
+# Encapsulation (MultiCmd and MultiChannel)
+# ======================================================================
+
+# Upper bound for the size of a command sent via API_ZW_SEND_DATA
+MAX_COMMAND_PAYLOAD = 46
+
+# overhead of MultiCmd_Encap: class, subcommand, count
+_MULTI_CMD_HEADER = 3
+
+
+def PackMultiCmd(raw_commands, max_payload=MAX_COMMAND_PAYLOAD):
+    """Packs raw commands into as few MultiCmd_Encap commands as possible
+
+    Order is preserved. Each encapsulated command stays within max_payload bytes.
+    Commands which cannot be combined with their neighbors are returned as is.
+    """
+    out = []
+    bundle = []
+    size = _MULTI_CMD_HEADER
+
+    def flush():
+        if len(bundle) == 1:
+            out.append(bundle[0])
+        elif bundle:
+            out.append(AssembleCommand(z.MultiCmd, z.MultiCmd_Encap[1], {"commands": bundle}))
+
+    for raw in raw_commands:
+        if bundle and size + 1 + len(raw) > max_payload:
+            flush()
+            bundle = []
+            size = _MULTI_CMD_HEADER
+        bundle.append(raw)
+        size += 1 + len(raw)
+    flush()
+    return out
+
+
+# MultiChannel_ChannelEncap destination flag: the lower 7 bits are a bit mask
+# selecting endpoints 1-7
+_BIT_ADDRESS = 0x80
+
+
+def _ChannelEncap(dst, raw_cmd):
+    return AssembleCommand(z.MultiChannel, z.MultiChannel_ChannelEncap[1],
+                           {"src": 0, "dst": dst, "command": raw_cmd})
+
+
+def EncapsulateForEndpoints(endpoints, raw_cmd, bit_addressing=False):
+    """Returns the MultiChannel_ChannelEncap commands delivering raw_cmd to all endpoints
+
+    With bit_addressing a single command reaches all of the endpoints 1-7
+    (Set type commands only).
+    """
+    rest = sorted(set(endpoints))
+    out = []
+    if bit_addressing:
+        low = [e for e in rest if 1 <= e <= 7]
+        if len(low) > 1:
+            mask = 0
+            for e in low:
+                mask |= 1 << (e - 1)
+            out.append(_ChannelEncap(_BIT_ADDRESS | mask, raw_cmd))
+            rest = [e for e in rest if e > 7]
+    for e in rest:
+        out.append(_ChannelEncap(e, raw_cmd))
+    return out
+
+
+def EndpointsFromDestination(dst):
+    """Inverse of the destination encoding used by EncapsulateForEndpoints"""
+    if dst & _BIT_ADDRESS:
+        return [e + 1 for e in range(7) if dst & (1 << e)]
+    return [dst]
+
+
+# ======================================================================
+# Device quirks
+#
+# Some devices send malformed commands. Quirks fix up the raw command
+# (a list of ints) in place before it is parsed.
+# A quirk applies to one command key and optionally only to a certain
+# product (manufacturer, type, product) as reported by
+# ManufacturerSpecific_Report (see NodeValues.ProductInfo()).
+# Components of the product may be None to match anything.
+# ======================================================================
 
-def MaybePatchCommand(m):
-    # if m[0] == z.MultiInstance and m[1] == z.MultiInstance_Encap:
-    #    logging.warning("received MultiInstance_Encap for instance")
-    #    return m[4:]
-
-    if ((m[0], m[1]) == z.SensorMultilevel_Report and
-            m[2] == 1 and
-            ((m[3] & 7) > len(m) - 4)):
-        x = 1 << 5 | (0 << 3) | 2
-        # [49, 5, 1, 127, 1, 10] => [49, 5, 1, X, 1, 10]
-        logging.error(
-            "A fixing up SensorMultilevel_Report %s: [3] %02x-> %02x", Hexify(m), m[3], x)
-        m[3] = x
-
-    if ((m[0], m[1]) == z.SensorMultilevel_Report and
-            m[2] == 1 and
-            (m[3] & 0x10) != 0):
-        x = m[3] & 0xe7
-        logging.error(
-            "B fixing up SensorMultilevel_Report %s: [3] %02x-> %02x", Hexify(m), m[3], x)
-        m[3] = x
-
-    if (m[0], m[1]) == z.Version_CommandClassReport and len(m) == 3:
-        m.append(1)
-    # if (m[0], m[1]) == z.SensorMultilevel_Report and (m[3] & 7) not in (1, 2, 4):
-    #     size = m[3] & 7
-    #     if size == 3:
-    #         size = 2
-    #     elif size == 7:
-    #         size = 1
-    #     elif size == 6:
-    #         size = 2
-    #     x = m[3] & 0xf8 | size
-    #     logging.error(
-    #         "C fixing up SensorMultilevel_Report %s: [3] %02x-> %02x", Hexify(m), m[3], x)
-    #     m[3] = x
-    return m
+class Quirk:
+
+    def __init__(self, name, key, fix, product=None):
+        """fix(m) patches the command m in place and returns True if it did anything"""
+        self.name = name
+        self.key = key
+        self.fix = fix
+        self.product = product
+        self.fired = 0
+
+    def Matches(self, product):
+        if self.product is None:
+            return True
+        if product is None:
+            return False
+        for a, b in zip(self.product, product):
+            if a is not None and a != b:
+                return False
+        return True
+
+    def __str__(self):
+        return "%s %s %s fired: %d" % (self.name, StringifyCommand(self.key), self.product, self.fired)
+
+
+class QuirkRegistry:
+    """Collection of quirks indexed by command key
+
+    Commands without a matching key cost a single dict lookup.
+    """
+
+    def __init__(self, quirks=()):
+        # cmd0 * 256 + cmd1 -> list of quirks
+        self._dispatch = {}
+        # True if some quirks are product specific
+        self.product_specific = False
+        for q in quirks:
+            self.Add(q)
+
+    def Add(self, quirk: Quirk):
+        self._dispatch.setdefault(quirk.key[0] * 256 + quirk.key[1], []).append(quirk)
+        if quirk.product is not None:
+            self.product_specific = True
+
+    def Quirks(self):
+        return [q for quirks in self._dispatch.values() for q in quirks]
+
+    def HasQuirks(self, key):
+        """Returns True if some quirk (for any product) patches command key"""
+        return key[0] * 256 + key[1] in self._dispatch
+
+    def Apply(self, m, product=None):
+        """Patches the command m (a list of ints) in place and returns it"""
+        quirks = self._dispatch.get(m[0] * 256 + m[1])
+        if quirks is None:
+            return m
+        for q in quirks:
+            if q.Matches(product) and q.fix(m):
+                q.fired += 1
+        return m
+
+    def __str__(self):
+        return "\n".join(str(q) for q in self.Quirks())
+
+
+def _FixSensorMultilevelSize(m):
+    # [49, 5, 1, 127, 1, 10] => [49, 5, 1, X, 1, 10]
+    if len(m) < 4 or m[2] != 1 or (m[3] & 7) <= len(m) - 4:
+        return False
+    x = 1 << 5 | (0 << 3) | 2
+    logging.error(
+        "A fixing up SensorMultilevel_Report %s: [3] %02x-> %02x", Hexify(m), m[3], x)
+    m[3] = x
+    return True
+
+
+def _FixSensorMultilevelUnit(m):
+    if len(m) < 4 or m[2] != 1 or (m[3] & 0x10) == 0:
+        return False
+    x = m[3] & 0xe7
+    logging.error(
+        "B fixing up SensorMultilevel_Report %s: [3] %02x-> %02x", Hexify(m), m[3], x)
+    m[3] = x
+    return True
+
+
+def _FixVersionCommandClassReport(m):
+    if len(m) != 3:
+        return False
+    m.append(1)
+    return True
+
+
+QUIRKS = QuirkRegistry([
+    Quirk("temperature with bad size", z.SensorMultilevel_Report, _FixSensorMultilevelSize),
+    Quirk("temperature with bad unit", z.SensorMultilevel_Report, _FixSensorMultilevelUnit),
+    Quirk("class version missing", z.Version_CommandClassReport, _FixVersionCommandClassReport),
+])
+
+
+def MaybePatchCommand(m, product=None):
+    return QUIRKS.Apply(m, product)
@@ -19,10 +19,10 @@
 
 """
 
+import collections
 import logging
 import struct
-import sys
-import traceback
+import threading
 import time
 
 from typing import List
@@ -50,6 +50,243 @@ _BAUD = [
 ]
 
 
+FAILURE_PARSE = "parse"
+FAILURE_ASSEMBLE = "assemble"
+
+
+class FailureQuarantine:
+    """Keeps track of commands which could not be parsed or assembled
+
+    Failures are counted per node and per failure type (kind, command key,
+    exception name). For each failure type only the first max_samples
+    samples (raw bytes for parse failures, values for assemble failures)
+    are kept (see Samples()).
+    Tracebacks are logged at most once every traceback_interval seconds
+    per failure type.
+    If mute_threshold is positive, a node with that many failures within
+    mute_window seconds is muted for mute_duration seconds, i.e. its
+    commands are dropped without being parsed.
+    """
+
+    def __init__(self, max_samples=5, traceback_interval=60.0,
+                 mute_threshold=0, mute_window=60.0, mute_duration=600.0,
+                 clock=time.time):
+        self._max_samples = max_samples
+        self._traceback_interval = traceback_interval
+        self._mute_threshold = mute_threshold
+        self._mute_window = mute_window
+        self._mute_duration = mute_duration
+        self._clock = clock
+        # n -> count
+        self.node_failures = {}
+        # (kind, key, exception name) -> count
+        self.type_failures = {}
+        # (kind, key, exception name) -> [(n, sample), ...]
+        self._samples = {}
+        # (kind, key, exception name) -> time of last logged traceback
+        self._last_traceback = {}
+        self.suppressed_tracebacks = 0
+        # n -> timestamps of recent failures
+        self._recent = {}
+        # n -> time the node is muted until
+        self._muted = {}
+        self.dropped = 0
+
+    def Add(self, kind, n, key, sample, exc=None):
+        failure = (kind, key, type(exc).__name__ if exc is not None else None)
+        self.node_failures[n] = self.node_failures.get(n, 0) + 1
+        self.type_failures[failure] = self.type_failures.get(failure, 0) + 1
+        samples = self._samples.setdefault(failure, [])
+        if len(samples) < self._max_samples:
+            samples.append((n, sample))
+
+        now = self._clock()
+        desc = command.StringifyCommand(key) if key is not None else "?"
+        last = self._last_traceback.get(failure)
+        if last is None or now - last >= self._traceback_interval:
+            self._last_traceback[failure] = now
+            if isinstance(sample, bytes):
+                sample = Hexify(sample)
+            logging.error("[%d] cannot %s %s: %s", n, kind, desc, sample, exc_info=exc)
+        else:
+            self.suppressed_tracebacks += 1
+            logging.info("[%d] cannot %s %s", n, kind, desc)
+
+        if self._mute_threshold > 0:
+            recent = [t for t in self._recent.get(n, []) if now - t < self._mute_window]
+            recent.append(now)
+            self._recent[n] = recent
+            if len(recent) >= self._mute_threshold:
+                logging.error("[%d] muting node for %ds after %d failures",
+                              n, self._mute_duration, len(recent))
+                self._muted[n] = now + self._mute_duration
+                self._recent[n] = []
+
+    def IsMuted(self, n):
+        """Returns True if commands from n should be dropped"""
+        until = self._muted.get(n)
+        if until is None:
+            return False
+        if self._clock() >= until:
+            del self._muted[n]
+            return False
+        self.dropped += 1
+        return True
+
+    def Unmute(self, n):
+        self._muted.pop(n, None)
+
+    def Samples(self, kind=None, key=None):
+        """Returns {(kind, key, exception name): [(n, sample), ...]} for the matching failure types"""
+        return {f: list(s) for f, s in self._samples.items()
+                if (kind is None or f[0] == kind) and (key is None or f[1] == key)}
+
+    def __str__(self):
+        out = ["failures by node: %s" % sorted(self.node_failures.items()),
+               "suppressed tracebacks: %d  dropped: %d  muted: %s" % (
+                   self.suppressed_tracebacks, self.dropped, sorted(self._muted))]
+        for (kind, key, exc), count in sorted(self.type_failures.items(), key=str):
+            out.append("%s %s %s: %d" % (
+                kind, command.StringifyCommand(key) if key is not None else "?", exc, count))
+        return "\n".join(out)
+
+
+class DuplicateFilter:
+    """Drops repeated copies of the same command from the same node.
+
+    Retransmissions and routing retries often deliver a command two or
+    three times in quick succession. A command (node plus raw bytes) is
+    considered a duplicate if an identical one was accepted less than
+    window seconds ago.
+    """
+
+    def __init__(self, window=0.5, clock=time.time):
+        self._window = window
+        self._clock = clock
+        # (n, raw) -> time accepted, oldest first
+        self._recent = collections.OrderedDict()
+        self.passed = 0
+        self.dropped = 0
+        # n -> count
+        self.node_dropped = {}
+
+    def IsDuplicate(self, n, raw):
+        now = self._clock()
+        recent = self._recent
+        while recent:
+            oldest = next(iter(recent.values()))
+            if now - oldest < self._window:
+                break
+            recent.popitem(last=False)
+        key = (n, bytes(raw))
+        if key in recent:
+            self.dropped += 1
+            self.node_dropped[n] = self.node_dropped.get(n, 0) + 1
+            return True
+        recent[key] = now
+        self.passed += 1
+        return False
+
+    def __str__(self):
+        return "passed: %d  dropped: %d  by node: %s" % (
+            self.passed, self.dropped, sorted(self.node_dropped.items()))
+
+
+class EventBatcher(object):
+    """Collects events and hands them to listener.put_batch(events) in batches
+
+    Each event is a tuple (n, ts, key, values). A batch is delivered once
+    it has max_events events or max_delay_ms after its first event,
+    whichever comes first. Batches are delivered in order, either from
+    the thread calling put() or from a background thread.
+    Commands from MultiChannel endpoints are not batched.
+    """
+
+    def __init__(self, listener, max_events=100, max_delay_ms=50):
+        assert max_events > 0
+        self._listener = listener
+        self._max_events = max_events
+        self._max_delay = max_delay_ms / 1000.0
+        self._cond = threading.Condition()
+        # serializes deliveries so batches arrive in order
+        self._deliver_lock = threading.Lock()
+        self._events = []
+        self._deadline = None
+        self._thread = None
+        self._closed = False
+        self.batches = 0
+        self.events = 0
+
+    def put(self, n, ts, key, values):
+        with self._cond:
+            self._events.append((n, ts, key, values))
+            if len(self._events) < self._max_events:
+                if self._deadline is None:
+                    self._deadline = time.time() + self._max_delay
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._Run, name="EventBatcher",
+                                                        daemon=True)
+                        self._thread.start()
+                    self._cond.notify()
+                return
+        self.Flush()
+
+    def _Take(self):
+        events = self._events
+        self._events = []
+        self._deadline = None
+        return events
+
+    def Flush(self):
+        with self._deliver_lock:
+            with self._cond:
+                events = self._Take()
+            if events:
+                self.batches += 1
+                self.events += len(events)
+                self._listener.put_batch(events)
+
+    def _Run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - time.time()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            self.Flush()
+
+    def Close(self):
+        """Delivers pending events and stops the background thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.Flush()
+
+
+class _Subscription(object):
+    """A listener together with the commands it is interested in"""
+    __slots__ = ("listener", "lazy", "nodes", "classes", "keys", "predicate", "endpoints")
+
+    def __init__(self, listener, lazy, nodes, classes, keys, predicate):
+        self.listener = listener
+        self.lazy = lazy
+        self.nodes = None if nodes is None else frozenset(nodes)
+        self.classes = None if classes is None else frozenset(classes)
+        self.keys = None if keys is None else frozenset(keys)
+        self.predicate = predicate
+        self.endpoints = hasattr(listener, "put_endpoint")
+
+    def Matches(self, n, key):
+        return ((self.nodes is None or n in self.nodes) and
+                (self.classes is None or key[0] in self.classes) and
+                (self.keys is None or key in self.keys))
+
+
 class CommandTranslator(object):
     """CommandTranslator is responsible for translating between raw messages and "commands"
 
@@ -59,35 +296,103 @@ class CommandTranslator(object):
     SendMultiCommand() and SendCommand().
     Certain non-command message are translated as custom (pseudo) commands.
 
+    If records is True commands are decoded into command.Record objects
+    instead of dicts (see command.ParseCommandAsRecord).
+
+    If parse_cache_size is positive, decoded commands are kept in a LRU cache
+    keyed by the raw command bytes and, if there are product specific
+    quirks, the product info (see command.ParseCache). Listeners then
+    receive immutable, shared values.
+
+    Listeners can restrict the commands they receive by node, command
+    class, command key and/or a predicate (see AddListener()).
+    Commands nobody is interested in are not parsed at all.
+
+    Listeners registered with AddListener(l, lazy=True) receive
+    command.CommandView objects instead which only decode the fields
+    that are actually accessed. If all listeners are lazy, no eager
+    parsing takes place.
+
+    Before parsing, the device quirks from the quirks registry
+    (see command.QuirkRegistry) are applied. Product specific quirks
+    rely on the product info registered via SetProductInfo().
+
+    Commands which cannot be parsed or assembled are recorded in the
+    failure quarantine (see FailureQuarantine) available as self.failures.
+
+    If a DuplicateFilter is given (available as self.duplicates), repeated
+    copies of a command are dropped before parsing.
+
+    MultiCmd and MultiChannel encapsulated commands are unwrapped.
+    Commands from MultiChannel endpoints are delivered to listeners
+    which implement put_endpoint(n, endpoint, ts, key, values).
     """
 
-    def __init__(self, driver: Driver):
+    def __init__(self, driver: Driver, records=False, parse_cache_size=0,
+                 quirks: command.QuirkRegistry = command.QUIRKS,
+                 failures: FailureQuarantine = None, duplicates: DuplicateFilter = None):
         self._driver = driver
-        self._listeners = []
+        self.failures = failures if failures is not None else FailureQuarantine()
+        self.duplicates = duplicates
+        self._quirks = quirks
+        # node -> (manufacturer, type, product)
+        self._products = {}
+        self._subscriptions = []
+        # (n, key) -> subscriptions matching n and key, computed on demand
+        self._dispatch = {}
+        # same for commands from MultiChannel endpoints
+        self._endpoint_dispatch = {}
+        self._parse = command.ParseCommandAsRecord if records else command.ParseCommand
+        self.parse_cache = None
+        if parse_cache_size > 0:
+            self.parse_cache = command.ParseCache(self._DecodeCachedCommand, parse_cache_size)
         driver.AddListener(self)
 
-    def AddListener(self, l):
-        self._listeners.append(l)
+    def SetProductInfo(self, n, product):
+        self._products[n] = product
+
+    def AddListener(self, l, lazy=False, nodes=None, classes=None, keys=None, predicate=None):
+        """Registers l to receive commands via l.put(n, ts, key, values)
+
+        nodes, classes and keys are collections of node ids, command classes
+        and command keys. If given, only matching commands are delivered.
+        predicate(n, key, values) is evaluated last for every remaining command.
+        """
+        self._subscriptions.append(_Subscription(l, lazy, nodes, classes, keys, predicate))
+        self._dispatch.clear()
+        self._endpoint_dispatch.clear()
+
+    def AddBatchListener(self, l, max_events=100, max_delay_ms=50, **filters):
+        """Registers l to receive commands in batches via l.put_batch(events)
+
+        See EventBatcher for details. The filters are the same as for AddListener().
+        Returns the EventBatcher, e.g. for flushing it explicitly.
+        """
+        batcher = EventBatcher(l, max_events, max_delay_ms)
+        self.AddListener(batcher, **filters)
+        return batcher
+
+    def _Subscribers(self, n, key, endpoint=False):
+        dispatch = self._endpoint_dispatch if endpoint else self._dispatch
+        subs = dispatch.get((n, key))
+        if subs is None:
+            subs = tuple(s for s in self._subscriptions
+                         if s.Matches(n, key) and (s.endpoints or not endpoint))
+            dispatch[(n, key)] = subs
+        return subs
 
     def _PushToListeners(self, n, ts, key, value):
-        for l in self._listeners:
-            l.put(n, ts, key, value)
+        for s in self._Subscribers(n, key):
+            if s.predicate is None or s.predicate(n, key, value):
+                s.listener.put(n, ts, key, value)
 
     def _SendMessageMulti(self, nn, m, priority: tuple, handler):
         mesg = zmessage.Message(m, priority, handler, nn[0])
         self._driver.SendMessage(mesg)
 
     def SendMultiCommand(self, nodes: List[int], key, values, priority: tuple, xmit: int):
-        try:
-            raw_cmd = command.AssembleCommand(key[0], key[1], values)
-        except Exception as e:
-            logging.error("cannot assemble command for %s %s %s",
-                          command.StringifyCommand(key),
-                          z.SUBCMD_TO_PARSE_TABLE[key[0] * 256 + key[1]],
-                          values)
-            print("-" * 60)
-            traceback.print_exc(file=sys.stdout)
-            print("-" * 60)
+        raw_cmd = self._AssembleCommand(nodes[0], key, values)
+        if raw_cmd is None:
             return
 
         def handler(_):
@@ -133,17 +438,16 @@ class CommandTranslator(object):
         mesg = zmessage.Message(m, priority, handler, n)
         self._driver.SendMessage(mesg)
 
-    def SendCommand(self, n, key, values, priority: tuple, xmit: int):
+    def _AssembleCommand(self, n, key, values):
         try:
-            raw_cmd = command.AssembleCommand(key[0], key[1], values)
-        except Exception as _e:
-            logging.error("cannot assemble command for %s %s %s",
-                          command.StringifyCommand(key),
-                          z.SUBCMD_TO_PARSE_TABLE[key[0] * 256 + key[1]],
-                          values)
-            print("-" * 60)
-            traceback.print_exc(file=sys.stdout)
-            print("-" * 60)
+            return command.AssembleCommand(key[0], key[1], values)
+        except Exception as e:
+            self.failures.Add(FAILURE_ASSEMBLE, n, key, values, e)
+            return None
+
+    def SendCommand(self, n, key, values, priority: tuple, xmit: int):
+        raw_cmd = self._AssembleCommand(n, key, values)
+        if raw_cmd is None:
             return
 
         def handler(_):
@@ -152,6 +456,42 @@ class CommandTranslator(object):
         m = zmessage.MakeRawCommandWithId(n, raw_cmd, xmit)
         self._SendMessage(n, m, priority, handler)
 
+    def SendBundledCommands(self, n, commands, priority: tuple, xmit: int):
+        """Sends the commands [(key, values), ...] to a node supporting MultiCmd
+
+        Commands are packed into as few MultiCmd_Encap frames as possible.
+        """
+        raw_cmds = []
+        for key, values in commands:
+            raw_cmd = self._AssembleCommand(n, key, values)
+            if raw_cmd is not None:
+                raw_cmds.append(raw_cmd)
+
+        def handler(_):
+            logging.debug("@@handler invoked")
+
+        for raw_cmd in command.PackMultiCmd(raw_cmds):
+            m = zmessage.MakeRawCommandWithId(n, raw_cmd, xmit)
+            self._SendMessage(n, m, priority, handler)
+
+    def SendEndpointCommand(self, n, endpoints, key, values, priority: tuple, xmit: int,
+                            bit_addressing=False):
+        """Sends a MultiChannel encapsulated command to several endpoints of a node
+
+        With bit_addressing endpoints 1-7 are reached with a single frame.
+        This must only be used for Set type commands.
+        """
+        raw_cmd = self._AssembleCommand(n, key, values)
+        if raw_cmd is None:
+            return
+
+        def handler(_):
+            logging.debug("@@handler invoked")
+
+        for raw in command.EncapsulateForEndpoints(endpoints, raw_cmd, bit_addressing):
+            m = zmessage.MakeRawCommandWithId(n, raw, xmit)
+            self._SendMessage(n, m, priority, handler)
+
     def _RequestNodeInfo(self, n, retries):
         """This usually triggers send "API_ZW_APPLICATION_UPDATE:"""
 
@@ -215,25 +555,96 @@ class CommandTranslator(object):
 
             self._UpdateIsFailedNode(n, handler)
 
+    def _DecodeCommand(self, raw, product=None):
+        data = [int(x) for x in raw]
+        data = self._quirks.Apply(data, product)
+        return (data[0], data[1]), self._parse(data)
+
+    def _DecodeCachedCommand(self, product_and_raw):
+        return self._DecodeCommand(product_and_raw[1], product_and_raw[0])
+
+    def _AddParseFailure(self, n, raw, exc=None):
+        key = (raw[0], raw[1]) if len(raw) >= 2 else None
+        self.failures.Add(FAILURE_PARSE, n, key, bytes(raw), exc)
+
+    def _HandleCommand(self, ts, n, raw, endpoint):
+        if len(raw) < 2:
+            self._AddParseFailure(n, raw)
+            return
+        key = (raw[0], raw[1])
+        subs = self._Subscribers(n, key, endpoint != 0)
+        if not subs:
+            return
+        lazy = False
+        eager = False
+        for sub in subs:
+            if sub.lazy:
+                lazy = True
+            else:
+                eager = True
+        product = None
+        if self._quirks.product_specific:
+            product = self._products.get(n)
+        view = None
+        value = None
+        try:
+            if lazy:
+                # patched fields must not be read straight from the buffer
+                view = command.CommandView(raw, lambda r: self._DecodeCommand(r, product)[1],
+                                           not self._quirks.HasQuirks(key))
+            if eager:
+                if self.parse_cache is not None:
+                    key, value = self.parse_cache.Get((product, bytes(raw)))
+                else:
+                    key, value = self._DecodeCommand(raw, product)
+                if value is None:
+                    self._AddParseFailure(n, raw)
+                    return
+        except Exception as e:
+            self._AddParseFailure(n, raw, e)
+            return
+
+        for sub in subs:
+            v = view if sub.lazy else value
+            if sub.predicate is not None and not sub.predicate(n, key, v):
+                continue
+            if endpoint == 0:
+                sub.listener.put(n, ts, key, v)
+            else:
+                sub.listener.put_endpoint(n, endpoint, ts, key, v)
+
+    def _HandleRawCommand(self, ts, n, raw, endpoint):
+        """Unwraps encapsulated commands before handling them"""
+        if len(raw) >= 2:
+            key = (raw[0], raw[1])
+            if key == z.MultiCmd_Encap or key == z.MultiChannel_ChannelEncap:
+                try:
+                    values = command.ParseCommand(raw)
+                except Exception as e:
+                    self._AddParseFailure(n, raw, e)
+                    return
+                if key == z.MultiCmd_Encap:
+                    for c in values["commands"]:
+                        self._HandleRawCommand(ts, n, c, endpoint)
+                else:
+                    self._HandleRawCommand(ts, n, values["command"], values["src"] & 0x7f)
+                return
+        self._HandleCommand(ts, n, raw, endpoint)
+
     def _HandleMessageApplicationCommand(self, ts, m):
         _ = m[4]  # status
         n = m[5]
         size = m[6]
-        try:
-            data = [int(x) for x in m[7:7 + size]]
-            data = command.MaybePatchCommand(data)
-            value = command.ParseCommand(data)
-            if value is None:
-                logging.error("[%d] parsing failed for %s", n, Hexify(data))
-                return
-        except Exception as _e:
-            logging.error("[%d] cannot parse: %s", n, zmessage.PrettifyRawMessage(m))
-            print("-" * 60)
-            traceback.print_exc(file=sys.stdout)
-            print("-" * 60)
+        if isinstance(m, (bytes, bytearray)):
+            # avoid copying the command
+            raw = memoryview(m)[7:7 + size]
+        else:
+            raw = m[7:7 + size]
+        if self.failures.IsMuted(n):
             return
-
-        self._PushToListeners(n, ts, (data[0], data[1]), value)
+        if self.duplicates is not None and self.duplicates.IsDuplicate(n, raw):
+            return
+        self._HandleRawCommand(ts, n, raw, 0)
 
     def _HandleMessageApplicationUpdate(self, ts, m):
         kind = m[4]
@@ -20,6 +20,10 @@
 """
 
 import logging
+import random
+from concurrent import futures
+import threading
+import time
 from typing import Set, Mapping
 
 from pyzwaver import zmessage
@@ -27,6 +31,7 @@ from pyzwaver import zwave as z
 from pyzwaver import command_translator
 from pyzwaver import command
 from pyzwaver import value
+from pyzwaver import timeseries
 
 
 def Hexify(t):
@@ -41,6 +46,21 @@ NODE_STATE_DISCOVERED = "2_Discovered"
 # info an versions)
 NODE_STATE_INTERVIEWED = "3_Interviewed"
 
+# secs a node may remain in a state (once the queries for the next state
+# were sent) before the missing answers are requested again.
+# The timeout doubles with every retry.
+# Nodes owned by an InterviewScheduler have no NODE_STATE_DISCOVERED
+# deadline - the scheduler retries stuck interviews itself.
+STATE_DEADLINES = {
+    NODE_STATE_NONE: 30.0,
+    NODE_STATE_DISCOVERED: 20.0,
+}
+_MAX_DEADLINE_RETRIES = 4
+
+# secs without a Configuration_Report after which a full parameter scan
+# is considered complete (the node does not answer unknown parameters)
+_PARAMETER_SCAN_QUIET = 60.0
+
 _NO_VERSION = {"version": -1}
 _BAD_VERSION = {"version": 0}
 
@@ -61,15 +81,64 @@ _COMMANDS_WITH_MAP_VALUES = {
     z.SceneActuatorConf_Report: lambda v: v["scene"],
     z.UserCode_Report: lambda v: v["user"],
     z.MultiChannel_CapabilityReport: lambda v: v["endpoint"],
+    z.Configuration_PropertiesReport: lambda v: v["parameter"],
 }
 
 _COMMANDS_WITH_SPECIAL_ACTIONS = {
-    z.ManufacturerSpecific_Report: lambda _ts, node, _values:
-        node.MaybeChangeState(NODE_STATE_INTERVIEWED),
     z.SceneActuatorConf_Report: lambda ts, node, values:
-        node.values.Set(ts, command.CUSTOM_COMMAND_ACTIVE_SCENE, values)
+        node.values.Set(ts, command.CUSTOM_COMMAND_ACTIVE_SCENE, values),
+    z.Configuration_PropertiesReport: lambda _ts, node, values:
+        node._ContinueParameterDiscovery(values),
+    z.Configuration_Report: lambda _ts, node, values:
+        node._LearnParameter(values["parameter"]),
+}
+
+# Get key -> subkey of the expected answer for queries whose answers
+# can only be told apart by one of their fields
+_QUERY_ANSWER_SUBKEYS = {
+    z.Version_CommandClassGet: lambda args: args["class"],
+    z.Configuration_Get: lambda args: args["parameter"],
+    z.Association_Get: lambda args: args["group"],
+    z.UserCode_Get: lambda args: args["user"],
+    z.ManufacturerSpecific_DeviceSpecificGet: lambda args: args["type"],
+}
+
+_REPORT_ANSWER_SUBKEYS = {
+    z.Version_CommandClassReport: lambda values: values["class"],
+    z.Configuration_Report: lambda values: values["parameter"],
+    z.Association_Report: lambda values: values["group"],
+    z.UserCode_Report: lambda values: values["user"],
+    z.ManufacturerSpecific_DeviceSpecificReport: lambda values: values["type"],
+}
+
+
+# Get key -> first version of its command class implementing it.
+# Older nodes never answer these.
+_MIN_QUERY_VERSION = {
+    z.SensorMultilevel_SupportedGet: 5,
+    z.ManufacturerSpecific_DeviceSpecificGet: 2,
+    z.Meter_SupportedGet: 2,
+    z.SwitchMultilevel_SupportedGet: 3,
+    z.MultiChannel_EndPointGet: 2,
+    z.Alarm_SupportedGet: 2,
 }
 
+
+def _ExpectedAnswer(key, args):
+    """Returns the (report key, subkey) answering the Get command or None"""
+    report = command.ReportForGet(key)
+    if report is None:
+        return None
+    subkey = _QUERY_ANSWER_SUBKEYS.get(key)
+    return report, subkey(args) if subkey else None
+
+
+# properties (and hence next-parameter chaining) were introduced with version 3
+_CONFIGURATION_PROPERTIES_VERSION = 3
+
+# bit addressed endpoints were introduced with version 2
+_MULTI_CHANNEL_BIT_ADDRESSING_VERSION = 2
+
 XMIT_OPTIONS_NO_ROUTE = (z.TRANSMIT_OPTION_ACK |
                          z.TRANSMIT_OPTION_EXPLORE)
 
@@ -155,10 +224,118 @@ _STATIC_PROPERTY_QUERIES = [
 ]
 
 
+# Values which rarely change and are worth persisting across restarts
+# (see Node.CacheSnapshot())
+_CACHED_VALUE_KEYS = frozenset(
+    [command.ReportForGet(key) for key, _ in _STATIC_PROPERTY_QUERIES
+     if command.ReportForGet(key)] +
+    [z.ManufacturerSpecific_Report,
+     z.Version_CommandClassReport,
+     z.Configuration_Report,
+     z.Configuration_PropertiesReport,
+     z.Association_Report,
+     z.AssociationGroupInformation_NameReport,
+     z.AssociationGroupInformation_InfoReport,
+     z.AssociationGroupInformation_ListReport,
+     z.MultiChannel_CapabilityReport,
+     command.CUSTOM_COMMAND_PROTOCOL_INFO])
+
+
+def _PlainValue(v):
+    """Converts read only mappings (records, views, frozen values) into dicts"""
+    if isinstance(v, Mapping):
+        return {k: _PlainValue(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_PlainValue(x) for x in v]
+    if isinstance(v, tuple):
+        return tuple(_PlainValue(x) for x in v)
+    return v
+
+
+class _ParameterScan(object):
+    """State of a running RefreshAllParameters"""
+
+    def __init__(self, properties):
+        # True if the node enumerates its parameters
+        self.properties = properties
+        self.last_progress = time.time()
+        self.seen = set()
+        # parameters whose properties were reported
+        self.visited = set()
+
+
+class ParameterCatalog(object):
+    """Configuration parameters seen so far keyed by product
+    (manufacturer, type, product).
+
+    Used to avoid scanning all parameters of devices predating the
+    Configuration properties.
+    """
+
+    def __init__(self):
+        self._params = {}
+
+    def Learn(self, product, parameters):
+        """Records the parameters found by a completed scan of the product"""
+        self._params.setdefault(product, set()).update(parameters)
+
+    def Get(self, product):
+        """Returns the sorted parameters of the product or None if unknown"""
+        params = self._params.get(product)
+        if params is None:
+            return None
+        return sorted(params)
+
+    def Export(self):
+        return {k: sorted(v) for k, v in self._params.items()}
+
+    def Import(self, data):
+        for product, params in data.items():
+            self._params.setdefault(product, set()).update(params)
+
+
 def _ColorQueries(groups):
     return [(z.ColorSwitch_Get, {"group": g}) for g in groups]
 
 
+# command classes for which only version 1 has ever been specified
+_SINGLE_VERSION_CLASSES = frozenset([
+    z.ApplicationStatus,
+    z.AssociationCommandConfiguration,
+    z.BasicWindowCovering,
+    z.ClimateControlSchedule,
+    z.Clock,
+    z.ControllerReplication,
+    z.CRC16Encap,
+    z.DeviceResetLocally,
+    z.DoorLockLogging,
+    z.EnergyProduction,
+    z.Hail,
+    z.Language,
+    z.Lock,
+    z.ManufacturerProprietary,
+    z.MeterPulse,
+    z.MultiCmd,
+    z.NodeNaming,
+    z.NoOperation,
+    z.Powerlevel,
+    z.Proprietary,
+    z.RemoteAssociationActivate,
+    z.SceneActivation,
+    z.SceneActuatorConf,
+    z.SceneControllerConf,
+    z.Security,
+    z.Security2,
+    z.SensorAlarm,
+    z.SilenceAlarm,
+    z.SwitchAll,
+    z.SwitchToggleBinary,
+    z.SwitchToggleMultilevel,
+    z.ThermostatSetBack,
+    z.TimeParameters,
+])
+
+
 def _CommandVersionQueries(classes):
     return [(z.Version_CommandClassGet, {"class": c}) for c in classes]
 
@@ -205,28 +382,115 @@ class NodeValues:
        The corresponding  "XXXGet" command does not take an argument.
     2. We cache several recent messages
        The corresponding  "XXXGet" command takes an argument.
+
+    Every entry that actually changes bumps a version counter which is
+    tracked per key and for the NodeValues as a whole.
+
+    Snapshot() hands out immutable views for other threads. The dicts
+    referenced by the latest snapshot are copied before the next update
+    (copy-on-write) so readers never need a lock.
     """
 
-    def __init__(self):
+    def __init__(self, on_change=None):
         self._values = {}
         self._maps = {}
+        # key -> version of its last change
+        self._versions = {}
+        self.version = 0
+        # called with (ts, key, subkey, old, new) for every change
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        # latest snapshot - the dicts it shares with us must not be mutated
+        self._snapshot = None
+        # keys of the maps which were copied/created since the latest snapshot
+        self._own_maps = set()
+
+    def _Changed(self, ts, key, subkey, old, new):
+        if self._on_change:
+            self._on_change(ts, key, subkey, old, new)
+
+    def _BumpVersion(self, key):
+        self.version += 1
+        self._versions[key] = self.version
+
+    def Snapshot(self):
+        """Returns a read only NodeValuesSnapshot reflecting the latest change.
+
+        The same snapshot is returned until the next change.
+        Timestamp only updates (identical values) do not create a new one.
+        """
+        with self._lock:
+            snap = self._snapshot
+            if snap is None or snap.version != self.version:
+                snap = NodeValuesSnapshot(self._values, self._maps, dict(self._versions),
+                                          self.version)
+                self._snapshot = snap
+                self._own_maps = set()
+            return snap
+
+    def Version(self, key=None):
+        """Returns the version of the last change of key or of any key"""
+        if key is None:
+            return self.version
+        return self._versions.get(key, 0)
+
+    def Export(self, keys):
+        """Returns the entries for the given keys as plain python data"""
+        return {
+            "values": {k: (ts, _PlainValue(v)) for k, (ts, v) in self._values.items()
+                       if k in keys},
+            "maps": {k: {sk: (ts, _PlainValue(v)) for sk, (ts, v) in m.items()}
+                     for k, m in self._maps.items() if k in keys},
+        }
+
+    def Import(self, data):
+        """Inverse of Export()"""
+        for k, (ts, v) in data["values"].items():
+            self.Set(ts, k, v)
+        for k, m in data["maps"].items():
+            for sk, (ts, v) in m.items():
+                self.SetMapEntry(ts, k, sk, v)
 
     def HasValue(self, key: tuple):
         return key in self._values
 
     def Set(self, ts, key: tuple, v):
+        """Returns True if the value differs from the previous one"""
         if v is None:
-            return
-        self._values[key] = ts, v
+            return False
+        with self._lock:
+            if self._snapshot is not None and self._values is self._snapshot._values:
+                self._values = dict(self._values)
+            old = self._values.get(key)
+            self._values[key] = ts, v
+            if old is not None and old[1] == v:
+                return False
+            self._BumpVersion(key)
+        self._Changed(ts, key, None, old and old[1], v)
+        return True
 
     def SetMapEntry(self, ts, key: tuple, subkey, v):
+        """Returns True if the value differs from the previous one"""
         if v is None:
-            return
-        m = self._maps.get(key)
-        if m is None:
-            m = {}
-            self._maps[key] = m
-        m[subkey] = ts, v
+            return False
+        with self._lock:
+            if self._snapshot is not None:
+                if self._maps is self._snapshot._maps:
+                    self._maps = dict(self._maps)
+                if key not in self._own_maps and key in self._maps:
+                    self._maps[key] = dict(self._maps[key])
+            self._own_maps.add(key)
+            m = self._maps.get(key)
+            if m is None:
+                m = {}
+                self._maps[key] = m
+            old = m.get(subkey)
+            m[subkey] = ts, v
+            if old is not None and old[1] == v:
+                return False
+            self._BumpVersion(key)
+        self._Changed(ts, key, subkey, old and old[1], v)
+        return True
 
     def Get(self, key: tuple) -> map:
         v = self._values.get(key)
@@ -237,6 +501,16 @@ class NodeValues:
     def GetMap(self, key: tuple) -> map:
         return self._maps.get(key, {})
 
+    def Timestamp(self, key: tuple):
+        """Returns the time the value (or the most recent map entry) was received or None"""
+        v = self._values.get(key)
+        if v is not None:
+            return v[0]
+        m = self._maps.get(key)
+        if not m:
+            return None
+        return max(ts for ts, _ in m.values())
+
     def ColorSwitchSupported(self):
         v = self.Get(z.ColorSwitch_SupportedReport)
         if not v:
@@ -297,6 +571,13 @@ class NodeValues:
             n = v["count"]
         return list(range(1, n + 1)) + [255]
 
+    def CommandVersion(self, cls):
+        m = self.GetMap(z.Version_CommandClassReport)
+        e = m.get(cls)
+        if not e:
+            return 0
+        return e[1]["version"]
+
     def HasCommandClass(self, cls):
         m = self.GetMap(z.Version_CommandClassReport)
         e = m.get(cls)
@@ -413,6 +694,101 @@ class NodeValues:
         return "\n".join(out)
 
 
+class NodeValuesSnapshot(NodeValues):
+    """Immutable view of a NodeValues at a given version (see NodeValues.Snapshot())
+
+    All the accessors of NodeValues are available.
+    """
+
+    def __init__(self, values, maps, versions, version):
+        self._values = values
+        self._maps = maps
+        self._versions = versions
+        self.version = version
+        self._snapshot = self
+
+    def Snapshot(self):
+        return self
+
+    def Set(self, ts, key: tuple, v):
+        raise TypeError("snapshots are read only")
+
+    def SetMapEntry(self, ts, key: tuple, subkey, v):
+        raise TypeError("snapshots are read only")
+
+
+class ValueChange(object):
+    """An entry of the NodeValues of node n (or one of its endpoints) changed"""
+    __slots__ = ("n", "endpoint", "ts", "key", "subkey", "old", "new", "version")
+
+    def __init__(self, n, endpoint, ts, key, subkey, old, new, version):
+        self.n = n
+        # 0 for the node itself
+        self.endpoint = endpoint
+        self.ts = ts
+        self.key = key
+        # None unless key has map values
+        self.subkey = subkey
+        # None if there was no previous value
+        self.old = old
+        self.new = new
+        self.version = version
+
+    def __repr__(self):
+        return "ValueChange(n=%d, endpoint=%d, key=%s, subkey=%s, %s -> %s)" % (
+            self.n, self.endpoint, command.StringifyCommand(self.key), self.subkey,
+            self.old, self.new)
+
+
+class Subscription(object):
+    """Forwards those numeric readings of a node which qualify to listener.put().
+
+    The first reading of every subkey qualifies. Later ones qualify if they
+    differ by more than `deadband` from the last delivered one or if they
+    crossed one of the `thresholds` since the previous reading.
+    If subkey is None all subkeys (e.g. sensor types) are tracked separately.
+    """
+
+    def __init__(self, n, key, listener, subkey=None, deadband=None, thresholds=()):
+        self.n = n
+        self.key = key
+        self.subkey = subkey
+        self.listener = listener
+        self._deadband = deadband
+        self._thresholds = tuple(thresholds)
+        # subkey -> last reading / last delivered reading
+        self._previous = {}
+        self._delivered = {}
+        self.delivered = 0
+        self.suppressed = 0
+
+    def _Qualifies(self, subkey, v):
+        previous = self._previous.get(subkey)
+        self._previous[subkey] = v
+        delivered = self._delivered.get(subkey)
+        if delivered is None:
+            return True
+        if self._deadband is not None and abs(v - delivered) > self._deadband:
+            return True
+        for t in self._thresholds:
+            if (previous < t) != (v < t):
+                return True
+        return False
+
+    def Check(self, ts, subkey, values):
+        if self.subkey is not None and subkey != self.subkey:
+            return
+        v = timeseries.NumericReading(self.key, values)
+        if v is None:
+            return
+        if not self._Qualifies(subkey, v):
+            self.suppressed += 1
+            return
+        self._delivered[subkey] = v
+        self.delivered += 1
+        self.listener.put(self.n, ts, self.key, values)
+
+
 class Node:
     """A Node represents a single node in a network.
 
@@ -420,18 +796,172 @@ class Node:
     Outgoing commands are send to the CommandTranslator.
     """
 
-    def __init__(self, n, translator: command_translator.CommandTranslator, is_controller):
+    def __init__(self, n, translator: command_translator.CommandTranslator, is_controller,
+                 scheduler=None, catalog: ParameterCatalog = None, on_change=None,
+                 on_state_change=None):
         assert n >= 1
         self.n = n
         self.is_controller = is_controller
         self.name = "Node %d" % n
         self._translator = translator
+        # called with (node, old_state, new_state) on every state change
+        self._on_state_change = on_state_change
+        # expected answer -> [Future] (see Query())
+        self._queries = {}
+        self._queries_lock = threading.Lock()
+        # expected answer -> (time first requested, [queries]) of the interview
+        self._outstanding = {}
+        # answer -> secs it took to arrive
+        self._answered = {}
+        # time at which CheckDeadline() retries the missing queries of the state
+        self.deadline = None
+        self.deadline_retries = 0
+        self._state = None
         self.state = NODE_STATE_NONE
         self._controls = set()
+        # called with a ValueChange whenever one of the values changes
+        self._on_change = on_change
+        # classes the node announced as supported (as opposed to controlled)
+        self._supported = set()
         #
-        self.values = NodeValues()
+        self.values = self._NewValues(0)
+        # endpoint -> NodeValues for MultiChannel devices
+        self.endpoints = {}
         self.is_controller = is_controller
         self.last_contact = 0
+        # optional timeseries.NodeHistory of numeric readings
+        self.history = None
+        # report key -> [Subscription] (replaced, never mutated)
+        self._subscriptions = {}
+        # True if the static values were restored from a cache and have
+        # not been confirmed by the node yet
+        self.stale = False
+        # optional InterviewScheduler deciding when the static interview starts
+        self.scheduler = scheduler
+        # optional ParameterCatalog shared by all nodes
+        self.catalog = catalog
+        # _ParameterScan collecting the parameters for the catalog
+        self._parameter_scan = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, new_state):
+        old_state = self._state
+        self._state = new_state
+        if old_state == new_state:
+            return
+        # the deadline for NODE_STATE_DISCOVERED is armed when the interview starts
+        self.deadline = None
+        # the controller never leaves NODE_STATE_NONE - no point in pinging it
+        if new_state == NODE_STATE_NONE and not self.is_controller:
+            self._ArmDeadline()
+        if self._on_state_change:
+            self._on_state_change(self, old_state, new_state)
+
+    def _ArmDeadline(self):
+        self.deadline = time.time() + STATE_DEADLINES[self.state]
+        self.deadline_retries = 0
+
+    def CheckDeadline(self, now):
+        """Re-requests whatever is missing to leave the current state once its
+        deadline has passed"""
+        scan = self._parameter_scan
+        if scan is not None and now - scan.last_progress >= _PARAMETER_SCAN_QUIET:
+            self._FinishParameterScan(not scan.properties)
+        if self.deadline is None or now < self.deadline:
+            return
+        if self.deadline_retries >= _MAX_DEADLINE_RETRIES:
+            logging.error("[%d] giving up on %s", self.n, self.state)
+            self.deadline = None
+            if self.state == NODE_STATE_DISCOVERED:
+                # make do with the answers we have got
+                self.MaybeChangeState(NODE_STATE_INTERVIEWED)
+            return
+        self.deadline_retries += 1
+        self.deadline = now + STATE_DEADLINES[self.state] * 2 ** self.deadline_retries
+        logging.warning("[%d] deadline for %s passed - retry %d",
+                        self.n, self.state, self.deadline_retries)
+        if self.state == NODE_STATE_NONE:
+            self._translator.Ping(self.n, 3, False, "deadline")
+        elif self.state == NODE_STATE_DISCOVERED:
+            self._SendMissingStaticQueries()
+
+    def EnableHistory(self, capacity):
+        """Keeps the last `capacity` readings of every sensor/meter"""
+        if self.history is None:
+            self.history = timeseries.NodeHistory(capacity)
+
+    def Subscribe(self, key, listener, subkey=None, deadband=None, thresholds=()):
+        """Returns a Subscription forwarding qualifying readings for key to listener"""
+        sub = Subscription(self.n, key, listener, subkey, deadband, thresholds)
+        self._subscriptions[key] = self._subscriptions.get(key, []) + [sub]
+        return sub
+
+    def Unsubscribe(self, sub: Subscription):
+        subs = [s for s in self._subscriptions.get(sub.key, []) if s is not sub]
+        if subs:
+            self._subscriptions[sub.key] = subs
+        else:
+            self._subscriptions.pop(sub.key, None)
+
+    def _NewValues(self, endpoint):
+        if self._on_change is None:
+            return NodeValues()
+
+        def changed(ts, key, subkey, old, new):
+            self._on_change(ValueChange(self.n, endpoint, ts, key, subkey, old, new,
+                                        values.version))
+
+        values = NodeValues(changed)
+        return values
+
+    def CacheSnapshot(self):
+        """Returns the state and the static/semi static values for persisting"""
+        return {
+            "state": self.state,
+            "values": self.values.Export(_CACHED_VALUE_KEYS),
+            "endpoints": {e: v.Export(_CACHED_VALUE_KEYS) for e, v in self.endpoints.items()},
+            # the node info is not repeated by the node unless asked for
+            "supported": sorted(self._supported),
+            "controls": sorted(self._controls),
+        }
+
+    def RestoreFromCache(self, snapshot):
+        """Inverse of CacheSnapshot() - the restored values are considered stale
+        until Revalidate() has been answered"""
+        self.state = snapshot["state"]
+        self._supported = set(snapshot["supported"])
+        self._controls = set(snapshot["controls"])
+        self.values.Import(snapshot["values"])
+        for e, data in snapshot["endpoints"].items():
+            self.EndpointValues(e).Import(data)
+        self.stale = True
+        if self.values.HasValue(z.ManufacturerSpecific_Report):
+            self._translator.SetProductInfo(self.n, self.values.ProductInfo())
+
+    def Revalidate(self):
+        """Cheaply checks that a restored node is still the same device"""
+        logging.warning("[%d] Revalidate", self.n)
+        self.BatchCommandSubmitFilteredSlow([(z.ManufacturerSpecific_Get, {})], XMIT_OPTIONS)
+
+    def _HandleRevalidation(self, values):
+        """Returns False if the cached values were discarded"""
+        self.stale = False
+        old = self.values.ProductInfo()
+        new = values.get("manufacturer", 0), values.get("type", 0), values.get("product", 0)
+        if old == new:
+            return True
+        logging.warning("[%d] product changed from %s to %s - reinterviewing", self.n, old, new)
+        self.values = self._NewValues(0)
+        self.endpoints = {}
+        self._supported = set()
+        self._controls = set()
+        self.state = NODE_STATE_NONE
+        self._translator.Ping(self.n, 3, False, "changed product")
+        return False
 
     def IsSelf(self):
         return self.is_controller
@@ -439,12 +969,122 @@ class Node:
     def IsInterviewed(self):
         return self.state == NODE_STATE_INTERVIEWED
 
+    def IsListening(self):
+        v = self.values.Get(command.CUSTOM_COMMAND_PROTOCOL_INFO)
+        return v is not None and "listening" in v["flags"]
+
+    def IsFrequentlyListening(self):
+        v = self.values.Get(command.CUSTOM_COMMAND_PROTOCOL_INFO)
+        return v is not None and bool({"sensor_250ms", "sensor_1000ms"} & v["flags"])
+
+    def InterviewCompletion(self):
+        """Returns the percentage of the interview queries which have been answered"""
+        if self.state >= NODE_STATE_INTERVIEWED:
+            return 100.0
+        total = len(self._outstanding) + len(self._answered)
+        if total == 0:
+            return 0.0
+        return 100.0 * len(self._answered) / total
+
+    def OutstandingAnswers(self, now=None):
+        """Returns (report key, subkey) -> secs waiting for the missing interview answers"""
+        if now is None:
+            now = time.time()
+        return {answer: now - sent for answer, (sent, _) in self._outstanding.items()}
+
+    def AnswerLatencies(self):
+        """Returns (report key, subkey) -> secs it took to receive the interview answers"""
+        return dict(self._answered)
+
+    def _IsImplemented(self, key):
+        version = self.values.CommandVersion(key[0])
+        if version == _NO_VERSION["version"]:
+            return True
+        # version 0 means not supported
+        return version > 0 and version >= _MIN_QUERY_VERSION.get(key, 0)
+
+    def _Expect(self, commands):
+        now = time.time()
+        # control only classes are never answered
+        supported = self._supported or set(self.values.Classes())
+        for key, args in commands:
+            if key[0] not in supported or not self._IsImplemented(key):
+                continue
+            answer = _ExpectedAnswer(key, args)
+            if answer is None or answer in self._answered:
+                continue
+            entry = self._outstanding.setdefault(answer, (now, []))
+            if (key, args) not in entry[1]:
+                entry[1].append((key, args))
+
+    def Query(self, key, args, timeout=10.0) -> futures.Future:
+        """Sends the Get command key and returns a Future which is resolved with the
+        values of the matching report or fails with futures.TimeoutError"""
+        answer = _ExpectedAnswer(key, args)
+        if answer is None:
+            raise ValueError("no report for %s" % command.StringifyCommand(key))
+        future = futures.Future()
+        with self._queries_lock:
+            self._queries.setdefault(answer, []).append(future)
+        timer = threading.Timer(timeout, self._ExpireQuery, (answer, future))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(lambda _: timer.cancel())
+        self._translator.SendCommand(self.n, key, args, zmessage.NodePriorityHi(self.n),
+                                     XMIT_OPTIONS)
+        return future
+
+    def _ExpireQuery(self, answer, future):
+        with self._queries_lock:
+            pending = self._queries.get(answer, [])
+            if future not in pending:
+                return
+            pending.remove(future)
+            if not pending:
+                del self._queries[answer]
+        future.set_exception(futures.TimeoutError(
+            "[%d] no %s" % (self.n, command.StringifyCommand(answer[0]))))
+
+    def _ResolveQueries(self, key, values):
+        subkey = _REPORT_ANSWER_SUBKEYS.get(key)
+        answer = key, subkey(values) if subkey else None
+        with self._queries_lock:
+            pending = self._queries.pop(answer, ())
+        for future in pending:
+            future.set_result(values)
+
+    def _DropUnimplemented(self, cls):
+        """Stops waiting for answers the now known version of cls cannot provide"""
+        for answer, (sent, queries) in list(self._outstanding.items()):
+            queries = [(key, args) for key, args in queries
+                       if key[0] != cls or self._IsImplemented(key)]
+            if queries:
+                self._outstanding[answer] = sent, queries
+            else:
+                del self._outstanding[answer]
+
+    def _Answered(self, key, values):
+        subkey = _REPORT_ANSWER_SUBKEYS.get(key)
+        answer = key, subkey(values) if subkey else None
+        entry = self._outstanding.pop(answer, None)
+        if entry is not None:
+            self._answered[answer] = time.time() - entry[0]
+        if key == z.Version_CommandClassReport:
+            self._DropUnimplemented(values["class"])
+        elif entry is None:
+            return
+        if not self._outstanding:
+            logging.warning("[%d] all interview answers received", self.n)
+            self.MaybeChangeState(NODE_STATE_INTERVIEWED)
+
     def __lt__(self, other):
         return self.n < other.n
 
     def InitializeUnversioned(self, cmd, controls, std_cmd, std_controls):
         self._controls |= set(controls)
         self._controls |= set(std_controls)
+        self._supported |= set(cmd)
+        self._supported |= set(std_cmd)
 
         ts = 0.0
         for k in cmd:
@@ -476,16 +1116,45 @@ class Node:
                 logging.error("BAD COMMAND: %s", c)
                 assert False
 
-        for key, values in commands:
-            if not self.values.HasCommandClass(key[0]):
-                continue
+        commands = [(key, values) for key, values in commands
+                    if self.values.HasCommandClass(key[0])]
 
-            # if self._IsSecureCommand(cmd[0], cmd[1]):
-            #    self._secure_messaging.Send(cmd)
-            #    continue
+        # if self._IsSecureCommand(cmd[0], cmd[1]):
+        #    self._secure_messaging.Send(cmd)
+        #    continue
 
+        # controlling MultiCmd does not mean the node can decode it
+        bundle = z.MultiCmd in self._supported or self.values.CommandVersion(z.MultiCmd) >= 1
+        if len(commands) > 1 and bundle:
+            # bundle the commands to save airtime
+            self._translator.SendBundledCommands(self.n, commands, priority, xmit)
+            return
+
+        for key, values in commands:
             self._translator.SendCommand(self.n, key, values, priority, xmit)
 
+    def EndpointValues(self, endpoint) -> NodeValues:
+        values = self.endpoints.get(endpoint)
+        if values is None:
+            values = self._NewValues(endpoint)
+            self.endpoints[endpoint] = values
+        return values
+
+    def BatchCommandSubmitEndpoints(self, endpoints, commands, priority: tuple, xmit: int):
+        """Sends each command to those endpoints supporting it"""
+        bit_addressing = (self.values.CommandVersion(z.MultiChannel) >=
+                          _MULTI_CHANNEL_BIT_ADDRESSING_VERSION)
+        for key, values in commands:
+            targets = [e for e in endpoints
+                       if self.EndpointValues(e).HasCommandClass(key[0])]
+            if not targets:
+                continue
+            # bit addressing is only allowed for Set type commands,
+            # queries go to each endpoint separately
+            multicast = bit_addressing and command.ReportForGet(key) is None
+            self._translator.SendEndpointCommand(self.n, targets, key, values,
+                                                 priority, xmit, multicast)
+
     def BatchCommandSubmitFilteredSlow(self, commands, xmit):
         self.BatchCommandSubmitFiltered(commands, zmessage.NodePriorityLo(self.n), xmit)
 
@@ -521,13 +1190,36 @@ class Node:
     #            self.n, xmit, driver.GetCallbackId())
     #        driver.Send(cmd, handler, "WakeUpIntervalCapabilitiesGet")
 
+    def PlanVersionProbes(self, force=False):
+        """Returns the supported classes whose version needs to be queried.
+
+        Versions which can be inferred are recorded right away: nodes without
+        the Version class only implement version 1 of everything and some
+        classes only exist in version 1. Already known versions (e.g. restored
+        from a NodeCache) are not queried again unless `force` is set.
+        """
+        supported = self._supported or set(self.values.Classes())
+        infer_all = z.Version not in supported
+        out = []
+        for cls in list(self.values.Classes()):
+            if cls not in supported or cls == z.Mark:
+                continue
+            if not force and self.values.CommandVersion(cls) != _NO_VERSION["version"]:
+                continue
+            if infer_all or cls in _SINGLE_VERSION_CLASSES:
+                self.values.SetMapEntry(0.0, z.Version_CommandClassReport, cls,
+                                        {"class": cls, "version": 1})
+                continue
+            out.append(cls)
+        return out
+
     def RefreshCommandVersions(self, classes):
         self.BatchCommandSubmitFilteredSlow(_CommandVersionQueries(classes),
                                             XMIT_OPTIONS)
 
     def RefreshAllCommandVersions(self):
         logging.warning("[%d] RefreshAllCommandVersions", self.n)
-        self.RefreshCommandVersions(range(255))
+        self.RefreshCommandVersions(self.PlanVersionProbes(force=True))
 
     def RefreshAllSceneActuatorConfigurations(self):
         # append 0 to set current scene at very end
@@ -535,11 +1227,75 @@ class Node:
             _SceneActuatorConfiguration(list(range(1, 256)) + [0]),  XMIT_OPTIONS)
 
     def RefreshAllParameters(self):
-        logging.warning("[%d] RefreshAllParameter", self.n)
-        c = [(z.Configuration_Get, {"parameter": p})
-             for p in range(255)]
+        """Discovers the configuration parameters and their values.
+
+        Nodes supporting Configuration properties are asked to enumerate
+        their parameters. Otherwise the parameters previously seen for the
+        same product are queried - only unknown products get a full scan.
+        """
+        if self.values.CommandVersion(z.Configuration) >= _CONFIGURATION_PROPERTIES_VERSION:
+            logging.warning("[%d] RefreshAllParameter via properties", self.n)
+            # parameter 0 yields the first parameter
+            c = [(z.Configuration_PropertiesGet, {"parameter": 0})]
+            self._parameter_scan = _ParameterScan(True)
+        else:
+            params = None
+            if self.catalog and self.values.HasValue(z.ManufacturerSpecific_Report):
+                params = self.catalog.Get(self.values.ProductInfo())
+            if params is None:
+                logging.warning("[%d] RefreshAllParameter via full scan", self.n)
+                params = range(1, 256)
+                self._parameter_scan = _ParameterScan(False)
+            else:
+                logging.warning("[%d] RefreshAllParameter for %d known params", self.n, len(params))
+                # nothing new to learn
+                self._parameter_scan = None
+            c = [(z.Configuration_Get, {"parameter": p}) for p in params]
+        self.BatchCommandSubmitFilteredSlow(c, XMIT_OPTIONS)
+
+    def _ContinueParameterDiscovery(self, values):
+        scan = self._parameter_scan
+        if scan is None or not scan.properties:
+            logging.warning("[%d] ignoring properties outside of a scan", self.n)
+            return
+        p = values["parameter"]
+        nxt = values["next"]
+        if p in scan.visited:
+            return
+        scan.visited.add(p)
+        c = []
+        # Configuration_Get cannot address parameters beyond 255
+        if values["properties"]["size"] != 0 and 0 < p < 256:
+            c.append((z.Configuration_Get, {"parameter": p}))
+            self._LearnParameter(p)
+        if nxt == 0:
+            self._FinishParameterScan(True)
+        elif nxt <= p or nxt in scan.visited:
+            # the parameters must be enumerated in ascending order
+            logging.error("[%d] bad next parameter %d after %d", self.n, nxt, p)
+            self._FinishParameterScan(False)
+        else:
+            c.append((z.Configuration_PropertiesGet, {"parameter": nxt}))
         self.BatchCommandSubmitFilteredSlow(c, XMIT_OPTIONS)
 
+    def _LearnParameter(self, parameter):
+        # reports outside of a scan may cover just some of the parameters
+        scan = self._parameter_scan
+        if scan is None:
+            return
+        scan.seen.add(parameter)
+        scan.last_progress = time.time()
+
+    def _FinishParameterScan(self, complete):
+        """Hands the parameters of a complete scan to the catalog"""
+        scan = self._parameter_scan
+        self._parameter_scan = None
+        if not complete:
+            logging.warning("[%d] parameter scan stalled", self.n)
+            return
+        if scan.seen and self.catalog and self.values.HasValue(z.ManufacturerSpecific_Report):
+            self.catalog.Learn(self.values.ProductInfo(), scan.seen)
+
     def SetConfigValue(self, param, size, val, request_update=True):
         c = [(z.Configuration_Set, {"parameter": param,
                                     "value": {"size": size, "value": val}})]
@@ -593,25 +1349,62 @@ class Node:
              (z.Association_Get, {"group": group})]
         self.BatchCommandSubmitFilteredFast(c, XMIT_OPTIONS)
 
+    def DynamicQueries(self):
+        """Returns the Get commands for all dynamic values (not filtered by class)"""
+        return (_DYNAMIC_PROPERTY_QUERIES +
+                _SensorMultiLevelQueries(self.values.SensorSupported()) +
+                _MeterQueries(self.values.MeterSupported()) +
+                _ColorQueries(self.values.ColorSwitchSupported()))
+
     def RefreshDynamicValues(self):
         logging.warning("[%d] RefreshDynamic", self.n)
+        self.BatchCommandSubmitFilteredSlow(self.DynamicQueries(), XMIT_OPTIONS)
+        self.RefreshEndpointValues()
+
+    def RefreshEndpointValues(self):
+        if not self.endpoints:
+            return
+        logging.warning("[%d] RefreshEndpoints %s", self.n, list(self.endpoints))
         c = (_DYNAMIC_PROPERTY_QUERIES +
-             _SensorMultiLevelQueries(self.values.SensorSupported()) +
-             _MeterQueries(self.values.MeterSupported()) +
-             _ColorQueries(self.values.ColorSwitchSupported()))
-        self.BatchCommandSubmitFilteredSlow(c, XMIT_OPTIONS)
+             _SensorMultiLevelQueries(()) +
+             _MeterQueries())
+        self.BatchCommandSubmitEndpoints(sorted(self.endpoints), c,
+                                         zmessage.NodePriorityLo(self.n), XMIT_OPTIONS)
 
     def RefreshStaticValues(self):
         logging.warning("[%d] RefreshStatic", self.n)
         c = (_STATIC_PROPERTY_QUERIES +
-             _CommandVersionQueries(self.values.Classes()))
+             _CommandVersionQueries(self.PlanVersionProbes()) +
+             [(z.ManufacturerSpecific_Get, {})])
+        # the node is interviewed once all the answers are in
+        self._outstanding = {}
+        self._answered = {}
+        self._Expect(c)
+        self.BatchCommandSubmitFilteredSlow(c, XMIT_OPTIONS)
+        if self.state != NODE_STATE_DISCOVERED:
+            return
+        if self._outstanding:
+            if self.scheduler is None:
+                self._ArmDeadline()
+        else:
+            # nothing to wait for
+            self.MaybeChangeState(NODE_STATE_INTERVIEWED)
+
+    def MissingStaticQueries(self):
+        """Returns the interview queries which have not been answered yet"""
+        return [c for _, queries in self._outstanding.values() for c in queries]
 
+    def _SendMissingStaticQueries(self):
+        c = self.MissingStaticQueries()
+        logging.warning("[%d] requesting %d missing static values", self.n, len(c))
         self.BatchCommandSubmitFilteredSlow(c, XMIT_OPTIONS)
 
-        # This must be last as we use this as an indicator for the
-        # NODE_STATE_INTERVIEWED
-        last = (z.ManufacturerSpecific_Get, {})
-        self.BatchCommandSubmitFilteredSlow([last], XMIT_OPTIONS)
+    def ResumeInterview(self):
+        """Like RefreshStaticValues() but only the missing values are requested"""
+        self._SendMissingStaticQueries()
+        # a pending deadline keeps counting its retries
+        if self.state == NODE_STATE_DISCOVERED and self.scheduler is None and self.deadline is None:
+            self._ArmDeadline()
 
     def RefreshSemiStaticValues(self):
         logging.warning("[%d] RefreshSemiStatic", self.n)
@@ -631,11 +1424,35 @@ class Node:
             if old_state < new_state and self.values.HasCommandClass(z.Security):
                 pass
             # self._InitializeSecurity()
-            self.RefreshStaticValues()
+            if self.scheduler:
+                self.scheduler.Request(self)
+            else:
+                self.RefreshStaticValues()
         elif new_state == NODE_STATE_INTERVIEWED:
+            if self.scheduler:
+                self.scheduler.Done(self)
             self.RefreshDynamicValues()
             self.RefreshSemiStaticValues()
 
+    def _InitializeEndpoint(self, ts, values):
+        endpoint = values["endpoint"] & 0x7f
+        logging.warning("[%d] found multichannel endpoint %d", self.n, endpoint)
+        ep_values = self.EndpointValues(endpoint)
+        for cls in values["classes"]:
+            if cls == z.Mark:
+                break
+            if not ep_values.HasCommandClass(cls):
+                ep_values.SetMapEntry(ts, z.Version_CommandClassReport, cls, _NO_VERSION)
+
+    def put_endpoint(self, endpoint, ts, key, values):
+        self.last_contact = ts
+        ep_values = self.EndpointValues(endpoint)
+        key_ex = _COMMANDS_WITH_MAP_VALUES.get(key)
+        if key_ex:
+            ep_values.SetMapEntry(ts, key, key_ex(values), values)
+        else:
+            ep_values.Set(ts, key, values)
+
     def put(self, ts, key, values):
         self.last_contact = ts
 
@@ -650,8 +1467,12 @@ class Node:
         if self.state < NODE_STATE_DISCOVERED and not command.IsCustom(key):
             self._translator.Ping(self.n, 3, False, "undiscovered")
 
+        if key == z.ManufacturerSpecific_Report and self.stale:
+            if not self._HandleRevalidation(values):
+                return
+
         if key == z.MultiChannel_CapabilityReport:
-            logging.warning("FOUND MULTICHANNEL ENDPOINT: %s", values)
+            self._InitializeEndpoint(ts, values)
 
         special = _COMMANDS_WITH_SPECIAL_ACTIONS.get(key)
         if special:
@@ -663,6 +1484,22 @@ class Node:
         else:
             self.values.Set(ts, key, values)
 
+        if self._outstanding:
+            self._Answered(key, values)
+
+        if self._queries:
+            self._ResolveQueries(key, values)
+
+        if self.history is not None:
+            self.history.Add(ts, key, key_ex(values) if key_ex else None, values)
+
+        for sub in self._subscriptions.get(key, ()):
+            sub.Check(ts, key_ex(values) if key_ex else None, values)
+
+        if key == z.ManufacturerSpecific_Report:
+            # enables product specific quirks
+            self._translator.SetProductInfo(self.n, self.values.ProductInfo())
+
         # elif a == command.ACTION_STORE_SCENE:
         #    if value[0] == 0:
         #        # TODO
@@ -681,6 +1518,255 @@ class Node:
         return
 
 
+INTERVIEW_WAITING = "waiting"
+INTERVIEW_ACTIVE = "active"
+INTERVIEW_BACKOFF = "backoff"
+INTERVIEW_DONE = "done"
+
+
+def _InterviewPriority(node: Node):
+    # mains powered nodes answer right away, FLiRS nodes after a beam,
+    # battery nodes only after they wake up
+    if node.IsListening():
+        return 0
+    if node.IsFrequentlyListening():
+        return 1
+    return 2
+
+
+class InterviewScheduler(object):
+    """Limits the number of nodes whose static interview is in progress.
+
+    Nodes are queued when they become NODE_STATE_DISCOVERED. Battery powered
+    nodes are only interviewed while no listening node is pending. Interviews which do not
+    complete within `timeout` secs are retried with exponential backoff so
+    that they stop occupying one of the `max_active` slots.
+    Tick() should be called periodically to detect stuck interviews.
+    """
+
+    def __init__(self, max_active=2, timeout=60.0, max_backoff=900.0, clock=time.time):
+        self._max_active = max_active
+        self._timeout = timeout
+        self._max_backoff = max_backoff
+        self._clock = clock
+        self._lock = threading.Lock()
+        # n -> Node
+        self._nodes = {}
+        # n -> INTERVIEW_XXX
+        self._status = {}
+        # n -> start time of the current attempt or earliest time of the next
+        self._time = {}
+        self._attempts = {}
+        # n -> secs it took to complete the interview
+        self.durations = {}
+
+    def Request(self, node: Node):
+        with self._lock:
+            if self._status.get(node.n) in (INTERVIEW_WAITING, INTERVIEW_ACTIVE):
+                return
+            self._nodes[node.n] = node
+            self._status[node.n] = INTERVIEW_WAITING
+            self._time[node.n] = self._clock()
+            self._attempts.setdefault(node.n, 0)
+        self.Tick()
+
+    def Done(self, node: Node):
+        with self._lock:
+            if self._status.get(node.n) == INTERVIEW_ACTIVE:
+                self.durations[node.n] = self._clock() - self._time[node.n]
+            if node.n in self._status:
+                self._status[node.n] = INTERVIEW_DONE
+        self.Tick()
+
+    def _Backoff(self, n):
+        return min(self._max_backoff, self._timeout * (2 ** self._attempts[n]))
+
+    def _NextToStart(self, now):
+        # lower priority nodes only start once no higher priority one is pending
+        best = min([_InterviewPriority(self._nodes[n]) for n, status in self._status.items()
+                    if status in (INTERVIEW_WAITING, INTERVIEW_ACTIVE)], default=None)
+        candidates = [(_InterviewPriority(self._nodes[n]), self._attempts[n], n)
+                      for n, status in self._status.items()
+                      if status == INTERVIEW_WAITING or
+                      status == INTERVIEW_BACKOFF and self._time[n] <= now]
+        return [n for p, _, n in sorted(candidates) if best is None or p <= best]
+
+    def Tick(self):
+        """Retires stuck interviews and starts new ones if there is capacity"""
+        to_start = []
+        with self._lock:
+            now = self._clock()
+            active = 0
+            for n, status in self._status.items():
+                if status != INTERVIEW_ACTIVE:
+                    continue
+                if now - self._time[n] < self._timeout:
+                    active += 1
+                    continue
+                self._attempts[n] += 1
+                logging.warning("[%d] interview stuck - attempt %d", n, self._attempts[n])
+                self._status[n] = INTERVIEW_BACKOFF
+                self._time[n] = now + self._Backoff(n)
+            for n in self._NextToStart(now)[:max(0, self._max_active - active)]:
+                self._status[n] = INTERVIEW_ACTIVE
+                self._time[n] = now
+                to_start.append((self._nodes[n], self._attempts[n]))
+        for node, attempts in to_start:
+            # retries only ask for what is still missing
+            if attempts:
+                node.ResumeInterview()
+            else:
+                node.RefreshStaticValues()
+
+    def Progress(self):
+        """Returns n -> (status, attempts, percentage of interview answers received)"""
+        with self._lock:
+            return {n: (status, self._attempts[n], self._nodes[n].InterviewCompletion())
+                    for n, status in self._status.items()}
+
+    def __str__(self):
+        out = []
+        for n, (status, attempts, progress) in sorted(self.Progress().items()):
+            out.append("[%d] %-8s attempts: %d  progress: %3.0f%%" % (
+                n, status, attempts, progress))
+        return "\n".join(out)
+
+
+# report key -> secs after which a value is stale and polled again.
+# Reports missing here are never polled.
+DEFAULT_POLL_TTLS = {
+    z.Basic_Report: 900.0,
+    z.SwitchBinary_Report: 900.0,
+    z.SwitchMultilevel_Report: 900.0,
+    z.ColorSwitch_Report: 900.0,
+    z.SensorBinary_Report: 900.0,
+    z.SensorMultilevel_Report: 300.0,
+    z.Meter_Report: 300.0,
+    z.Alarm_Report: 1800.0,
+    z.Lock_Report: 900.0,
+    z.DoorLock_Report: 900.0,
+    z.ThermostatMode_Report: 1800.0,
+    z.Battery_Report: 6 * 3600.0,
+}
+
+
+class DynamicPoller(object):
+    """Periodically re-queries the dynamic values of the interviewed nodes of a Nodeset.
+
+    Every (node, report) pair is polled once its value is older than the
+    report's ttl. Values that were updated by other means, e.g. unsolicited
+    reports, are therefore not polled. Schedules are jittered by +/- `jitter`
+    of the ttl to avoid bursts and all polling shares a budget of
+    `frames_per_minute` Get commands (a node's queries for one report are
+    never split, larger groups overdraw the budget). Nodes which are not listening
+    (battery powered) are skipped - they report on their own when they wake up.
+
+    Tick() should be called periodically (every few seconds).
+    """
+
+    def __init__(self, nodeset, ttls=None, frames_per_minute=20, jitter=0.1,
+                 clock=time.time, rng=None):
+        self._nodeset = nodeset
+        self._ttls = DEFAULT_POLL_TTLS if ttls is None else ttls
+        self._frames_per_minute = frames_per_minute
+        self._jitter = jitter
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        # (n, report key) -> time the value should be checked next
+        self._due = {}
+        # token bucket for the frame budget
+        self._tokens = float(frames_per_minute)
+        self._refill_time = clock()
+        self.frames = 0
+        self.skipped_fresh = 0
+        self.deferred = 0
+
+    def _Jittered(self, ttl):
+        return ttl * self._rng.uniform(1.0 - self._jitter, 1.0 + self._jitter)
+
+    def _Refill(self, now):
+        rate = self._frames_per_minute / 60.0
+        self._tokens = min(float(self._frames_per_minute),
+                           self._tokens + (now - self._refill_time) * rate)
+        self._refill_time = now
+
+    def _PollGroups(self, node: Node):
+        """Returns report key -> Get commands for the values of the node worth polling"""
+        groups = {}
+        for key, args in node.DynamicQueries():
+            if not node.values.HasCommandClass(key[0]):
+                continue
+            report = command.ReportForGet(key)
+            if report in self._ttls:
+                groups.setdefault(report, []).append((key, args))
+        return groups
+
+    def _Candidates(self):
+        nodeset = self._nodeset
+        nodes = (nodeset.NodesInState(NODE_STATE_INTERVIEWED) -
+                 nodeset.SleepingNodes())
+        out = {}
+        for n in nodes:
+            node = nodeset.nodes.get(n)
+            if node is None or node.is_controller:
+                continue
+            for report, commands in self._PollGroups(node).items():
+                out[(n, report)] = node, commands
+        return out
+
+    def PollNow(self, n):
+        """Makes the values of node n due (they are still skipped if fresh)"""
+        with self._lock:
+            now = self._clock()
+            for key in self._due:
+                if key[0] == n:
+                    self._due[key] = now
+
+    def Tick(self):
+        """Polls the stale values as far as the budget allows"""
+        to_send = []
+        with self._lock:
+            now = self._clock()
+            self._Refill(now)
+            candidates = self._Candidates()
+            for key in list(self._due):
+                if key not in candidates:
+                    del self._due[key]
+            for key, (node, _) in candidates.items():
+                if key not in self._due:
+                    # spread the first polls of new values over one ttl
+                    ts = node.values.Timestamp(key[1])
+                    ttl = self._ttls[key[1]]
+                    self._due[key] = (now + self._rng.uniform(0, ttl) if ts is None
+                                      else ts + self._Jittered(ttl))
+            for due, key in sorted((due, key) for key, due in self._due.items()):
+                if due > now:
+                    break
+                node, commands = candidates[key]
+                ttl = self._ttls[key[1]]
+                ts = node.values.Timestamp(key[1])
+                if ts is not None and now - ts < ttl:
+                    self.skipped_fresh += 1
+                    self._due[key] = ts + self._Jittered(ttl)
+                    continue
+                # groups larger than the bucket go out once it is full and
+                # overdraw it - the debt is paid back before anything else is sent
+                if self._tokens < min(len(commands), self._frames_per_minute):
+                    self.deferred += 1
+                    break
+                self._tokens -= len(commands)
+                self.frames += len(commands)
+                self._due[key] = now + self._Jittered(ttl)
+                to_send.append((node, commands))
+        for node, commands in to_send:
+            node.BatchCommandSubmitFilteredSlow(commands, XMIT_OPTIONS)
+
+    def __str__(self):
+        return "frames: %d  skipped(fresh): %d  deferred: %d  scheduled: %d" % (
+            self.frames, self.skipped_fresh, self.deferred, len(self._due))
+
+
 class Nodeset(object):
     """NodeSet represents the collection of all nodes in the network.
 
@@ -689,24 +1775,145 @@ class Nodeset(object):
 
     It is not involved in outgoing messages which have to be sent directly to the
     CommandTranslator.
+
+    An optional InterviewScheduler throttles the static interviews of its nodes.
+
+    It also maintains indexes so that nodes can be selected by command class,
+    device type, state and listening flag without scanning all nodes
+    (see NodesWithClass() and friends). All of them return fresh sets
+    which can be combined with set operations.
     """
 
-    def __init__(self, translator: command_translator.CommandTranslator, controller_n):
+    def __init__(self, translator: command_translator.CommandTranslator, controller_n,
+                 scheduler: InterviewScheduler = None, history_capacity=0):
         self._controller_n = controller_n
         self._translator = translator
+        self.scheduler = scheduler
+        self.catalog = ParameterCatalog()
+        self._change_listeners = []
+        # if non zero every node keeps this many readings per sensor/meter
+        self._history_capacity = history_capacity
         self.nodes: Mapping[int: Node] = {}
+        self._index_lock = threading.Lock()
+        # command class -> nodes
+        self._by_class = {}
+        # generic and (generic, specific) -> nodes
+        self._by_type = {}
+        # state -> nodes
+        self._by_state = {}
+        self._listening = set()
+        self._sleeping = set()
         translator.AddListener(self)
 
+    def _UpdateIndexes(self, change: ValueChange):
+        n = change.n
+        if change.key == z.Version_CommandClassReport:
+            nodes = self._by_class.setdefault(change.subkey, set())
+            if change.new["version"] != 0:
+                nodes.add(n)
+            else:
+                nodes.discard(n)
+        elif change.key == command.CUSTOM_COMMAND_PROTOCOL_INFO:
+            self._DropFromDeviceIndexes(n)
+            _, generic, specific = change.new["device_type"]
+            self._by_type.setdefault(generic, set()).add(n)
+            self._by_type.setdefault((generic, specific), set()).add(n)
+            if "listening" in change.new["flags"]:
+                self._listening.add(n)
+            else:
+                self._sleeping.add(n)
+
+    def _DropFromDeviceIndexes(self, n):
+        for nodes in self._by_type.values():
+            nodes.discard(n)
+        self._listening.discard(n)
+        self._sleeping.discard(n)
+
+    def _IndexState(self, node: Node, old_state, new_state):
+        with self._index_lock:
+            if old_state is not None:
+                self._by_state[old_state].discard(node.n)
+            self._by_state.setdefault(new_state, set()).add(node.n)
+            if new_state == NODE_STATE_NONE and old_state is not None:
+                # the node was reset and its values discarded
+                for nodes in self._by_class.values():
+                    nodes.discard(node.n)
+                self._DropFromDeviceIndexes(node.n)
+
+    def NodesWithClass(self, cls):
+        with self._index_lock:
+            return set(self._by_class.get(cls, ()))
+
+    def NodesWithDeviceType(self, generic, specific=None):
+        key = generic if specific is None else (generic, specific)
+        with self._index_lock:
+            return set(self._by_type.get(key, ()))
+
+    def NodesInState(self, state):
+        with self._index_lock:
+            return set(self._by_state.get(state, ()))
+
+    def ListeningNodes(self):
+        with self._index_lock:
+            return set(self._listening)
+
+    def SleepingNodes(self):
+        """Nodes known not to be listening, i.e. usually battery powered"""
+        with self._index_lock:
+            return set(self._sleeping)
+
+    def AddChangeListener(self, l):
+        """l.put_change(change) will be called with a ValueChange whenever a
+        value of any node changes"""
+        self._change_listeners.append(l)
+
+    def _NotifyChange(self, change: ValueChange):
+        if change.endpoint == 0:
+            with self._index_lock:
+                self._UpdateIndexes(change)
+        for l in self._change_listeners:
+            l.put_change(change)
+
     def DropNode(self, n):
         del self.nodes[n]
+        with self._index_lock:
+            for index in (self._by_class, self._by_state):
+                for nodes in index.values():
+                    nodes.discard(n)
+            self._DropFromDeviceIndexes(n)
+
+    def CheckDeadlines(self, now=None):
+        """Should be called periodically so that nodes stuck in a state retry
+        the missing queries (see Node.CheckDeadline())"""
+        if now is None:
+            now = time.time()
+        for node in list(self.nodes.values()):
+            node.CheckDeadline(now)
+
+    def Subscribe(self, n, key, listener, subkey=None, deadband=None, thresholds=()):
+        """Only readings of node n which qualify are passed to listener.put()
+        (see Subscription)"""
+        return self.GetNode(n).Subscribe(key, listener, subkey, deadband, thresholds)
+
+    def Unsubscribe(self, sub: Subscription):
+        node = self.nodes.get(sub.n)
+        if node:
+            node.Unsubscribe(sub)
 
     def GetNode(self, n) -> Node:
         node = self.nodes.get(n)
         if node is None:
-            node = Node(n, self._translator, n == self._controller_n)
+            node = Node(n, self._translator, n == self._controller_n, self.scheduler,
+                        self.catalog, self._NotifyChange, self._IndexState)
+            if self._history_capacity:
+                node.EnableHistory(self._history_capacity)
             self.nodes[n] = node
         return node
 
     def put(self, n, ts, key, values):
         node = self.GetNode(n)
         node.put(ts, key, values)
+
+    def put_endpoint(self, n, endpoint, ts, key, values):
+        node = self.GetNode(n)
+        node.put_endpoint(endpoint, ts, key, values)
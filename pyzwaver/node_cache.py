@@ -0,0 +1,88 @@
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+"""
+node_cache.py persists the results of node interviews so that a restart
+does not have to repeat the (slow) static interview of every node.
+"""
+
+import logging
+import shelve
+
+from pyzwaver import node
+
+# bump whenever the snapshot format changes - older entries are ignored
+CACHE_FORMAT_VERSION = 2
+
+
+class NodeCache(object):
+    """Shelve backed store of Node.CacheSnapshot()s keyed by home id and node id.
+    It also keeps the Nodeset's ParameterCatalog which is not network specific.
+
+    Restored nodes are marked stale and should be revalidated
+    (see Node.Revalidate()) - if the node reports a different product the
+    cached values are discarded and the node is interviewed again.
+    """
+
+    def __init__(self, path, home_id):
+        self._home_id = home_id
+        self._shelf = shelve.open(path)
+
+    def _Key(self, n):
+        return "%08x:%d" % (self._home_id, n)
+
+    def Save(self, n: node.Node):
+        if n.state < node.NODE_STATE_INTERVIEWED:
+            return
+        self._shelf[self._Key(n.n)] = (CACHE_FORMAT_VERSION, n.CacheSnapshot())
+
+    def SaveAll(self, nodeset: node.Nodeset):
+        for n in nodeset.nodes.values():
+            self.Save(n)
+        self.SaveCatalog(nodeset.catalog)
+        self._shelf.sync()
+
+    def Drop(self, n):
+        key = self._Key(n)
+        if key in self._shelf:
+            del self._shelf[key]
+
+    def SaveCatalog(self, catalog: node.ParameterCatalog):
+        self._shelf["parameters"] = (CACHE_FORMAT_VERSION, catalog.Export())
+
+    def RestoreCatalog(self, catalog: node.ParameterCatalog):
+        entry = self._shelf.get("parameters")
+        if entry is not None and entry[0] == CACHE_FORMAT_VERSION:
+            catalog.Import(entry[1])
+
+    def Restore(self, nodeset: node.Nodeset, node_ids):
+        """Restores the given nodes and returns the ids of those found in the cache"""
+        self.RestoreCatalog(nodeset.catalog)
+        out = []
+        for n in node_ids:
+            entry = self._shelf.get(self._Key(n))
+            if entry is None:
+                continue
+            version, snapshot = entry
+            if version != CACHE_FORMAT_VERSION:
+                logging.warning("[%d] ignoring cache entry with format %d", n, version)
+                continue
+            nodeset.GetNode(n).RestoreFromCache(snapshot)
+            out.append(n)
+        return out
+
+    def Close(self):
+        self._shelf.close()
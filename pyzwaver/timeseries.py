@@ -0,0 +1,181 @@
+# Copyright 2016 Robert Muth <robert@muth.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+
+"""
+timeseries.py keeps a bounded history of numeric sensor/meter readings
+in flat array('d') buffers so that short trends can be evaluated in memory.
+"""
+
+from array import array
+
+from pyzwaver import zwave as z
+
+
+def _Level(values):
+    return values["level"]
+
+
+def _Reading(values):
+    return values["value"]["_value"]
+
+
+# report key -> extraction of the numeric value
+# (mirrors NodeValues.Sensors(), Meters() and MiscSensors())
+_NUMERIC_READINGS = {
+    z.SensorMultilevel_Report: _Reading,
+    z.Meter_Report: _Reading,
+    z.SwitchMultilevel_Report: _Level,
+    z.SwitchBinary_Report: _Level,
+    z.Battery_Report: _Level,
+}
+
+
+def NumericReading(key, values):
+    """Returns the numeric value of a sensor/meter/level report as a float or None"""
+    extract = _NUMERIC_READINGS.get(key)
+    if extract is None:
+        return None
+    try:
+        return float(extract(values))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RingBuffer(object):
+    """Fixed capacity buffer of (timestamp, value) pairs.
+
+    Timestamps are expected to be non decreasing. Once full the oldest
+    samples are overwritten.
+    """
+
+    def __init__(self, capacity):
+        assert capacity > 0
+        self._capacity = capacity
+        self._ts = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        # physical index of the oldest sample
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def Add(self, ts, v):
+        end = (self._start + self._count) % self._capacity
+        self._ts[end] = ts
+        self._values[end] = v
+        if self._count < self._capacity:
+            self._count += 1
+        else:
+            self._start = (self._start + 1) % self._capacity
+
+    def Last(self):
+        """Returns the most recent (ts, value) or None"""
+        if self._count == 0:
+            return None
+        i = (self._start + self._count - 1) % self._capacity
+        return self._ts[i], self._values[i]
+
+    def _LowerBound(self, ts):
+        """Returns the logical index of the first sample with a timestamp >= ts"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[(self._start + mid) % self._capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _Range(self, start, end):
+        """Returns the logical index range covering [start, end)"""
+        first = 0 if start is None else self._LowerBound(start)
+        last = self._count if end is None else self._LowerBound(end)
+        return first, max(first, last)
+
+    def _Slice(self, data, first, last):
+        a = (self._start + first) % self._capacity
+        b = (self._start + last) % self._capacity
+        if first == last:
+            return array('d')
+        if a < b:
+            return data[a:b]
+        return data[a:] + data[:b]
+
+    def Window(self, start=None, end=None):
+        """Returns the timestamps and values in [start, end) as two array('d')"""
+        first, last = self._Range(start, end)
+        return self._Slice(self._ts, first, last), self._Slice(self._values, first, last)
+
+    def Stats(self, start=None, end=None):
+        """Returns (count, min, max, mean) of the values in [start, end) or None"""
+        first, last = self._Range(start, end)
+        if first == last:
+            return None
+        values = self._Slice(self._values, first, last)
+        return len(values), min(values), max(values), sum(values) / len(values)
+
+    def Downsample(self, bucket_secs, start=None, end=None):
+        """Returns [(bucket_start, count, min, max, mean), ...] for the
+        non empty buckets of width bucket_secs in [start, end)"""
+        ts, values = self.Window(start, end)
+        out = []
+        i = 0
+        while i < len(ts):
+            bucket = ts[i] - ts[i] % bucket_secs
+            limit = bucket + bucket_secs
+            lo = hi = total = values[i]
+            j = i + 1
+            while j < len(ts) and ts[j] < limit:
+                v = values[j]
+                if v < lo:
+                    lo = v
+                if v > hi:
+                    hi = v
+                total += v
+                j += 1
+            out.append((bucket, j - i, lo, hi, total / (j - i)))
+            i = j
+        return out
+
+
+class NodeHistory(object):
+    """Ring buffers for the numeric readings of a single node.
+
+    Readings are keyed like the NodeValues: (report key, subkey) where
+    subkey is e.g. (type, unit) for sensors and meters and None otherwise.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._buffers = {}
+
+    def Add(self, ts, key, subkey, values):
+        v = NumericReading(key, values)
+        if v is None:
+            return
+        buf = self._buffers.get((key, subkey))
+        if buf is None:
+            buf = RingBuffer(self._capacity)
+            self._buffers[(key, subkey)] = buf
+        buf.Add(ts, v)
+
+    def Get(self, key, subkey=None) -> RingBuffer:
+        """Returns the RingBuffer for the reading or None"""
+        return self._buffers.get((key, subkey))
+
+    def Keys(self):
+        return list(self._buffers.keys())
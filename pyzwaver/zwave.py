@@ -594,6 +594,8 @@ UserCode_NumberReport = (0x63, 0x05)
 Configuration_Set = (0x70, 0x04)
 Configuration_Get = (0x70, 0x05)
 Configuration_Report = (0x70, 0x06)
+Configuration_PropertiesGet = (0x70, 0x0e)
+Configuration_PropertiesReport = (0x70, 0x0f)
 Alarm_Get = (0x71, 0x04)
 Alarm_Report = (0x71, 0x05)
 Alarm_Set = (0x71, 0x06)
@@ -652,6 +654,7 @@ Indicator_Report = (0x87, 0x03)
 TimeParameters_Set = (0x8b, 0x01)
 TimeParameters_Get = (0x8b, 0x02)
 TimeParameters_Report = (0x8b, 0x03)
+MultiCmd_Encap = (0x8f, 0x01)
 Security_SupportedGet = (0x98, 0x02)
 Security_SupportedReport = (0x98, 0x03)
 Security_SchemeGet = (0x98, 0x04)
@@ -765,6 +768,8 @@ SUBCMD_TO_STRING = {
     0x7004: 'Configuration_Set',
     0x7005: 'Configuration_Get',
     0x7006: 'Configuration_Report',
+    0x700e: 'Configuration_PropertiesGet',
+    0x700f: 'Configuration_PropertiesReport',
     0x7104: 'Alarm_Get',
     0x7105: 'Alarm_Report',
     0x7106: 'Alarm_Set',
@@ -823,6 +828,7 @@ SUBCMD_TO_STRING = {
     0x8b01: 'TimeParameters_Set',
     0x8b02: 'TimeParameters_Get',
     0x8b03: 'TimeParameters_Report',
+    0x8f01: 'MultiCmd_Encap',
     0x9802: 'Security_SupportedGet',
     0x9803: 'Security_SupportedReport',
     0x9804: 'Security_SchemeGet',
@@ -1021,7 +1027,7 @@ SUBCMD_TO_PARSE_TABLE = {
     0x600a: ['B{endpoint}', 'B{generic}', 'B{specific}', 'L{classes}'],  # CapabilityReport (10)
     0x600b: [],  # ChannelEndPointFind (11)
     0x600c: [],  # ChannelEndPointFindReport (12)
-    0x600d: [],  # ChannelEncap (13)
+    0x600d: ['B{src}', 'B{dst}', 'L{command}'],  # ChannelEncap (13)
 
     # DoorLock (0x62 = 98)
     0x6201: ['B{status}'],  # Set (1)
@@ -1042,6 +1048,8 @@ SUBCMD_TO_PARSE_TABLE = {
     0x7004: ['B{parameter}', 'V{value}'],  # Set (4)
     0x7005: ['B{parameter}'],  # Get (5)
     0x7006: ['B{parameter}', 'V{value}'],  # Report (6)
+    0x700e: ['W{parameter}'],  # PropertiesGet (14)
+    0x700f: ['W{parameter}', 'P{properties}', 'W{next}'],  # PropertiesReport (15)
 
     # Alarm (0x71 = 113)
     0x7104: [],  # Get (4)
@@ -1105,7 +1113,7 @@ SUBCMD_TO_PARSE_TABLE = {
     0x8407: [],  # Notification (7)
     0x8408: [],  # NoMoreInformation (8)
     0x8409: [],  # IntervalCapabilitiesGet (9)
-    0x840a: ['3{XXX}', '3{XXX}', '3{XXX}', '3{XXX}'],  # IntervalCapabilitiesReport (10)
+    0x840a: ['3{min}', '3{max}', '3{default}', '3{step}'],  # IntervalCapabilitiesReport (10)
 
     # Association (0x85 = 133)
     0x8501: ['B{group}', 'L{nodes}'],  # Set (1)
@@ -1131,6 +1139,9 @@ SUBCMD_TO_PARSE_TABLE = {
     0x8b02: [],  # Get (2)
     0x8b03: ['C{date}'],  # Report (3)
 
+    # MultiCmd (0x8f = 143)
+    0x8f01: ['E{commands}'],  # Encap (1)
+
     # Security (0x98 = 152)
     0x9802: [],  # SupportedGet (2)
     0x9803: ['B{mode}', 'L{command}'],  # SupportedReport (3)